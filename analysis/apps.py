@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class AnalysisConfig(AppConfig):
     name = 'analysis'
+
+    def ready(self):
+        # connect signals that keep the poly/ artefact filters up to date
+        from . import signals
@@ -156,6 +156,7 @@ class SampleCommentForm(forms.Form):
 
         super(SampleCommentForm, self).__init__(*args, **kwargs)
         self.helper = FormHelper()
+        self.helper.form_class = 'analysis-update-form'
         self.fields['sample_comment'].initial = self.comment
         self.fields['patient_demographics'].initial = self.info_check
         self.fields['pk'].initial = self.pk
@@ -180,6 +181,7 @@ class VariantCommentForm(forms.Form):
 
         super(VariantCommentForm, self).__init__(*args, **kwargs)
         self.helper = FormHelper()
+        self.helper.form_class = 'analysis-update-form'
         self.fields['variant_comment'].initial = self.comment
         self.fields['pk'].initial = self.pk
         self.helper.add_input(Submit('submit', 'Update', css_class='btn btn-success'))
@@ -209,6 +211,7 @@ class FusionCommentForm(forms.Form):
 
         super(FusionCommentForm, self).__init__(*args, **kwargs)
         self.helper = FormHelper()
+        self.helper.form_class = 'analysis-update-form'
         self.fields['fusion_comment'].initial = self.comment
         self.fields['hgvs'].initial = self.hgvs
         self.fields['pk'].initial = self.pk
@@ -255,6 +258,7 @@ class CoverageCheckForm(forms.Form):
 
         super(CoverageCheckForm, self).__init__(*args, **kwargs)
         self.helper = FormHelper()
+        self.helper.form_class = 'analysis-update-form'
         self.fields['coverage_comment'].initial = self.comment
         self.fields['ntc_checked'].initial = self.ntc
         self.fields['pk'].initial = self.pk
@@ -276,6 +280,7 @@ class ManualVariantCheckForm(forms.Form):
 
         super(ManualVariantCheckForm, self).__init__(*args, **kwargs)
         self.helper = FormHelper()
+        self.helper.form_class = 'analysis-update-form'
         self.helper.layout = Layout()
 
         # loop through regions and make a checkbox for each
@@ -521,4 +526,76 @@ class SelfAuditSubmission(forms.Form):
         )
         self.helper.add_input(
             Submit('download_submit', 'Download', css_class='btn btn-success')
-        )
\ No newline at end of file
+        )
+
+
+class WorksheetFilterForm(forms.Form):
+    """
+    Filter the list of all worksheets by assay, type and upload date
+
+    """
+    # worksheets are saved with the assay name used by the import script, e.g. TSO500_DNA
+    ASSAY_CHOICES = [('', 'All assays')] + [(a.replace(' ', '_'), a) for _, a in Panel.ASSAY_CHOICES]
+    TYPE_CHOICES = (
+        ('', 'All worksheets'),
+        ('diagnostic', 'Diagnostic'),
+        ('training', 'Training/ validation'),
+    )
+    assay = forms.ChoiceField(choices=ASSAY_CHOICES, required=False)
+    worksheet_type = forms.ChoiceField(choices=TYPE_CHOICES, required=False, label='Type')
+    start_date = forms.DateField(required=False, label='Uploaded from', widget=forms.DateInput(attrs={'type': 'date'}))
+    end_date = forms.DateField(required=False, label='Uploaded to', widget=forms.DateInput(attrs={'type': 'date'}))
+
+    def __init__(self, *args, **kwargs):
+        super(WorksheetFilterForm, self).__init__(*args, **kwargs)
+        self.helper = FormHelper()
+        self.helper.form_method = 'GET'
+        self.helper.layout = Layout(
+            Div(
+                Field('assay', wrapper_class='col-md-3'),
+                Field('worksheet_type', wrapper_class='col-md-3'),
+                Field('start_date', wrapper_class='col-md-3'),
+                Field('end_date', wrapper_class='col-md-3'),
+                css_class='row'
+            ),
+        )
+        self.helper.add_input(
+            Submit('submit', 'Filter', css_class='btn btn-info')
+        )
+
+
+class VariantListFilterForm(forms.Form):
+    """
+    Filter the entries on a poly/ artefact list page, the table is reloaded in the background so the form isnt submitted
+
+    """
+    STATUS_CHOICES = (
+        ('confirmed', 'Confirmed'),
+        ('checking', 'Needs checking'),
+        ('', 'All'),
+    )
+    gene = forms.CharField(required=False, label='Gene')
+    chrm = forms.CharField(required=False, label='Chromosome')
+    upload_user = forms.CharField(required=False, label='Added by')
+    check_user = forms.CharField(required=False, label='Checked by')
+    status = forms.ChoiceField(choices=STATUS_CHOICES, required=False, initial='confirmed', label='Sign-off')
+
+    def __init__(self, *args, **kwargs):
+        super(VariantListFilterForm, self).__init__(*args, **kwargs)
+        self.helper = FormHelper()
+        self.helper.form_id = 'list-filter-form'
+        self.helper.form_method = 'GET'
+        self.fields['chrm'].widget.attrs['placeholder'] = 'e.g. 7'
+        self.helper.layout = Layout(
+            Div(
+                Field('gene', wrapper_class='col-md-2'),
+                Field('chrm', wrapper_class='col-md-2'),
+                Field('upload_user', wrapper_class='col-md-3'),
+                Field('check_user', wrapper_class='col-md-3'),
+                Field('status', wrapper_class='col-md-2'),
+                css_class='row'
+            ),
+        )
+        self.helper.add_input(
+            Submit('submit', 'Filter', css_class='btn btn-info')
+        )
@@ -0,0 +1,1144 @@
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.encoding import smart_text
+from django.contrib.contenttypes.models import ContentType
+from auditlog.models import LogEntry
+from auditlog.registry import auditlog
+
+from .models import *
+from .utils import PanelRegionIndex, update_sample_status, update_search_index, save_coverage_summary, get_variant_list_entries, get_list_filter, get_list_decision, get_fusion_artefacts
+
+import os
+import re
+import csv
+import json
+import time
+import hashlib
+import resource
+import contextlib
+import numpy as np
+from datetime import datetime
+
+
+# number of rows sent to the database in each INSERT statement during import
+IMPORT_BATCH_SIZE = 500
+
+
+def can_return_bulk_pks():
+    """
+    Whether the database sets primary keys on objects made with bulk_create
+    Postgres (live database) does, sqlite (local dev) doesnt
+    (setting was renamed between Django versions so check both names)
+
+    """
+    features = connection.features
+    return getattr(features, 'can_return_rows_from_bulk_insert', False) or \
+        getattr(features, 'can_return_ids_from_bulk_insert', False)
+
+
+def sync_foreign_keys(objs):
+    """
+    Copy the primary key of each linked object into its foreign key column. Objects are built before
+    the objects they link to are saved, so the foreign key column is still empty at this point
+
+    """
+    for obj in objs:
+        for field in obj._meta.concrete_fields:
+            if field.is_relation and field.is_cached(obj):
+                related_obj = getattr(obj, field.name)
+                if related_obj is not None and getattr(obj, field.attname) is None:
+                    setattr(obj, field.attname, related_obj.pk)
+
+
+def log_bulk_create(model, objs):
+    """
+    Add the auditlog entries that saving each object one at a time would have made, as bulk inserts dont send the
+    save signals that auditlog uses. Only models registered with auditlog are logged, objects must have their pks set
+
+    The changes are made from the foreign key columns rather than the linked objects, so no queries are needed to
+    load them (auditlog would show the linked object instead of its pk)
+
+    """
+    if len(objs) == 0 or not auditlog.contains(model):
+        return
+
+    content_type = ContentType.objects.get_for_model(model)
+    log_entries = []
+    for obj in objs:
+        # same format as auditlog, a list of the old and new value for each field that has a value
+        changes = {}
+        for field in model._meta.concrete_fields:
+            value = getattr(obj, field.attname)
+            if value is not None:
+                changes[field.name] = ['None', smart_text(value)]
+
+        log_entries.append(LogEntry(
+            content_type=content_type,
+            object_pk=smart_text(obj.pk),
+            object_id=obj.pk if isinstance(obj.pk, int) else None,
+            object_repr=smart_text(obj),
+            action=LogEntry.Action.CREATE,
+            changes=json.dumps(changes),
+        ))
+
+    LogEntry.objects.bulk_create(log_entries, batch_size=IMPORT_BATCH_SIZE)
+
+
+def bulk_insert(model, objs, batch_size=IMPORT_BATCH_SIZE, return_pks=False):
+    """
+    Write a list of unsaved objects to the database in chunks of batch_size rows
+
+    Set return_pks if other objects will link to these ones, if the database cant return primary
+    keys from a bulk insert then the objects are saved one at a time instead (local dev only)
+
+    Bulk inserts dont send save signals, so auditlog entries are added by log_bulk_create. The pks are
+    needed for these, so they're always returned for models registered with auditlog
+
+    """
+    if len(objs) == 0:
+        return objs
+
+    sync_foreign_keys(objs)
+
+    if auditlog.contains(model):
+        return_pks = True
+
+    # saving one at a time sends the save signals, so auditlog adds the log entries itself
+    if return_pks and not can_return_bulk_pks():
+        for obj in objs:
+            obj.save()
+        return objs
+
+    objs = model.objects.bulk_create(objs, batch_size=batch_size)
+    log_bulk_create(model, objs)
+    return objs
+
+
+def get_or_create_in_bulk(model, key_fields, keys, **shared_fields):
+    """
+    Get the objects matching a list of keys, making any that arent in the database yet. Takes a list of
+    tuples with a value for each of key_fields, plus any fields that are the same for all objects (e.g. genome build)
+
+    Looks up all keys at once (in chunks of IMPORT_BATCH_SIZE) rather than a get_or_create for each key. The
+    model needs a unique constraint on the key/ shared fields, if another import has added some of the same
+    objects in the meantime then they're skipped when inserting and picked up by the second lookup
+
+    Returns a dictionary of key: object
+
+    """
+    wanted_keys = set(keys)
+    keys = list(wanted_keys)
+    objs = {}
+
+    def lookup(keys_to_get):
+        for n in range(0, len(keys_to_get), IMPORT_BATCH_SIZE):
+            chunk = keys_to_get[n:n + IMPORT_BATCH_SIZE]
+
+            # filter on first key field only, any extra matches are dropped when checking the full key
+            filter_values = {f'{key_fields[0]}__in': set(k[0] for k in chunk)}
+            for obj in model.objects.filter(**shared_fields, **filter_values):
+                key = tuple(getattr(obj, f) for f in key_fields)
+                if key in wanted_keys:
+                    objs[key] = obj
+
+    lookup(keys)
+
+    # make any that are missing, then get them again as bulk_create with ignore_conflicts wont return the pks
+    missing = [k for k in keys if k not in objs]
+    if missing:
+        model.objects.bulk_create(
+            [model(**dict(zip(key_fields, k)), **shared_fields) for k in missing],
+            batch_size=IMPORT_BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+        lookup(missing)
+
+        # pks arent set by bulk_create with ignore_conflicts, so log the new objects once they've been looked up
+        log_bulk_create(model, [objs[k] for k in missing if k in objs])
+
+    return objs
+
+
+def get_peak_rss_mb():
+    """
+    Highest memory use (resident set size) of this process so far, in MB. Linux reports this in KB
+
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class ImportMetrics:
+    """
+    Records how long each stage of an import takes, how many database queries it sends and how many rows it
+    handles, so that a slow import can be tracked down from the logs. Time and queries are added to whichever
+    stage is running, a stage started inside another stage pauses the outer one so nothing is counted twice
+
+    Memory is recorded as how much the peak memory use of the process went up while each stage was running,
+    stages that fit in memory that's already been used by an earlier stage will show no increase
+
+    Stages can be entered more than once (e.g. gaps are saved in batches) and their values are added up
+
+    """
+    def __init__(self, **info):
+        # extra values saved with the metrics, e.g. sample and panel names
+        self.info = info
+        self.stages = {}
+        self.current_stage = None
+        self.stage_start = None
+        self.stage_start_rss = None
+
+    def __call__(self, execute, sql, params, many, context):
+        """ count queries against the current stage, used with connection.execute_wrapper """
+        if self.current_stage is not None:
+            self.stages[self.current_stage]['queries'] += 1
+        return execute(sql, params, many, context)
+
+    def get_stage(self, name):
+        """ get the values for a stage, adding it if it hasnt been seen yet """
+        if name not in self.stages:
+            self.stages[name] = {'seconds': 0, 'queries': 0, 'peak_rss_increase_mb': 0, 'rows': {}}
+        return self.stages[name]
+
+    def switch_stage(self, name):
+        """ add the time and memory increase since the last switch to the current stage and move on to the next one """
+        now = time.perf_counter()
+        peak_rss = get_peak_rss_mb()
+        if self.current_stage is not None:
+            self.stages[self.current_stage]['seconds'] += now - self.stage_start
+            self.stages[self.current_stage]['peak_rss_increase_mb'] += peak_rss - self.stage_start_rss
+        self.current_stage = name
+        self.stage_start = now
+        self.stage_start_rss = peak_rss
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """ time and count queries for the code inside the with block """
+        self.get_stage(name)
+        outer_stage = self.current_stage
+
+        with contextlib.ExitStack() as stack:
+            # only need to wrap the connection once for nested stages
+            if outer_stage is None:
+                stack.enter_context(connection.execute_wrapper(self))
+
+            self.switch_stage(name)
+            try:
+                yield self
+            finally:
+                self.switch_stage(outer_stage)
+
+    def add_rows(self, stage, row_type, count):
+        """ add to the number of rows of a type handled in a stage """
+        rows = self.get_stage(stage)['rows']
+        rows[row_type] = rows.get(row_type, 0) + count
+
+    def as_dict(self):
+        """ all values for the import, with totals across all stages """
+        return {
+            **self.info,
+            'seconds': round(sum(s['seconds'] for s in self.stages.values()), 3),
+            'queries': sum(s['queries'] for s in self.stages.values()),
+            'stages': {
+                name: {**s, 'seconds': round(s['seconds'], 3), 'peak_rss_increase_mb': round(s['peak_rss_increase_mb'], 1)}
+                for name, s in self.stages.items()
+            },
+        }
+
+    def log(self, metrics_file=None):
+        """ print metrics as a single JSON line, and add to the end of the metrics file if given """
+        line = json.dumps(self.as_dict())
+        print(line)
+        if metrics_file:
+            with open(metrics_file, 'a') as f:
+                f.write(line + '\n')
+
+
+def iter_coverage_json(coverage_file, chunk_size=65536):
+    """
+    Read a coverage JSON file one gene at a time, yields the gene name and a dictionary of coverage values for
+    that gene. Only one gene is held in memory at once, rather than loading the whole file with json.load
+
+    The file is read in chunks and each gene is decoded once the whole record has been read in. The chunk size
+    goes up to the size of the current buffer, so large records dont need to be decoded many times
+
+    """
+    decoder = json.JSONDecoder()
+
+    with open(coverage_file, 'r') as f:
+        buffer, pos, end_of_file = '', 0, False
+
+        def read_more():
+            """ drop the part of the buffer that's already been used and add the next chunk of the file """
+            nonlocal buffer, pos, end_of_file
+            chunk = f.read(max(chunk_size, len(buffer) - pos))
+            if chunk == '':
+                end_of_file = True
+            buffer = buffer[pos:] + chunk
+            pos = 0
+
+        def next_token():
+            """ skip any whitespace, then return the next character without using it up, empty string at end of file """
+            nonlocal pos
+            while True:
+                while pos < len(buffer) and buffer[pos] in ' \t\n\r':
+                    pos += 1
+                if pos < len(buffer) or end_of_file:
+                    return buffer[pos:pos + 1]
+                read_more()
+
+        def decode():
+            """ decode the string or object at the current position, reading more of the file until it's complete """
+            nonlocal pos
+            while True:
+                try:
+                    value, pos = decoder.raw_decode(buffer, pos)
+                    return value
+                except json.JSONDecodeError:
+                    if end_of_file:
+                        raise
+                    read_more()
+
+        # file is an object with a record for each gene
+        if next_token() != '{':
+            raise ValueError(f'{coverage_file} is not a JSON object')
+        pos += 1
+
+        while True:
+            token = next_token()
+            if token == '}':
+                return
+            elif token == ',':
+                pos += 1
+                continue
+            elif token != '"':
+                raise ValueError(f'{coverage_file} is not a valid coverage JSON')
+
+            gene = decode()
+            if next_token() != ':':
+                raise ValueError(f'{coverage_file} is not a valid coverage JSON')
+            pos += 1
+            next_token()
+            values = decode()
+
+            yield gene, values
+
+
+def make_gene_coverage(gene, values, coverage_thresholds):
+    """
+    Make unsaved coverage objects for one gene record from the coverage JSON, regions and gaps can be in
+    either the list or dictionary format (any in an unknown format are skipped). The sample isnt set here, it's
+    added by write_sample
+
+    Returns the gene coverage object and lists of region and gap objects that link to it
+
+    """
+    # get the coverage values, if they're missing default to none
+    new_gene_coverage_obj = GeneCoverageAnalysis(
+        gene_id=gene,
+        av_coverage=values['average_depth'],
+        percent_135x=values.get('percent_135', None),
+        percent_270x=values.get('percent_270', None),
+        percent_500x=values.get('percent_500', None),
+        percent_1000x=values.get('percent_1000', None),
+        av_ntc_coverage=values['average_ntc'],
+        percent_ntc=values['percent_ntc'],
+    )
+    new_region_objs = []
+    new_gap_objs = []
+
+    # genescreen region
+    for r in values.get('genescreen_regions', []):
+        new_region_objs.append(make_region(r, 'G', new_gene_coverage_obj))
+
+    # hotspot regions
+    if 'hotspot_regions' in values:
+        for r in values['hotspot_regions']:
+            new_region_objs.append(make_region(r, 'H', new_gene_coverage_obj))
+
+        # gaps at each of the coverage thresholds in the panel
+        for cutoff in ['135', '270', '500', '1000']:
+            if cutoff in coverage_thresholds:
+                for gap in values[f'gaps_{cutoff}']:
+                    new_gap_objs.append(make_gap(gap, cutoff, new_gene_coverage_obj))
+
+    # skip any regions or gaps in a format that isnt recognised
+    new_region_objs = [r for r in new_region_objs if r is not None]
+    new_gap_objs = [g for g in new_gap_objs if g is not None]
+
+    return new_gene_coverage_obj, new_region_objs, new_gap_objs
+
+
+def save_coverage(gene_coverage_objs, region_objs, gap_objs, metrics=None):
+    """
+    Save a batch of coverage objects made by make_gene_coverage, gaps are counted as a separate stage in the metrics
+
+    """
+    if metrics is None:
+        metrics = ImportMetrics()
+
+    with metrics.stage('coverage'):
+        # make any genes that arent in the database yet
+        get_or_create_in_bulk(Gene, ('gene',), [(g.gene_id,) for g in gene_coverage_objs])
+
+        # save to db, gene level first so that their pks can be used in the regions and gaps
+        bulk_insert(GeneCoverageAnalysis, gene_coverage_objs, return_pks=True)
+        bulk_insert(RegionCoverageAnalysis, region_objs)
+
+        metrics.add_rows('coverage', 'genes', len(gene_coverage_objs))
+        metrics.add_rows('coverage', 'regions', len(region_objs))
+
+    with metrics.stage('gaps'):
+        bulk_insert(GapsAnalysis, gap_objs)
+
+        metrics.add_rows('gaps', 'gaps', len(gap_objs))
+
+
+def make_gap_from_list(gap, cutoff, gene_coverage_obj):
+    """
+    Make an unsaved gap object from a gap in the coverage JSON that is formatted as a list
+    TODO remove when coverage2json updated
+
+    """
+    #if there is no cosmic percent or count present, make this 0 (so adding two numbers to the list)
+    if len(gap) < 6:
+        gap.append(None)
+        gap.append(None)
+
+    #if cosmic percent is NaN (because no cosmic annotations for that referral), make it 0 (html displays NA in these cases)
+    if gap[6] is not None:
+        if np.isnan(gap[6]):
+            gap[6] = None
+
+    return GapsAnalysis(
+        gene = gene_coverage_obj,
+        hgvs_c = gap[3],
+        chr_start = gap[0],
+        pos_start = gap[1],
+        chr_end = gap[0],
+        pos_end = gap[2],
+        coverage_cutoff = cutoff,
+        percent_cosmic = gap[6],
+    )
+
+
+def make_gap_from_dict(gap, cutoff, gene_coverage_obj):
+    """
+    Make an unsaved gap object from a gap in the coverage JSON that is formatted as a dictionary
+
+    """
+    # handle weird inputs for COSMIC percent
+    if 'percent_cosmic' not in gap.keys():
+        perc_cosmic = None
+    elif gap['percent_cosmic'] == 'N/A':
+        perc_cosmic = None
+    elif np.isnan(gap['percent_cosmic']):
+        perc_cosmic = None
+    else:
+        perc_cosmic = gap['percent_cosmic']
+
+    # handle weird inputs for COSMIC counts
+    if 'counts_cosmic' not in gap.keys():
+        counts_cosmic = None
+    elif gap['counts_cosmic'] == 'N/A':
+        counts_cosmic = None
+    elif np.isnan(gap['counts_cosmic']):
+        counts_cosmic = None
+    else:
+        counts_cosmic = gap['counts_cosmic']
+
+    return GapsAnalysis(
+        gene = gene_coverage_obj,
+        hgvs_c = gap['hgvs_c'],
+        chr_start = gap['chr'],
+        pos_start = gap['pos_start'],
+        chr_end = gap['chr'],
+        pos_end = gap['pos_end'],
+        coverage_cutoff = cutoff,
+        percent_cosmic = perc_cosmic,
+        counts_cosmic = counts_cosmic,
+    )
+
+
+def make_region_from_list(region, hotspot, gene_coverage_obj):
+    """
+    Make an unsaved region object (e.g. exons or codons) from a region in the coverage JSON that is formatted as a list
+    TODO remove this when coverage2json updated
+
+    """
+    return RegionCoverageAnalysis(
+        gene = gene_coverage_obj,
+        hgvs_c = region[3],
+        chr_start = region[0],
+        pos_start = region[1],
+        chr_end = region[0],
+        pos_end = region[2],
+        hotspot = hotspot,
+        average_coverage = region[4],
+        percent_135x = region[6],
+        percent_270x = region[5],
+        ntc_coverage = region[7],
+        percent_ntc = region[8],
+    )
+
+
+def make_region_from_dict(region, hotspot, gene_coverage_obj):
+    """
+    Make an unsaved region object (e.g. exons or codons) from a region in the coverage JSON that is formatted as a dictionary
+
+    """
+    return RegionCoverageAnalysis(
+        gene = gene_coverage_obj,
+        hgvs_c = region['hgvs_c'],
+        chr_start = region['chr'],
+        pos_start = region['pos_start'],
+        chr_end = region['chr'],
+        pos_end = region['pos_end'],
+        hotspot = hotspot,
+        average_coverage = region['average_coverage'],
+        percent_135x = region.get('percent_135', None),
+        percent_270x = region.get('percent_270', None),
+        percent_500x = region.get('percent_500', None),
+        percent_1000x = region.get('percent_1000', None),
+        ntc_coverage = region['ntc_coverage'],
+        percent_ntc = region['percent_ntc'],
+    )
+
+
+def make_region(region, hotspot, gene_coverage_obj):
+    """
+    Make a region object from either format of region in the coverage JSON, returns None for unknown formats
+
+    """
+    if isinstance(region, list):
+        return make_region_from_list(region, hotspot, gene_coverage_obj)
+    elif isinstance(region, dict):
+        return make_region_from_dict(region, hotspot, gene_coverage_obj)
+
+
+def make_gap(gap, cutoff, gene_coverage_obj):
+    """
+    Make a gap object from either format of gap in the coverage JSON, returns None for unknown formats
+
+    """
+    if isinstance(gap, list):
+        return make_gap_from_list(gap, cutoff, gene_coverage_obj)
+    elif isinstance(gap, dict):
+        return make_gap_from_dict(gap, cutoff, gene_coverage_obj)
+
+
+# assays that can be imported, and the code that they're saved as in the panel model
+ASSAY_CHOICES = {
+    'TSO500_DNA': '1',
+    'TSO500_RNA': '2',
+    'TSO500_ctDNA': '3',
+    'GeneRead_CRM': '4',
+    'GeneRead_BRCA': '5',
+}
+
+
+def read_samples_csv(samples_file, default_run=None):
+    """
+    Get the settings for each sample/ referral in a samples CSV, in the same format as used by scripts/upload.sh
+    Input files are expected to be in the same folder as the samples CSV, the run is taken from default_run if
+    it isnt in the CSV and the genome build defaults to GRCh37 (for older runs)
+
+    """
+    # input files are in the same folder as the samples file
+    data_folder = os.path.dirname(samples_file)
+
+    samples = []
+    with open(samples_file) as f:
+        for line in f:
+
+            # skip blank lines
+            line = line.strip()
+            if line == '':
+                continue
+
+            # get common variables, pad so that missing columns are empty
+            fields = line.split(',') + [''] * 8
+            sample_id, ws, assay, referral, run, genome = fields[0:6]
+            fusion_coverage = None
+
+            # DNA specific variables
+            if assay == 'DNA':
+                assay = 'TSO500_DNA'
+
+            # RNA specific variables - TODO-reorder in pipeline so that run and genome are the same order as DNA
+            if assay == 'RNA':
+                assay = 'TSO500_RNA'
+                fusion_coverage = f'{fields[4]},{fields[5]}'
+                run, genome = fields[6:8]
+
+            # check if run ID not given on sample list, take from command line (so old style upload will still work for older runs).
+            # If reference genome not given, make GRCh37 - again for old runs
+            if run == '':
+                run = default_run
+            if not run:
+                print(f'ERROR\t{datetime.now()}\timport.py\tNo run ID found for {sample_id}, exiting script')
+                raise IOError(f'No run ID found for {sample_id}')
+            if genome == '':
+                genome = 'GRCh37'
+
+            samples.append({
+                'sample': sample_id,
+                'ws': ws,
+                'assay': assay,
+                'panel': referral,
+                'run': run,
+                'genome': genome,
+                'snvs_file': os.path.join(data_folder, f'{sample_id}_variants.tsv'),
+                'coverage_file': os.path.join(data_folder, f'{sample_id}_{referral}_coverage.json'),
+                'fusions_file': os.path.join(data_folder, f'{sample_id}_fusion_check.csv'),
+                'fusion_coverage': fusion_coverage,
+            })
+
+    return samples
+
+
+def get_sample_panel(run_id, ws, assay, panel, genome):
+    """
+    Check the settings for a sample before it's imported and get the virtual panel that will be applied to it
+    Raises an IOError if any of the settings are wrong, returns the panel object and the genome build as a number
+
+    """
+    # check assay is in list
+    if assay not in ASSAY_CHOICES.keys():
+        print(f'ERROR\t{datetime.now()}\timport.py\tUnknown assay - {assay}')
+        raise IOError(f'ERROR\tUnknown assay - {assay}')
+
+    # check genome build is in list
+    if genome == 'GRCh38':
+        genome_build = 38
+    elif genome == 'GRCh37':
+        genome_build = 37
+    else:
+        raise IOError(f'Genome build {genome} is neither GRCh37 or GRCh38')
+
+    # check that worksheet not already uploaded with another sequencing run
+    exist_worksheets = Worksheet.objects.filter(ws_id = ws)
+
+    if len(exist_worksheets) != 0:
+        for worksheet in exist_worksheets:
+            if worksheet.run.run_id != run_id:
+                raise IOError(f'Worksheet {ws} uploaded already on another sequencing run {worksheet.run.run_id}. Please edit worksheet ID and try again e.g. {ws}R')
+
+    # get panel object
+    panel_obj = Panel.objects.get(panel_name=panel, assay=ASSAY_CHOICES[assay], live=True, genome_build=genome_build)
+
+    return panel_obj, genome_build
+
+
+# separators between the partner genes in a fusion name e.g. GENE1--GENE2, GENE1/GENE2 or GENE1-GENE2;GENE3
+# a single hyphen is also used as a separator, but can be part of a gene name too so is handled in get_partner_genes
+FUSION_GENE_SEPARATORS = re.compile(r'--|::|/|;')
+
+
+def get_partner_genes(fusion_name):
+    """
+    Get all the gene names that could be in a fusion name. Single hyphens can either separate genes or be part of a
+    gene name (e.g. NKX2-1), so every run of hyphen separated names is included e.g. NKX2-1-SFTA3 gives NKX2, 1,
+    SFTA3, NKX2-1, 1-SFTA3 and NKX2-1-SFTA3
+
+    """
+    partner_genes = set()
+    for part in FUSION_GENE_SEPARATORS.split(fusion_name):
+        names = part.strip().split('-')
+        for start in range(len(names)):
+            for end in range(start + 1, len(names) + 1):
+                partner_genes.add('-'.join(names[start:end]))
+
+    return partner_genes
+
+
+def get_panel_fusion_genes(panel_obj):
+    """
+    Get the splice and fusion genes in a virtual panel as sets, so that each fusion call can be checked against
+    them with a lookup rather than looping through the panel genes
+
+    """
+    # handle empty strings as they cant be split
+    splicing, fusions = set(), set()
+    if panel_obj.splice_genes:
+        splicing = set(g.strip() for g in panel_obj.splice_genes.split(','))
+    if panel_obj.fusion_genes:
+        fusions = set(g.strip() for g in panel_obj.fusion_genes.split(','))
+
+    return {
+        'splicing': splicing,
+        'fusions': fusions,
+    }
+
+
+def format_fusion_call(f, panel_genes):
+    """
+    Format the name of a call from the fusion CSV and check whether it's in the virtual panel, panel_genes is the
+    output of get_panel_fusion_genes. Gene fusions are in the panel if any of the partner genes are panel fusion
+    genes, splice variants are in the panel if the gene is a panel splice gene
+
+    Returns a tuple of the key used to find the fusion object, whether it's in the panel, and the original call
+
+    """
+    # sanitise the fusion input to prevent multiple fusions with the same breakpoints but different names
+    # we want to remove GENE1/GENE2 and GENE1--GENE2 and just have GENE1-GENE2
+    fusion_name = f['fusion']
+    sanitised_fusion_name = fusion_name.replace("/","-").replace("--","-")
+
+    # splice variants - add exon number to gene name
+    if f['type'] == 'Splice':
+        fusion = f"{sanitised_fusion_name} {f['exons']}"
+        in_panel = fusion_name in panel_genes['splicing']
+
+    # gene fusions - use pipeline output directly, split into partner genes to check against panel
+    else:
+        fusion = sanitised_fusion_name
+        partner_genes = get_partner_genes(fusion_name)
+        in_panel = f['type'] == 'Fusion' and not partner_genes.isdisjoint(panel_genes['fusions'])
+
+    fusion_key = (fusion, f['left_breakpoint'], f['right_breakpoint'])
+    return fusion_key, in_panel, f
+
+
+def read_sample_files(panel_obj, snvs_file=None, coverage_file=None, fusions_file=None):
+    """
+    Read and filter the input files for a sample, doesnt touch the database so that it can be run in a worker
+    process (see the import_worksheet command). Only the files that are used by the panel are read. The coverage
+    file is only checked here, it's read one gene at a time by write_sample to keep memory use down.
+
+    Returns a dictionary that is passed to write_sample
+
+    """
+    sample_data = {}
+
+    # ---------------------------------------------------------------------------------------------------------
+    # SNV and coverage files
+    # ---------------------------------------------------------------------------------------------------------
+    if panel_obj.show_snvs:
+
+        # check that inputs are valid
+        if snvs_file is None or not os.path.isfile(snvs_file):
+            print(f'ERROR\t{datetime.now()}\timport.py\t{snvs_file} file does not exist')
+            raise IOError(f'{snvs_file} file does not exist')
+        if coverage_file is None or not os.path.isfile(coverage_file):
+            print(f'ERROR\t{datetime.now()}\timport.py\t{coverage_file} file does not exist')
+            raise IOError(f'{coverage_file} file does not exist')
+
+        # get filepath for bed from panel model
+        panel_bed_file = panel_obj.bed_file.path
+        if not os.path.isfile(panel_bed_file):
+            print(f'ERROR\t{datetime.now()}\timport.py\t{panel_bed_file} file does not exist')
+            raise IOError(f'{panel_bed_file} file does not exist')
+
+        # load regions in bed file, this is only read once per process for each panel
+        panel_regions = PanelRegionIndex.load(panel_bed_file)
+
+        # pull cutoff from panel object
+        vaf_threshold = panel_obj.vaf_cutoff
+
+        # genomic coords of every variant in the file, and the variants that will go on the panel
+        all_variants = []
+        panel_variants = []
+
+        with open(snvs_file) as f:
+            reader = csv.DictReader(f, delimiter='\t')
+
+            for v in reader:
+
+                # format pos, chr, ref etc as genomic coords
+                genomic_coords = f"{v['chr'].strip('chr')}:{v['pos']}{v['ref']}>{v['alt']}"
+
+                # variant object is created for all variants across whole panel
+                all_variants.append(genomic_coords)
+
+                # determine whether or not VAF is above threshold
+                vaf = float(v['vaf']) * 100
+                above_vaf_threshold = (vaf >= vaf_threshold)
+
+                ## check if variant is within the virtual panel
+                # boolean if variant overlaps with panel, variant pos is converted to bed coordinates
+                overlaps_panel = panel_regions.overlaps(v['chr'].strip('chr'), int(v['pos']) - 1, int(v['pos']))
+
+                # if both booleans true, keep for upload
+                if overlaps_panel and above_vaf_threshold:
+                    panel_variants.append((genomic_coords, v))
+
+        sample_data['all_variants'] = all_variants
+        sample_data['panel_variants'] = panel_variants
+
+        # coverage json is already filtered for panel, it's streamed in while saving so isnt loaded here
+        sample_data['coverage_file'] = coverage_file
+
+        # get required coverage values from panel
+        sample_data['coverage_thresholds'] = panel_obj.depth_cutoffs.split(',')
+
+    # ---------------------------------------------------------------------------------------------------------
+    # Fusion file
+    # ---------------------------------------------------------------------------------------------------------
+    if panel_obj.show_fusions:
+
+        # check that inputs are valid
+        if fusions_file is None or not os.path.isfile(fusions_file):
+            print(f'ERROR\t{datetime.now()}\timport.py\t{fusions_file} file does not exist')
+            raise IOError(f'{fusions_file} file does not exist')
+
+        # load in fusion calls, format names and check which are in the panel
+        panel_genes = get_panel_fusion_genes(panel_obj)
+        with open(fusions_file) as f:
+            sample_data['fusion_calls'] = [
+                format_fusion_call(f, panel_genes) for f in csv.DictReader(f, delimiter=',')
+            ]
+
+    return sample_data
+
+
+def hash_input_files(panel_obj, snvs_file=None, coverage_file=None, fusions_file=None, fusion_coverage=None):
+    """
+    Make a hash of the contents of the input files that are used by the panel (and the fusion coverage values if
+    the panel shows them). This is saved with the sample analysis so that importing the same files again can be skipped
+
+    """
+    inputs = []
+    if panel_obj.show_snvs:
+        inputs += [snvs_file, coverage_file]
+    if panel_obj.show_fusions:
+        inputs += [fusions_file]
+
+    # hash each file separately, then combine them with the fusion coverage values
+    input_hash = hashlib.sha256()
+    for input_file in inputs:
+        file_hash = hashlib.sha256()
+        # missing files are picked up when the files are read
+        if input_file is not None and os.path.isfile(input_file):
+            with open(input_file, 'rb') as f:
+                for chunk in iter(lambda: f.read(1048576), b''):
+                    file_hash.update(chunk)
+        input_hash.update(file_hash.hexdigest().encode())
+
+    if panel_obj.show_fusion_coverage:
+        input_hash.update(str(fusion_coverage).encode())
+
+    return input_hash.hexdigest()
+
+
+def get_previous_import(ws, sample, panel_obj, input_hash):
+    """
+    Check whether a sample has already been imported onto a worksheet with the same panel
+
+    Returns a tuple of the previous sample analysis (or None if there isnt one) and whether it was imported
+    from the same input files. Raises an IOError if the input files have changed but the previous analysis
+    can't be replaced because checking has already started
+
+    """
+    previous_analysis = SampleAnalysis.objects.filter(
+        worksheet_id=ws, sample_id=sample, panel=panel_obj
+    ).order_by('pk').last()
+
+    if previous_analysis is None:
+        return None, False
+
+    if previous_analysis.input_hash == input_hash:
+        return previous_analysis, True
+
+    # only replace if no-one has started checking it, all checks should be pending and unassigned
+    if Check.objects.filter(analysis=previous_analysis).exclude(status='P', user=None).exists():
+        print(f'ERROR\t{datetime.now()}\timport.py\t{sample} {panel_obj} already imported on {ws} from different input files and checking has started')
+        raise IOError(f'{sample} {panel_obj} already imported on {ws} from different input files and checking has started, not replacing')
+
+    return previous_analysis, False
+
+
+def write_sample(run_id, ws, sample, assay, panel_obj, genome_build, sample_data, fusion_coverage=None, debug=False, input_hash=None, replace_analysis=None, metrics=None):
+    """
+    Save a sample to the database from the output of read_sample_files. Everything is written in one transaction
+    using bulk inserts so that the database is only locked for a short time, and nothing is saved if there's an error.
+    Coverage is read one gene at a time and saved in batches as it's read, so memory use doesnt depend on the size of the file
+
+    If the sample has been imported before from different input files, pass the previous sample analysis
+    as replace_analysis (see get_previous_import) and it will be removed in the same transaction
+
+    Time, queries and rows for each stage are added to metrics if an ImportMetrics object is passed in
+
+    Returns the new sample analysis object
+
+    """
+    # current time for upload timestamps
+    current_time = timezone.now()
+
+    if metrics is None:
+        metrics = ImportMetrics()
+
+    with transaction.atomic():
+
+        with metrics.stage('setup'):
+            # remove previous import, variant instances are linked to the sample so need removing separately
+            if replace_analysis is not None:
+                print(f'INFO\t{datetime.now()}\timport.py\tInput files have changed, replacing previous import of {sample} {panel_obj}')
+                VariantInstance.objects.filter(variantpanelanalysis__sample_analysis=replace_analysis).delete()
+                replace_analysis.delete()
+
+            # ---------------------------------------------------------------------------------------------------------
+            # Sample level objects
+            # ---------------------------------------------------------------------------------------------------------
+
+            # make run
+            new_run, created = Run.objects.get_or_create(run_id=run_id)
+
+            # make ws
+            new_ws, created = Worksheet.objects.get_or_create(
+                ws_id=ws,
+                run=new_run,
+                assay=assay,
+            )
+            # only add timestamp when worksheet is initially created (dont update when a new sample added)
+            if created:
+                new_ws.upload_time = current_time
+
+            new_ws.save()
+
+            # make samples
+            new_sample, created = Sample.objects.get_or_create(
+                sample_id=sample,
+            )
+
+            # make sample analysis and checks
+            new_sample_analysis = SampleAnalysis(
+                worksheet=new_ws,
+                sample=new_sample,
+                panel=panel_obj,
+                genome_build=genome_build,
+                upload_time=current_time,
+                input_hash=input_hash,
+            )
+            # add num reads if in panel settings
+            if panel_obj.show_fusion_coverage:
+
+                # split sample and NTC values and handle missing values
+                total_cov, ntc_cov = fusion_coverage.split(',')
+                if total_cov == 'NA':
+                    total_cov = 0
+                if ntc_cov == 'NA':
+                    ntc_cov = 0
+
+                # add to model
+                new_sample_analysis.total_reads = total_cov
+                new_sample_analysis.total_reads_ntc = ntc_cov
+
+            new_sample_analysis.save()
+
+            new_check = Check(
+                analysis=new_sample_analysis,
+                stage='IGV',
+                status='P',
+            )
+            new_check.save()
+            update_sample_status([new_sample_analysis.pk])
+            update_search_index(SampleAnalysis.objects.filter(pk=new_sample_analysis.pk))
+
+
+        # ---------------------------------------------------------------------------------------------------------
+        # SNVs and indels
+        # ---------------------------------------------------------------------------------------------------------
+        if panel_obj.show_snvs:
+
+            with metrics.stage('snvs'):
+                print(f'INFO\t{datetime.now()}\timport.py\tUploading SNVs...')
+
+                # variant object is created for all variants across whole panel, looked up/ made all at once
+                variant_objs = get_or_create_in_bulk(
+                    Variant, ('variant',), [(v,) for v in sample_data['all_variants']], genome_build=genome_build
+                )
+
+                # signed off poly/ artefact list entries, used to filter variants on the analysis sheet
+                list_entries = get_variant_list_entries(genome_build, panel_obj.assay)
+
+                # build instance, panel analysis and check objects for variants in the panel, these are saved in bulk below
+                new_var_instances = []
+                new_var_panel_analyses = []
+                new_var_checks = []
+
+                for genomic_coords, v in sample_data['panel_variants']:
+                    if debug:
+                        print(f'DEBUG\t{datetime.now()}\timport.py\tAdding variant: {v}')
+
+                    # if gnomad frequency not there, make it None
+                    if 'gnomad_popmax_AF' not in v:
+                        v['gnomad_popmax_AF'] = None
+
+                    if v['in_ntc'] == '':
+                        v['in_ntc'] = False
+
+                    # make new instance of variant
+                    new_var_instance = VariantInstance(
+                        sample = new_sample,
+                        variant = variant_objs[(genomic_coords,)],
+                        gene = v['gene'],
+                        exon = v['exon'],
+                        hgvs_c = v['hgvs_c'],
+                        hgvs_p = v['hgvs_p'],
+                        total_count = int(v['depth']),
+                        alt_count = int(v['alt_reads']),
+                        in_ntc = v['in_ntc'],
+                        gnomad_popmax = v['gnomad_popmax_AF'],
+                    )
+
+                    # For new database had to convert string to boolean
+                    if v['in_ntc'] == 'False':
+                        v['in_ntc'] = False
+
+                    # add NTC read counts if the variant is seen in the NTC
+                    if v['in_ntc']:
+                        new_var_instance.total_count_ntc = v['ntc_depth']
+                        new_var_instance.alt_count_ntc = v['ntc_alt_reads']
+
+                    # put on panel
+                    new_var_panel_analysis = VariantPanelAnalysis(
+                        sample_analysis = new_sample_analysis,
+                        variant_instance = new_var_instance,
+                    )
+
+                    # check if the variant is on a poly/ artefact list
+                    new_var_panel_analysis.list_filter, new_var_panel_analysis.list_filter_reason = get_list_filter(
+                        new_var_instance.vaf(), list_entries.get(genomic_coords, [])
+                    )
+
+                    # add check, polys and artefacts are classified automatically
+                    new_var_check = VariantCheck(
+                        variant_analysis=new_var_panel_analysis,
+                        check_object=new_check,
+                        decision=get_list_decision(new_var_panel_analysis),
+                    )
+
+                    new_var_instances.append(new_var_instance)
+                    new_var_panel_analyses.append(new_var_panel_analysis)
+                    new_var_checks.append(new_var_check)
+
+                # save to db, parent objects first so that their pks can be used in the linked objects
+                bulk_insert(VariantInstance, new_var_instances, return_pks=True)
+                bulk_insert(VariantPanelAnalysis, new_var_panel_analyses, return_pks=True)
+                bulk_insert(VariantCheck, new_var_checks)
+
+                metrics.add_rows('snvs', 'variants', len(variant_objs))
+                metrics.add_rows('snvs', 'variant_instances', len(new_var_instances))
+
+                # logging
+                print(f'INFO\t{datetime.now()}\timport.py\tFinished uploading SNVs successfully - added {len(new_var_instances)} variant(s)')
+                print(f'INFO\t{datetime.now()}\timport.py\tUploading coverage data...')
+
+
+            # ---------------------------------------------------------------------------------------------------------
+            # Coverage
+            # ---------------------------------------------------------------------------------------------------------
+
+            with metrics.stage('coverage'):
+                # read coverage json one gene at a time and save in batches, so memory use doesnt depend on the size of the file
+                new_gene_coverage_objs = []
+                new_region_objs = []
+                new_gap_objs = []
+
+                for g, values in iter_coverage_json(sample_data['coverage_file']):
+                    new_gene_coverage_obj, gene_region_objs, gene_gap_objs = make_gene_coverage(
+                        g, values, sample_data['coverage_thresholds']
+                    )
+                    new_gene_coverage_obj.sample = new_sample_analysis
+                    new_gene_coverage_objs.append(new_gene_coverage_obj)
+                    new_region_objs += gene_region_objs
+                    new_gap_objs += gene_gap_objs
+
+                    if len(new_region_objs) + len(new_gap_objs) >= IMPORT_BATCH_SIZE:
+                        save_coverage(new_gene_coverage_objs, new_region_objs, new_gap_objs, metrics)
+                        new_gene_coverage_objs, new_region_objs, new_gap_objs = [], [], []
+
+                # save anything left over from the last batch
+                save_coverage(new_gene_coverage_objs, new_region_objs, new_gap_objs, metrics)
+
+                # logging
+                print(f'INFO\t{datetime.now()}\timport.py\tFinished uploading coverage data successfully')
+
+            # coverage doesnt change after import, so work out the coverage tab once and save it with the sample
+            with metrics.stage('coverage_summary'):
+                save_coverage_summary(new_sample_analysis)
+
+
+        # ---------------------------------------------------------------------------------------------------------
+        # fusions
+        # ---------------------------------------------------------------------------------------------------------
+
+        if panel_obj.show_fusions:
+            with metrics.stage('fusions'):
+                print(f'INFO\t{datetime.now()}\timport.py\tUploading fusions...')
+                formatted_calls = sample_data['fusion_calls']
+
+                # add record for each fusion (regardless of whether it's in the panel or not), looked up/ made all at once
+                fusion_objs = get_or_create_in_bulk(
+                    Fusion,
+                    ('fusion_genes', 'left_breakpoint', 'right_breakpoint'),
+                    [fusion_key for fusion_key, in_panel, f in formatted_calls],
+                    genome_build=genome_build,
+                )
+
+                # pks of fusions on signed off artefact lists, these are classified automatically
+                fusion_artefacts = get_fusion_artefacts(genome_build, panel_obj.assay)
+
+                # build instance, panel analysis and check objects for fusions in the panel, these are saved in bulk below
+                new_fusion_instances = []
+                new_fusion_analyses = []
+                new_fusion_checks = []
+
+                for fusion_key, in_panel, f in formatted_calls:
+
+                    # only make a fusion instance if the fusion was in the panel
+                    if not in_panel:
+                        continue
+
+                    if debug:
+                        print(f'DEBUG\t{datetime.now()}\timport.py\tAdding fusion: {f}')
+
+                    # add fusion instance object
+                    new_fusion_instance = FusionAnalysis(
+                        sample = new_sample_analysis,
+                        fusion_genes = fusion_objs[fusion_key],
+                        fusion_supporting_reads = f['fusion_supporting_reads'],
+                        ref_reads_1 = f['reference_reads_1'],
+                        fusion_caller = f['type'],
+                        in_ntc = f['in_ntc'],
+                    )
+                    # some variables aren't always included in pipeline output (particularly for splice variants)
+                    if f['reference_reads_2'] not in ['', 'NA']:
+                        new_fusion_instance.ref_reads_2 = f['reference_reads_2']
+                    if f['fusion_score'] != '':
+                        new_fusion_instance.fusion_score = f['fusion_score']
+                    if f['split_reads'] != '':
+                        new_fusion_instance.split_reads = f['split_reads']
+                    if f['split_reads'] != '':
+                        new_fusion_instance.spanning_reads = f['spanning_reads']
+
+                    # set up virtual panel
+                    new_fusion_analysis = FusionPanelAnalysis(
+                        sample_analysis = new_sample_analysis,
+                        fusion_instance = new_fusion_instance,
+                    )
+
+                    # set up check object
+                    new_fusion_check = FusionCheck(
+                        fusion_analysis = new_fusion_analysis,
+                        check_object = new_check,
+                    )
+                    if fusion_objs[fusion_key].pk in fusion_artefacts:
+                        new_fusion_check.decision = 'A'
+
+                    new_fusion_instances.append(new_fusion_instance)
+                    new_fusion_analyses.append(new_fusion_analysis)
+                    new_fusion_checks.append(new_fusion_check)
+
+                # save to db, parent objects first so that their pks can be used in the linked objects
+                bulk_insert(FusionAnalysis, new_fusion_instances, return_pks=True)
+                bulk_insert(FusionPanelAnalysis, new_fusion_analyses, return_pks=True)
+                bulk_insert(FusionCheck, new_fusion_checks)
+
+                # logging
+                print(f'INFO\t{datetime.now()}\timport.py\tFinished uploading successfully - added {len(new_fusion_instances)} fusions(s)')
+
+                metrics.add_rows('fusions', 'fusion_calls', len(formatted_calls))
+                metrics.add_rows('fusions', 'fusion_instances', len(new_fusion_instances))
+
+    return new_sample_analysis
@@ -0,0 +1,137 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from analysis.import_utils import read_samples_csv, get_sample_panel, read_sample_files, write_sample, ImportMetrics, get_peak_rss_mb
+
+import io
+import os
+import time
+import textwrap
+import contextlib
+from argparse import RawTextHelpFormatter
+from datetime import datetime
+
+
+class Command(BaseCommand):
+    help = textwrap.dedent(
+    """
+    Time the import of each sample in a samples CSV, broken down into the stages of the import command:
+        setup            - check settings, get panel and make sample level objects
+        read             - read and filter input files
+        snvs             - save SNVs and indels
+        coverage         - read coverage JSON and save gene and region coverage
+        gaps             - save coverage gaps
+        coverage_summary - work out and save the coverage tab
+        fusions          - save fusions
+
+    Wall time, number of database queries and how much the peak memory use of the process went up
+    (peak_rss_increase_mb) are recorded for each stage. The peak memory use of the whole benchmark is
+    logged at the end. Test data can be made with the generate_import_data command.
+
+    Everything is rolled back at the end so the benchmark can be repeated, unless --keep is used.
+    Run against a copy of the Postgres database for results that match the live server, sqlite (local
+    dev) cant bulk insert objects that other objects link to, so saves these one at a time.
+    """)
+
+
+    def create_parser(self, *args, **kwargs):
+        """ edit class so that help text above wraps round lines """
+        parser = super(Command, self).create_parser(*args, **kwargs)
+        parser.formatter_class = RawTextHelpFormatter
+        return parser
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--samples', nargs=1, type=str, required=True, help='Path to samples CSV file')
+        parser.add_argument('--run', nargs=1, type=str, required=False, help='Run ID, only used if not in the samples CSV')
+        parser.add_argument('--output', nargs=1, type=str, required=False, help='Save results to this TSV file as well as printing them')
+        parser.add_argument('--keep', default=False, action='store_true', help='Keep the imported samples in the database')
+        parser.add_argument('--verbose', default=False, action='store_true', help='Show output from the import')
+
+
+    def handle(self, *args, **options):
+        """
+        Run benchmark
+
+        """
+        # extract variables from argparse
+        samples_file = options['samples'][0]
+        default_run = options['run'][0] if options['run'] else None
+
+        # check that inputs are valid
+        if not os.path.isfile(samples_file):
+            raise IOError(f'{samples_file} file does not exist')
+
+        samples = read_samples_csv(samples_file, default_run)
+        print(f'INFO\t{datetime.now()}\tbenchmark_import.py\tBenchmarking import of {len(samples)} sample(s) from {samples_file}')
+
+        results = []
+        failed = []
+        start_time = time.perf_counter()
+
+        # hide logging from import unless asked for
+        import_output = contextlib.nullcontext() if options['verbose'] else contextlib.redirect_stdout(io.StringIO())
+
+        with transaction.atomic(), import_output:
+            for s in samples:
+                metrics = ImportMetrics()
+                try:
+                    with metrics.stage('setup'):
+                        panel_obj, genome_build = get_sample_panel(s['run'], s['ws'], s['assay'], s['panel'], s['genome'])
+                    with metrics.stage('read'):
+                        sample_data = read_sample_files(panel_obj, s['snvs_file'], s['coverage_file'], s['fusions_file'])
+                    write_sample(
+                        s['run'], s['ws'], s['sample'], s['assay'], panel_obj, genome_build, sample_data,
+                        fusion_coverage = s['fusion_coverage'],
+                        metrics = metrics,
+                    )
+                except Exception as e:
+                    failed.append(f'{s["sample"]} {s["panel"]} - {e}')
+
+                # one row for each stage of the import, including failed ones up to the point they failed
+                for stage, stage_metrics in metrics.as_dict()['stages'].items():
+                    results.append({
+                        'sample': s['sample'],
+                        'panel': s['panel'],
+                        'stage': stage,
+                        'seconds': stage_metrics['seconds'],
+                        'queries': stage_metrics['queries'],
+                        'peak_rss_increase_mb': stage_metrics['peak_rss_increase_mb'],
+                    })
+
+            # undo the import so that the benchmark can be run again
+            if not options['keep']:
+                transaction.set_rollback(True)
+
+        total_time = round(time.perf_counter() - start_time, 3)
+
+        # totals for each stage across all samples, in the order the stages were first run
+        totals = []
+        for stage in dict.fromkeys(r['stage'] for r in results):
+            stage_results = [r for r in results if r['stage'] == stage]
+            totals.append({
+                'sample': 'total',
+                'panel': '',
+                'stage': stage,
+                'seconds': round(sum(r['seconds'] for r in stage_results), 3),
+                'queries': sum(r['queries'] for r in stage_results),
+                'peak_rss_increase_mb': round(sum(r['peak_rss_increase_mb'] for r in stage_results), 1),
+            })
+
+        # format as TSV, print and save if needed
+        columns = ['sample', 'panel', 'stage', 'seconds', 'queries', 'peak_rss_increase_mb']
+        lines = ['\t'.join(columns)]
+        for r in results + totals:
+            lines.append('\t'.join(str(r[c]) for c in columns))
+
+        print('\n'.join(lines))
+        if options['output']:
+            with open(options['output'][0], 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+
+        print(f'INFO\t{datetime.now()}\tbenchmark_import.py\tImported {len(samples) - len(failed)} sample(s) in {total_time}s, peak memory use {round(get_peak_rss_mb(), 1)}MB')
+
+        if failed:
+            for f in failed:
+                print(f'ERROR\t{datetime.now()}\tbenchmark_import.py\tFailed - {f}')
+            raise CommandError(f'{len(failed)} of {len(samples)} sample(s) failed to import')
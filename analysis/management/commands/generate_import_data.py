@@ -0,0 +1,294 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from analysis.models import *
+from analysis.import_utils import ASSAY_CHOICES
+
+import os
+import csv
+import json
+import random
+import textwrap
+from argparse import RawTextHelpFormatter
+from datetime import datetime
+
+
+# columns in the pipeline output files
+VARIANT_COLUMNS = [
+    'gene', 'chr', 'pos', 'ref', 'alt', 'vaf', 'depth', 'hgvs_p', 'hgvs_c', 'consequence', 'exon', 'alt_reads',
+    'in_ntc', 'ntc_vaf', 'ntc_depth', 'ntc_alt_reads', 'gnomad_popmax_AF',
+]
+FUSION_COLUMNS = [
+    'fusion', 'exons', 'reference_reads_1', 'reference_reads_2', 'fusion_supporting_reads', 'left_breakpoint',
+    'right_breakpoint', 'type', 'in_ntc', 'spanning_reads', 'spanning_reads_dedup', 'split_reads',
+    'split_reads_dedup', 'fusion_caller', 'fusion_score',
+]
+CHROMOSOMES = [str(c) for c in range(1, 23)] + ['X']
+BASES = 'ACGT'
+
+
+def read_bed_regions(bed_path):
+    """
+    Get a list of (chr, start, end) for each region in a BED file
+
+    """
+    regions = []
+    with open(bed_path) as f:
+        for line in f:
+            if line.strip() == '' or line.startswith(('#', 'track', 'browser')):
+                continue
+            fields = line.split('\t')
+            regions.append((fields[0], int(fields[1]), int(fields[2])))
+    return regions
+
+
+def make_variant_pool(num_variants, bed_regions, on_panel):
+    """
+    Make a list of random variants to pick each sample's variants from, so that some variants are seen in more
+    than one sample like in a real worksheet. A proportion of variants are placed within the panel BED regions
+
+    """
+    pool = {}
+    while len(pool) < num_variants:
+        if bed_regions and random.random() < on_panel:
+            chrom, start, end = random.choice(bed_regions)
+            pos = random.randint(start + 1, end)
+        else:
+            chrom, pos = random.choice(CHROMOSOMES), random.randint(1, 150000000)
+
+        ref = random.choice(BASES)
+        alt = random.choice(BASES.replace(ref, ''))
+        pool[f'{chrom}:{pos}{ref}>{alt}'] = (chrom, pos, ref, alt)
+
+    return list(pool.values())
+
+
+def make_variant_row(chrom, pos, ref, alt, n):
+    """
+    Make one line of a variants TSV for a variant
+
+    """
+    depth = random.randint(200, 2000)
+    vaf = round(random.uniform(0.01, 0.6), 4)
+    in_ntc = random.random() < 0.02
+    ntc_depth = random.randint(100, 1000)
+
+    return {
+        'gene': f'GENE{n % 500}',
+        'chr': f'chr{chrom}',
+        'pos': pos,
+        'ref': ref,
+        'alt': alt,
+        'vaf': vaf,
+        'depth': depth,
+        'hgvs_p': f'NP_{n:06d}.1:p.(Xaa{n}Yaa)',
+        'hgvs_c': f'NM_{n:06d}.1:c.{n}{ref}>{alt}',
+        'consequence': 'missense_variant',
+        'exon': f'{random.randint(1, 20)}/20',
+        'alt_reads': int(depth * vaf),
+        'in_ntc': in_ntc,
+        'ntc_vaf': 0.01 if in_ntc else '',
+        'ntc_depth': ntc_depth if in_ntc else '',
+        'ntc_alt_reads': int(ntc_depth * 0.01) if in_ntc else '',
+        'gnomad_popmax_AF': random.choice([-1.0, round(random.random() / 100, 6)]),
+    }
+
+
+def make_coverage_region(chrom, pos, hgvs_c):
+    """
+    Make a region in the dictionary format of the coverage JSON
+
+    """
+    return {
+        'chr': f'chr{chrom}',
+        'pos_start': pos,
+        'pos_end': pos + random.randint(20, 300),
+        'hgvs_c': hgvs_c,
+        'average_coverage': random.randint(100, 2000),
+        'percent_135': random.randint(80, 100),
+        'percent_270': random.randint(70, 100),
+        'percent_500': random.randint(50, 100),
+        'percent_1000': random.randint(20, 100),
+        'ntc_coverage': random.randint(0, 10),
+        'percent_ntc': random.randint(0, 2),
+    }
+
+
+def make_coverage_gap(chrom, pos, hgvs_c):
+    """
+    Make a gap in the dictionary format of the coverage JSON
+
+    """
+    return {
+        'chr': f'chr{chrom}',
+        'pos_start': pos,
+        'pos_end': pos + random.randint(1, 50),
+        'hgvs_c': hgvs_c,
+        'percent_cosmic': random.choice(['N/A', round(random.uniform(0, 5), 2)]),
+        'counts_cosmic': random.choice(['N/A', random.randint(0, 100)]),
+    }
+
+
+def make_coverage_json(num_genes):
+    """
+    Make the contents of a coverage JSON with a record for each gene
+
+    """
+    coverage = {}
+    for g in range(num_genes):
+        chrom, pos = random.choice(CHROMOSOMES), random.randint(1, 150000000)
+
+        # annotations are in the same format as the real coverage files e.g. GENE1(NM_000001.1):exon_1
+        transcript = f'GENE{g}(NM_{g:06d}.1)'
+        values = {
+            'average_depth': random.randint(100, 2000),
+            'percent_135': random.randint(80, 100),
+            'percent_270': random.randint(70, 100),
+            'percent_500': random.randint(50, 100),
+            'percent_1000': random.randint(20, 100),
+            'average_ntc': random.randint(0, 10),
+            'percent_ntc': random.randint(0, 2),
+            'genescreen_regions': [make_coverage_region(chrom, pos + r * 1000, f'{transcript}:exon_{r}') for r in range(random.randint(1, 6))],
+            'hotspot_regions': [make_coverage_region(chrom, pos + r * 500, f'{transcript}:codon_{r}') for r in range(random.randint(1, 3))],
+        }
+        for cutoff in ['135', '270', '500', '1000']:
+            values[f'gaps_{cutoff}'] = [make_coverage_gap(chrom, pos + r * 100, f'{transcript}:c.{r}_{r + 10}') for r in range(random.randint(0, 2))]
+
+        coverage[f'GENE{g}'] = values
+
+    return coverage
+
+
+def make_fusion_rows(num_fusions, panel_obj):
+    """
+    Make the lines of a fusion CSV, including some fusions and splice variants in the genes in the panel
+
+    """
+    fusion_genes = panel_obj.fusion_genes.split(',') if panel_obj.fusion_genes else []
+    splice_genes = panel_obj.splice_genes.split(',') if panel_obj.splice_genes else []
+
+    rows = []
+    for n in range(num_fusions):
+        chrom = random.choice(CHROMOSOMES)
+        row = {
+            'exons': '',
+            'reference_reads_1': random.randint(0, 1000),
+            'reference_reads_2': random.choice(['NA', random.randint(0, 1000)]),
+            'fusion_supporting_reads': random.randint(5, 500),
+            'left_breakpoint': f'chr{chrom}:{random.randint(1, 150000000)}',
+            'right_breakpoint': f'chr{chrom}:{random.randint(1, 150000000)}',
+            'in_ntc': random.random() < 0.02,
+            'spanning_reads': random.randint(0, 500),
+            'spanning_reads_dedup': random.randint(0, 100),
+            'split_reads': random.randint(0, 500),
+            'split_reads_dedup': random.randint(0, 100),
+            'fusion_caller': 'RnaFusionFilter',
+            'fusion_score': round(random.random(), 3),
+        }
+        if splice_genes and random.random() < 0.1:
+            row['fusion'] = random.choice(splice_genes)
+            row['exons'] = f'{random.randint(1, 14)}/{random.randint(15, 28)}'
+            row['type'] = 'Splice'
+        else:
+            partner = random.choice(fusion_genes) if fusion_genes and random.random() < 0.5 else f'GENE{n}'
+            row['fusion'] = f'GENEB{n}--{partner}'
+            row['type'] = 'Fusion'
+        rows.append(row)
+
+    return rows
+
+
+class Command(BaseCommand):
+    help = textwrap.dedent(
+    """
+    Make a worksheet of random test data for benchmarking the import, in the same format as the pipeline output.
+    Writes a variants TSV and coverage JSON (DNA) or fusion CSV (RNA) for each sample, and a samples CSV that
+    can be passed to the import_worksheet or benchmark_import commands. The panel must already be in the database.
+
+    e.g. 50 samples with 10,000 variants and 500 genes each:
+        python manage.py generate_import_data --output bench --samples 50 --variants 10000 --genes 500
+    """)
+
+
+    def create_parser(self, *args, **kwargs):
+        """ edit class so that help text above wraps round lines """
+        parser = super(Command, self).create_parser(*args, **kwargs)
+        parser.formatter_class = RawTextHelpFormatter
+        return parser
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', nargs=1, type=str, required=True, help='Folder to save files to')
+        parser.add_argument('--worksheet', nargs=1, type=str, default=['bench_ws'], help='Worksheet ID')
+        parser.add_argument('--run', nargs=1, type=str, default=['bench_run'], help='Run ID')
+        parser.add_argument('--assay', nargs=1, type=str, default=['DNA'], choices=['DNA', 'RNA'], help='DNA or RNA')
+        parser.add_argument('--panel', nargs=1, type=str, default=['Tumour'], help='Name of virtual panel applied')
+        parser.add_argument('--genome', nargs=1, type=str, default=['GRCh37'], choices=['GRCh37', 'GRCh38'], help='Reference genome as GRCh37 or GRCh38')
+        parser.add_argument('--samples', nargs=1, type=int, default=[50], help='Number of samples on the worksheet')
+        parser.add_argument('--variants', nargs=1, type=int, default=[10000], help='Number of variants per sample (DNA)')
+        parser.add_argument('--on_panel', nargs=1, type=float, default=[0.05], help='Proportion of variants within the panel BED (DNA)')
+        parser.add_argument('--genes', nargs=1, type=int, default=[500], help='Number of genes in each coverage JSON (DNA)')
+        parser.add_argument('--fusions', nargs=1, type=int, default=[100], help='Number of fusions per sample (RNA)')
+        parser.add_argument('--seed', nargs=1, type=int, default=[1], help='Random seed, so the same data can be made again')
+
+
+    def handle(self, *args, **options):
+        """
+        Make test data
+
+        """
+        # extract variables from argparse
+        output_folder = options['output'][0]
+        ws = options['worksheet'][0]
+        run_id = options['run'][0]
+        assay = options['assay'][0]
+        panel = options['panel'][0]
+        genome = options['genome'][0]
+        num_samples = options['samples'][0]
+        num_variants = options['variants'][0]
+        num_genes = options['genes'][0]
+        num_fusions = options['fusions'][0]
+        random.seed(options['seed'][0])
+
+        # get panel, to put variants in the BED file and fusions in the panel gene lists
+        genome_build = {'GRCh37': 37, 'GRCh38': 38}[genome]
+        try:
+            panel_obj = Panel.objects.get(panel_name=panel, assay=ASSAY_CHOICES[f'TSO500_{assay}'], live=True, genome_build=genome_build)
+        except Panel.DoesNotExist:
+            raise CommandError(f'No live {panel} panel for TSO500_{assay} {genome}')
+
+        os.makedirs(output_folder, exist_ok=True)
+        sample_ids = [f'{ws}_sample{n + 1}' for n in range(num_samples)]
+
+        if assay == 'DNA':
+            bed_regions = read_bed_regions(panel_obj.bed_file.path) if panel_obj.bed_file else []
+            variant_pool = make_variant_pool(num_variants * 3, bed_regions, options['on_panel'][0])
+
+            for sample_id in sample_ids:
+                variants = random.sample(variant_pool, num_variants)
+                with open(os.path.join(output_folder, f'{sample_id}_variants.tsv'), 'w', newline='') as f:
+                    writer = csv.DictWriter(f, fieldnames=VARIANT_COLUMNS, delimiter='\t')
+                    writer.writeheader()
+                    for n, v in enumerate(variants):
+                        writer.writerow(make_variant_row(*v, n))
+
+                with open(os.path.join(output_folder, f'{sample_id}_{panel}_coverage.json'), 'w') as f:
+                    json.dump(make_coverage_json(num_genes), f)
+
+            samples_lines = [f'{s},{ws},DNA,{panel},{run_id},{genome}' for s in sample_ids]
+
+        elif assay == 'RNA':
+            samples_lines = []
+            for sample_id in sample_ids:
+                with open(os.path.join(output_folder, f'{sample_id}_fusion_check.csv'), 'w', newline='') as f:
+                    writer = csv.DictWriter(f, fieldnames=FUSION_COLUMNS)
+                    writer.writeheader()
+                    writer.writerows(make_fusion_rows(num_fusions, panel_obj))
+
+                samples_lines.append(f'{sample_id},{ws},RNA,{panel},{random.randint(1000000, 90000000)},{random.randint(0, 5000)},{run_id},{genome}')
+
+        # samples file in the same format as the pipeline
+        samples_file = os.path.join(output_folder, f'samples_{ws}.csv')
+        with open(samples_file, 'w') as f:
+            f.write('\n'.join(samples_lines) + '\n')
+
+        print(f'INFO\t{datetime.now()}\tgenerate_import_data.py\tMade {num_samples} {assay} sample(s), samples file saved to {samples_file}')
@@ -0,0 +1,160 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from analysis.import_utils import ImportMetrics, read_samples_csv, get_sample_panel, hash_input_files, get_previous_import, read_sample_files, write_sample
+
+import os
+import django
+import textwrap
+import multiprocessing
+from argparse import RawTextHelpFormatter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+
+class Command(BaseCommand):
+    help = textwrap.dedent(
+    """
+    Import all samples in a samples CSV file in one go, replaces running the import command once per sample.
+    Takes the same samples CSV as scripts/upload.sh, with one line per sample/ referral:
+        DNA: <sample>,<worksheet>,<assay>,<referral>,<run>,<genome>
+        RNA: <sample>,<worksheet>,<assay>,<referral>,<total_reads>,<total_reads_ntc>,<run>,<genome>
+
+    Input files must be in the same folder as the samples CSV. If the run isnt
+    in the samples CSV then it is taken from --run, and if the genome isnt
+    given then GRCh37 is used (for older runs).
+
+    Input files are read in parallel by a pool of worker processes, then each
+    sample is saved to the database in turn. Files are only read up to
+    --workers samples ahead of the sample being saved, to limit memory use.
+    A sample failing doesnt stop the other samples from importing, failed
+    samples are listed at the end.
+
+    Samples that have already been imported from the same input files are
+    skipped, so the command can be rerun after a failure. If the input files
+    have changed, the previous import is replaced as long as checking hasnt
+    started.
+
+    Time, database queries and rows for each stage of the import are printed
+    as one JSON line per sample, and added to --metrics_file if given. Input
+    files are read in the worker processes, so the read stage is the time
+    spent waiting for them.
+    """)
+
+
+    def create_parser(self, *args, **kwargs):
+        """ edit class so that help text above wraps round lines """
+        parser = super(Command, self).create_parser(*args, **kwargs)
+        parser.formatter_class = RawTextHelpFormatter
+        return parser
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--samples', nargs=1, type=str, required=True, help='Path to samples CSV file')
+        parser.add_argument('--run', nargs=1, type=str, required=False, help='Run ID, only used if not in the samples CSV')
+        parser.add_argument('--workers', nargs=1, type=int, required=False, default=[4], help='Number of processes used to read input files')
+        parser.add_argument('--debug', nargs=1, type=str, required=False, default=['False'], help='Show detailed logging')
+        parser.add_argument('--metrics_file', nargs=1, type=str, required=False, help='Add timings for each stage of the import to the end of this file')
+
+
+    def handle(self, *args, **options):
+        """
+        Run worksheet upload script
+
+        """
+        # extract variables from argparse
+        samples_file = options['samples'][0]
+        default_run = options['run'][0] if options['run'] else None
+        num_workers = options['workers'][0]
+        debug = bool(options['debug'][0] == 'True')
+        metrics_file = options['metrics_file'][0] if options['metrics_file'] else None
+
+        # check that inputs are valid
+        if not os.path.isfile(samples_file):
+            print(f'ERROR\t{datetime.now()}\timport_worksheet.py\t{samples_file} file does not exist')
+            raise IOError(f'{samples_file} file does not exist')
+
+        samples = read_samples_csv(samples_file, default_run)
+        print(f'INFO\t{datetime.now()}\timport_worksheet.py\tFound {len(samples)} sample(s) in {samples_file}')
+
+        # errors for any samples that fail and whether samples are skipped, in the same order as the samples file
+        errors = [None] * len(samples)
+        skipped = [False] * len(samples)
+
+        # check settings for each sample, get panel and check for previous imports - this is done in this process as it needs the database
+        for n, s in enumerate(samples):
+            s['metrics'] = ImportMetrics(sample=s['sample'], worksheet=s['ws'], run=s['run'], panel=s['panel'], assay=s['assay'])
+            try:
+                with s['metrics'].stage('setup'):
+                    s['panel_obj'], s['genome_build'] = get_sample_panel(s['run'], s['ws'], s['assay'], s['panel'], s['genome'])
+                    s['input_hash'] = hash_input_files(
+                        s['panel_obj'], s['snvs_file'], s['coverage_file'], s['fusions_file'], s['fusion_coverage']
+                    )
+                    s['previous_analysis'], skipped[n] = get_previous_import(s['ws'], s['sample'], s['panel_obj'], s['input_hash'])
+            except Exception as e:
+                errors[n] = e
+
+            if skipped[n]:
+                s['metrics'].info['skipped'] = True
+                s['metrics'].log(metrics_file)
+
+        # read input files in worker processes. spawn is used so that workers dont inherit the database connection,
+        # workers only need django set up to load the models and never query the database
+        num_workers = max(num_workers, 1)
+        with ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=django.setup,
+        ) as pool:
+
+            # files are only read a few samples ahead of the sample being saved, so that the output of
+            # read_sample_files is only held in memory for about as many samples as there are workers
+            jobs = [None] * len(samples)
+            next_read = 0
+
+            # save each sample to the database in turn as its files are read
+            for n, s in enumerate(samples):
+                while next_read < min(n + num_workers, len(samples)):
+                    r = samples[next_read]
+                    if errors[next_read] is None and not skipped[next_read]:
+                        jobs[next_read] = pool.submit(read_sample_files, r['panel_obj'], r['snvs_file'], r['coverage_file'], r['fusions_file'])
+                    next_read += 1
+
+                if errors[n] is not None or skipped[n]:
+                    continue
+
+                print(f'INFO\t{datetime.now()}\timport_worksheet.py\tStarting database upload for {s["sample"]} - {s["panel"]}')
+                try:
+                    with s['metrics'].stage('read'):
+                        sample_data = jobs[n].result()
+                    write_sample(
+                        s['run'], s['ws'], s['sample'], s['assay'], s['panel_obj'], s['genome_build'], sample_data,
+                        fusion_coverage = s['fusion_coverage'],
+                        debug = debug,
+                        input_hash = s['input_hash'],
+                        replace_analysis = s['previous_analysis'],
+                        metrics = s['metrics'],
+                    )
+                    s['metrics'].log(metrics_file)
+                except Exception as e:
+                    errors[n] = e
+
+                # dont keep the input data once the sample is saved
+                jobs[n], sample_data = None, None
+
+        # report outcome of each sample
+        print('------------------------------------------------------------------------------------------------------------')
+        for s, e, skip in zip(samples, errors, skipped):
+            if skip:
+                print(f'INFO\t{datetime.now()}\timport_worksheet.py\t{s["sample"]}\t{s["panel"]}\tSkipped - already imported from the same input files')
+            elif e is None:
+                print(f'INFO\t{datetime.now()}\timport_worksheet.py\t{s["sample"]}\t{s["panel"]}\tSuccess')
+            else:
+                print(f'ERROR\t{datetime.now()}\timport_worksheet.py\t{s["sample"]}\t{s["panel"]}\tFailed - {e}')
+        print('------------------------------------------------------------------------------------------------------------')
+
+        # exit with an error if anything failed so that it's picked up by the upload script
+        num_failed = len([e for e in errors if e is not None])
+        if num_failed:
+            raise CommandError(f'{num_failed} of {len(samples)} sample(s) failed to import')
+
+        print(f'INFO\t{datetime.now()}\timport_worksheet.py\tFinished import_worksheet.py script successfully')
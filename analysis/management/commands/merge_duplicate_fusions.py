@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from analysis.models import Fusion, FusionAnalysis, VariantList, VariantToVariantList
+from analysis.utils import VariantListCache
+
+import textwrap
+from argparse import RawTextHelpFormatter
+from datetime import datetime
+
+
+class Command(BaseCommand):
+    help = textwrap.dedent(
+    """
+    Merge fusions that have the same genes, breakpoints and genome build into
+    one record. Fusion analyses and fusion artefact list entries that link to a
+    duplicate are moved onto the oldest record, then the duplicates are removed.
+
+    Fusions need to be unique before the unique constraint on these fields can
+    be added, so run this before migrating an existing database. It's safe to
+    run more than once, nothing is changed if there are no duplicates.
+    """)
+
+
+    def create_parser(self, *args, **kwargs):
+        """ edit class so that help text above wraps round lines """
+        parser = super(Command, self).create_parser(*args, **kwargs)
+        parser.formatter_class = RawTextHelpFormatter
+        return parser
+
+
+    def handle(self, *args, **options):
+        """
+        Merge each group of duplicate fusions in its own transaction
+
+        """
+        key_fields = ['fusion_genes', 'left_breakpoint', 'right_breakpoint', 'genome_build']
+        duplicates = Fusion.objects.values(*key_fields).annotate(
+            num_fusions=Count('pk'), keep_pk=Min('pk')
+        ).filter(num_fusions__gt=1).order_by('keep_pk')
+        print(f'INFO\t{datetime.now()}\tmerge_duplicate_fusions.py\tFound {len(duplicates)} fusion(s) with duplicate records')
+
+        changed_lists = set()
+        for d in duplicates:
+            with transaction.atomic():
+                duplicate_pks = list(
+                    Fusion.objects.filter(**{f: d[f] for f in key_fields}).exclude(pk=d['keep_pk']).values_list('pk', flat=True)
+                )
+
+                # move everything that links to a duplicate onto the record that's kept
+                FusionAnalysis.objects.filter(fusion_genes_id__in=duplicate_pks).update(fusion_genes_id=d['keep_pk'])
+                list_entries = VariantToVariantList.objects.filter(fusion_id__in=duplicate_pks)
+                changed_lists.update(list_entries.values_list('variant_list_id', flat=True))
+                list_entries.update(fusion_id=d['keep_pk'])
+
+                Fusion.objects.filter(pk__in=duplicate_pks).delete()
+
+            print(f'INFO\t{datetime.now()}\tmerge_duplicate_fusions.py\tMerged {len(duplicate_pks)} duplicate(s) of {d["fusion_genes"]} {d["left_breakpoint"]} {d["right_breakpoint"]} into fusion {d["keep_pk"]}')
+
+        # list entries were moved without saving them, so mark the lists as changed for any cached list entries
+        if changed_lists:
+            VariantList.objects.filter(pk__in=changed_lists).update(updated=timezone.now())
+            VariantListCache.clear()
+
+        print(f'INFO\t{datetime.now()}\tmerge_duplicate_fusions.py\tFinished merging duplicate fusions')
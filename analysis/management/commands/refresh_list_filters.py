@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from analysis.models import SampleAnalysis, VariantPanelAnalysis
+from analysis.utils import update_list_filters
+
+import textwrap
+from argparse import RawTextHelpFormatter
+from datetime import datetime
+
+
+class Command(BaseCommand):
+    help = textwrap.dedent(
+    """
+    Recalculate which variants are filtered by the poly and artefact lists for
+    every sample analysis. This is done automatically when a sample is imported
+    and when the lists change, so this only needs running once to fill in
+    samples that were imported before the filter was saved with each variant.
+    """)
+
+
+    def create_parser(self, *args, **kwargs):
+        """ edit class so that help text above wraps round lines """
+        parser = super(Command, self).create_parser(*args, **kwargs)
+        parser.formatter_class = RawTextHelpFormatter
+        return parser
+
+
+    def handle(self, *args, **options):
+        """
+        Update list filters one sample analysis at a time
+
+        """
+        sample_analyses = SampleAnalysis.objects.filter(panel__show_snvs=True).order_by('pk').values_list('pk', flat=True)
+        print(f'INFO\t{datetime.now()}\trefresh_list_filters.py\tUpdating {len(sample_analyses)} sample analyses')
+
+        for sample_analysis_pk in sample_analyses:
+            with transaction.atomic():
+                update_list_filters(
+                    VariantPanelAnalysis.objects.filter(sample_analysis_id=sample_analysis_pk).select_related(
+                        'variant_instance__variant', 'sample_analysis__panel'
+                    )
+                )
+
+        print(f'INFO\t{datetime.now()}\trefresh_list_filters.py\tFinished updating list filters')
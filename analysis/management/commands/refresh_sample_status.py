@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from analysis.models import SampleAnalysis
+from analysis.utils import update_sample_status
+
+import textwrap
+from argparse import RawTextHelpFormatter
+from datetime import datetime
+
+
+class Command(BaseCommand):
+    help = textwrap.dedent(
+    """
+    Work out the status and assigned user of every sample analysis from its
+    checks, and the status of every worksheet, and save them. These are kept
+    up to date whenever a check changes, so this only needs running once to
+    fill them in for samples imported before they were saved, or to fix them
+    if the checks have been edited directly (e.g. in the admin page).
+
+    Use --worksheet to only refresh the samples on one worksheet.
+    """)
+
+
+    def create_parser(self, *args, **kwargs):
+        """ edit class so that help text above wraps round lines """
+        parser = super(Command, self).create_parser(*args, **kwargs)
+        parser.formatter_class = RawTextHelpFormatter
+        return parser
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--worksheet', nargs=1, type=str, required=False, help='Worksheet ID, only refresh samples on this worksheet')
+
+
+    def handle(self, *args, **options):
+        """
+        Refresh sample and worksheet statuses in one transaction
+
+        """
+        sample_analyses = SampleAnalysis.objects.order_by('pk')
+        if options['worksheet']:
+            sample_analyses = sample_analyses.filter(worksheet_id=options['worksheet'][0])
+
+        sample_analysis_ids = list(sample_analyses.values_list('pk', flat=True))
+        print(f'INFO\t{datetime.now()}\trefresh_sample_status.py\tRefreshing status for {len(sample_analysis_ids)} sample analyses')
+
+        with transaction.atomic():
+            update_sample_status(sample_analysis_ids)
+
+        print(f'INFO\t{datetime.now()}\trefresh_sample_status.py\tFinished refreshing sample status')
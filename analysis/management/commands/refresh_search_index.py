@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from analysis.models import SampleAnalysis, SearchTerm
+from analysis.utils import update_search_index
+
+import textwrap
+from argparse import RawTextHelpFormatter
+from datetime import datetime
+
+
+class Command(BaseCommand):
+    help = textwrap.dedent(
+    """
+    Save search terms for the worksheet, run and sample IDs of every sample
+    analysis, used by the search bar on the home page. Search terms are
+    added when a sample is imported, so this only needs running once to
+    fill them in for samples imported before they were saved.
+
+    Use --overwrite to delete all search terms and make them again, e.g. if
+    the way that search terms are made changes.
+    """)
+
+
+    def create_parser(self, *args, **kwargs):
+        """ edit class so that help text above wraps round lines """
+        parser = super(Command, self).create_parser(*args, **kwargs)
+        parser.formatter_class = RawTextHelpFormatter
+        return parser
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--overwrite', default=False, action='store_true', help='Replace search terms that are already saved')
+
+
+    def handle(self, *args, **options):
+        """
+        Save search terms one worksheet at a time
+
+        """
+        worksheet_ids = SampleAnalysis.objects.order_by('worksheet_id').values_list('worksheet_id', flat=True).distinct()
+        print(f'INFO\t{datetime.now()}\trefresh_search_index.py\tSaving search terms for {worksheet_ids.count()} worksheets')
+
+        for worksheet_id in worksheet_ids:
+            with transaction.atomic():
+                if options['overwrite']:
+                    SearchTerm.objects.filter(worksheet_id=worksheet_id).delete()
+                update_search_index(SampleAnalysis.objects.filter(worksheet_id=worksheet_id))
+
+        print(f'INFO\t{datetime.now()}\trefresh_search_index.py\tFinished saving search terms')
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from analysis.models import SampleAnalysis
+from analysis.utils import save_coverage_summary
+
+import textwrap
+from argparse import RawTextHelpFormatter
+from datetime import datetime
+
+
+class Command(BaseCommand):
+    help = textwrap.dedent(
+    """
+    Work out and save the coverage tab and myeloid coverage summary for sample
+    analyses that dont have one saved yet. This is done automatically when a
+    sample is imported, so this only needs running once to fill in samples
+    that were imported before coverage summaries were saved.
+
+    Use --overwrite to redo the summaries for all samples, e.g. if the format
+    of the coverage tab changes.
+    """)
+
+
+    def create_parser(self, *args, **kwargs):
+        """ edit class so that help text above wraps round lines """
+        parser = super(Command, self).create_parser(*args, **kwargs)
+        parser.formatter_class = RawTextHelpFormatter
+        return parser
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--overwrite', default=False, action='store_true', help='Replace summaries that are already saved')
+
+
+    def handle(self, *args, **options):
+        """
+        Save coverage summaries one sample analysis at a time
+
+        """
+        sample_analyses = SampleAnalysis.objects.filter(panel__show_snvs=True)
+        if not options['overwrite']:
+            sample_analyses = sample_analyses.filter(coveragesummary__isnull=True)
+
+        sample_analyses = sample_analyses.select_related('panel').order_by('pk')
+        print(f'INFO\t{datetime.now()}\tsave_coverage_summaries.py\tSaving coverage summaries for {sample_analyses.count()} sample analyses')
+
+        for sample_analysis_obj in sample_analyses.iterator():
+            with transaction.atomic():
+                save_coverage_summary(sample_analysis_obj)
+
+        print(f'INFO\t{datetime.now()}\tsave_coverage_summaries.py\tFinished saving coverage summaries')
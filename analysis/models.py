@@ -1,8 +1,12 @@
 from django.db import models
+from django.db.models import OuterRef, Subquery, Count, Case, When, Value
+from django.db.models.functions import Coalesce, Concat, Cast
 from django.contrib.auth.models import User
 
 from auditlog.registry import auditlog
 import decimal
+import json
+import zlib
 import re
 
 
@@ -37,19 +41,27 @@ class Worksheet(models.Model):
     diagnostic = models.BooleanField(default=True)
     upload_time = models.DateTimeField(blank=True, null=True)
 
+    # saved from the status of the samples on the worksheet by update_sample_status, so that worksheets can be filtered on it
+    status = models.CharField(max_length=200, blank=True, null=True) # all sample statuses, pipe seperated
+    igv_open = models.BooleanField(default=False, db_index=True) # true if any samples have an IGV check open
+
+    class Meta:
+        # order used to page through all worksheets
+        indexes = [models.Index(fields=['diagnostic', 'run', 'ws_id'])]
+
     def __str__(self):
         return self.ws_id
 
     def get_status_and_samples(self):
-        # get all sample analysis objects
-        samples = SampleAnalysis.objects.filter(worksheet = self)
+        # get all sample analysis objects along with their status
+        samples = SampleAnalysis.objects.filter(worksheet = self).with_check_status()
 
         # get list of all unique statuses and concatenate
-        all_status = [ s.get_checks()['current_status'] for s in samples ]
+        all_status = [ s.current_status for s in samples ]
         status = ' | '.join( set(all_status) )
 
         # get all sample IDs
-        sample_list = [i.sample.sample_id for i in samples]
+        sample_list = [i.sample_id for i in samples]
 
         return status, sample_list
 
@@ -73,6 +85,18 @@ class Sample(models.Model):
         return worksheets
 
 
+class SearchTerm(models.Model):
+    """
+    Lowercase worksheet, run and sample IDs used by the search bar on the home page, so that searches can be
+    matched on an index. Worksheet and run IDs are saved with no sample, sample IDs are saved with each worksheet
+    the sample is on. Made at import by update_search_index
+
+    """
+    term = models.CharField(max_length=50, db_index=True)
+    worksheet = models.ForeignKey('Worksheet', on_delete=models.CASCADE)
+    sample = models.ForeignKey('Sample', on_delete=models.CASCADE, blank=True, null=True)
+
+
 def make_bedfile_path(instance, filename):
     """
     Function to generate filepath when adding bed file to Panel model below
@@ -131,12 +155,61 @@ class Panel(models.Model):
         return f'{self.pretty_print} (v{self.version})'
 
 
+class SampleAnalysisQuerySet(models.QuerySet):
+    """
+    Extra queries for sample analyses, used as SampleAnalysis.objects
+
+    """
+    def with_check_status(self):
+        """
+        Work out the status of each sample analysis in the database, gives the same status as get_checks
+        for a list of sample analyses in one query. Adds:
+          current_status - e.g. 'IGV check 1', 'Complete', 'Fail'
+          assigned_to_id - pk of the user the open IGV check is assigned to, or None
+          current_check_id - pk of the open IGV check, or the latest check if there isnt one
+          latest_check_id - pk of the latest check
+          num_fails - number of failed IGV checks
+
+        """
+        checks = Check.objects.filter(analysis=OuterRef('pk'))
+        igv_checks = checks.filter(stage='IGV')
+        pending_checks = igv_checks.filter(status='P').order_by('-pk')
+
+        # IGV check number of the open check, counting all IGV checks up to and including it
+        check_number = Check.objects.filter(
+            analysis=OuterRef('pk'), stage='IGV', pk__lte=OuterRef('pending_check_id')
+        ).order_by().values('analysis').annotate(n=Count('pk')).values('n')
+
+        num_fails = igv_checks.filter(status='F').order_by().values('analysis').annotate(n=Count('pk')).values('n')
+
+        return self.annotate(
+            pending_check_id=Subquery(pending_checks.values('pk')[:1]),
+            assigned_to_id=Subquery(pending_checks.values('user')[:1]),
+            latest_check_id=Subquery(checks.order_by('-pk').values('pk')[:1]),
+            num_fails=Coalesce(Subquery(num_fails, output_field=models.IntegerField()), 0),
+        ).annotate(
+            current_check_id=Coalesce('pending_check_id', 'latest_check_id'),
+            current_status=Case(
+                When(num_fails__gt=1, then=Value('Fail')),
+                When(num_fails=1, then=Value('Fail - 2nd check required')),
+                When(pending_check_id__isnull=False, then=Concat(
+                    Value(f"{dict(Check.STAGE_CHOICES)['IGV']} "),
+                    Cast(Subquery(check_number, output_field=models.IntegerField()), models.CharField()),
+                )),
+                default=Value('Complete'),
+                output_field=models.CharField(),
+            ),
+        )
+
+
 class SampleAnalysis(models.Model):
     """
     An analysis of a sample, if there are multiple analyses (e.g. multiple panels), 
     then there will be multiple sample analysis objects
 
     """
+    objects = SampleAnalysisQuerySet.as_manager()
+
     worksheet = models.ForeignKey('Worksheet', on_delete=models.CASCADE)
     sample = models.ForeignKey('Sample', on_delete=models.CASCADE)
     panel = models.ForeignKey('Panel', on_delete=models.CASCADE)
@@ -145,6 +218,12 @@ class SampleAnalysis(models.Model):
     total_reads_ntc = models.IntegerField(blank=True, null=True)
     genome_build = models.IntegerField(default=37)
     upload_time = models.DateTimeField(blank=True, null=True)
+    input_hash = models.CharField(max_length=64, blank=True, null=True) # hash of input files, so reimporting the same files can be skipped
+
+    # saved from the checks by update_sample_status whenever they change, so that samples can be filtered on them
+    status = models.CharField(max_length=50, blank=True, null=True, db_index=True) # same as current_status in get_checks
+    assigned_user = models.ForeignKey('auth.User', on_delete=models.SET_NULL, blank=True, null=True)
+    status_updated = models.DateTimeField(blank=True, null=True)
 
 
     def percent_reads_ntc(self):
@@ -332,8 +411,15 @@ class VariantPanelAnalysis(models.Model):
     Link instances of variants to a panel analysis
 
     """
+    LIST_FILTER_CHOICES = (
+        ('P', 'Poly'),
+        ('A', 'Artefact'),
+    )
     sample_analysis = models.ForeignKey('SampleAnalysis', on_delete=models.CASCADE)
     variant_instance = models.ForeignKey('VariantInstance', on_delete=models.CASCADE)
+    # whether the variant is filtered by a signed off poly/ artefact list, updated at import and when the lists change
+    list_filter = models.CharField(max_length=1, blank=True, null=True, choices=LIST_FILTER_CHOICES)
+    list_filter_reason = models.CharField(max_length=50, blank=True, null=True)
 
     def get_current_check(self):
         return VariantCheck.objects.filter(variant_analysis=self).latest('pk')
@@ -378,6 +464,7 @@ class VariantList(models.Model):
     list_type = models.CharField(max_length=1, choices=TYPE_CHOICES)
     genome_build = models.IntegerField(default=37)
     assay = models.CharField(blank=True, max_length=1, choices=Panel.ASSAY_CHOICES)
+    updated = models.DateTimeField(blank=True, null=True)
 
     def header(self):
         if self.genome_build == 37:
@@ -486,6 +573,22 @@ class GapsAnalysis(models.Model):
         return f'{self.chr_start}:{self.pos_start}_{self.chr_end}:{self.pos_end}'
 
 
+class CoverageSummary(models.Model):
+    """
+    Coverage tab and myeloid coverage summary for a sample analysis, worked out once at import as
+    coverage doesnt change afterwards. Saved as compressed JSON
+
+    """
+    sample = models.OneToOneField('SampleAnalysis', on_delete=models.CASCADE)
+    summary = models.BinaryField()
+
+    def set_summary(self, summary_dict):
+        self.summary = zlib.compress(json.dumps(summary_dict).encode())
+
+    def get_summary(self):
+        return json.loads(zlib.decompress(self.summary).decode())
+
+
 class Fusion(models.Model):
     """
     A fusion
@@ -495,6 +598,9 @@ class Fusion(models.Model):
     right_breakpoint = models.CharField(max_length=50)
     genome_build = models.IntegerField(default=37)
 
+    class Meta:
+        unique_together = ('fusion_genes', 'left_breakpoint', 'right_breakpoint', 'genome_build')
+
 
 class FusionAnalysis(models.Model):
     """
@@ -0,0 +1,84 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import VariantList, VariantToVariantList
+from .utils import VariantListCache, refresh_list_filters, apply_fusion_list_decisions
+
+
+# this needs to be connected first so that the handlers below see the changes
+@receiver([post_save, post_delete], sender=VariantToVariantList)
+@receiver([post_save, post_delete], sender=VariantList)
+def clear_variant_list_cache(sender, instance, **kwargs):
+    """
+    Clear the cached poly/ artefact list entries whenever a list or list entry changes, and mark the list as
+    updated so that other processes reload their cached entries too
+
+    """
+    list_pk = instance.pk if sender == VariantList else instance.variant_list_id
+    VariantList.objects.filter(pk=list_pk).update(updated=timezone.now())
+    VariantListCache.clear()
+
+
+@receiver([post_save, post_delete], sender=VariantToVariantList)
+def variant_list_entry_changed(sender, instance, **kwargs):
+    """
+    Update the poly/ artefact filter of samples with the variant when it's added to, signed off or removed from a list
+    (skipped when loading fixtures, as the rest of the data might not be loaded yet)
+
+    """
+    if kwargs.get('raw'):
+        return
+
+    if instance.variant_id is not None:
+        refresh_list_filters([instance.variant_id])
+
+
+@receiver(post_save, sender=VariantToVariantList)
+def fusion_list_entry_changed(sender, instance, **kwargs):
+    """
+    Classify the fusion as an artefact in any open checks when it's signed off on a fusion artefact list
+    (skipped when loading fixtures, as the rest of the data might not be loaded yet)
+
+    """
+    if kwargs.get('raw'):
+        return
+
+    if instance.fusion_id is not None:
+        apply_fusion_list_decisions(instance)
+
+
+# settings of a variant list that change which samples the list entries are applied to
+VARIANT_LIST_FILTER_FIELDS = ['list_type', 'genome_build', 'assay']
+
+
+@receiver(pre_save, sender=VariantList)
+def store_variant_list_settings(sender, instance, **kwargs):
+    """
+    Keep the saved list settings before the list is changed, so that variant_list_changed can tell if they've changed
+
+    """
+    instance._previous_settings = None
+    if not kwargs.get('raw'):
+        instance._previous_settings = VariantList.objects.filter(pk=instance.pk).values(*VARIANT_LIST_FILTER_FIELDS).first()
+
+
+@receiver(post_save, sender=VariantList)
+def variant_list_changed(sender, instance, created, **kwargs):
+    """
+    Update the poly/ artefact filter of samples with any variant in a list if the list type, genome build or assay
+    are changed (removing a list is handled above, as the list entries are removed with it)
+
+    """
+    if created or kwargs.get('raw'):
+        return
+
+    previous_settings = getattr(instance, '_previous_settings', None)
+    if previous_settings is None:
+        return
+
+    if any(previous_settings[f] != getattr(instance, f) for f in VARIANT_LIST_FILTER_FIELDS):
+        variant_ids = VariantToVariantList.objects.filter(
+            variant_list=instance, variant__isnull=False
+        ).values_list('variant_id', flat=True)
+        refresh_list_filters(list(variant_ids))
@@ -1,12 +1,22 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, models
 from django.contrib.auth.models import User
 from django.core.management import call_command
+from django.core.management.base import CommandError
 
 from analysis.utils import *
+from analysis.import_utils import *
 from analysis.models import *
+from auditlog.models import LogEntry
 
 from decimal import Decimal
 import contextlib
+import tempfile
+import json
+import os
+import csv
+import shutil
 
 
 class TestViews(TestCase):
@@ -295,6 +305,1109 @@ class TestUpload(TestCase):
         self.assertFalse(FusionAnalysis.objects.filter(fusion_caller='Splice').exists())
 
 
+    def test_upload_metrics(self):
+        '''
+        timings and counts for each stage of the import should be saved as a JSON line in the metrics file
+        '''
+        metrics_file = os.path.join(tempfile.mkdtemp(), 'metrics.jsonl')
+        self.addCleanup(shutil.rmtree, os.path.dirname(metrics_file))
+
+        kwargs = {
+            'run': ['run_3'],
+            'worksheet': ['crm_ws_1'],
+            'assay': ['GeneRead_CRM'],
+            'sample': ['crm_test_1'],
+            'panel': ['tumour'],
+            'genome': ['GRCh37'],
+            'debug': ['False'],
+            'snvs': ['analysis/test_data/Database_37/crm_test_1_variants.tsv'],
+            'snv_coverage': ['analysis/test_data/Database_37/crm_test_1_tumour_coverage.json'],
+            'metrics_file': [metrics_file],
+        }
+        with contextlib.redirect_stdout(None):
+            call_command('import', **kwargs)
+
+        with open(metrics_file) as f:
+            metrics = [json.loads(line) for line in f]
+
+        self.assertEqual(len(metrics), 1)
+        self.assertEqual(metrics[0]['sample'], 'crm_test_1')
+        self.assertEqual(list(metrics[0]['stages'].keys()), ['setup', 'read', 'snvs', 'coverage', 'gaps', 'coverage_summary'])
+        self.assertEqual(metrics[0]['stages']['snvs']['rows'], {'variants': 67, 'variant_instances': 11})
+        self.assertEqual(metrics[0]['stages']['coverage']['rows'], {'genes': 13, 'regions': 55})
+        self.assertEqual(metrics[0]['stages']['gaps']['rows'], {'gaps': 0})
+        self.assertEqual(metrics[0]['queries'], sum(s['queries'] for s in metrics[0]['stages'].values()))
+
+
+    def test_upload_worksheet(self):
+        '''
+        test importing a whole worksheet from a samples CSV in one command, using TSO500_RNA test data
+        '''
+        kwargs = {
+            'samples': ['analysis/test_data/Database_37/samples_rna_ws_1.csv'],
+            'run': ['rna_test_1'],
+            'workers': [2],
+        }
+
+        # run import management command - wrap in contextlib to prevent output printing to screen
+        with contextlib.redirect_stdout(None):
+            call_command('import_worksheet', **kwargs)
+
+        # one sample analysis per line of samples CSV, all on the same worksheet
+        ws_obj = Worksheet.objects.get(ws_id = 'rna_ws_1')
+        self.assertEqual(ws_obj.run.run_id, 'rna_test_1')
+        self.assertEqual(ws_obj.assay, 'TSO500_RNA')
+        self.assertEqual(SampleAnalysis.objects.filter(worksheet=ws_obj).count(), 8)
+
+        # coverage should be taken from the RNA specific columns
+        panel_obj = Panel.objects.get(panel_name='Tumour', assay='2', live=True, genome_build=37)
+        sample_analysis_obj = SampleAnalysis.objects.get(worksheet = ws_obj, sample_id='rna_test_1', panel=panel_obj)
+        self.assertEqual(sample_analysis_obj.genome_build, 37)
+        self.assertEqual(sample_analysis_obj.total_reads, 9000004)
+        self.assertEqual(sample_analysis_obj.total_reads_ntc, 596)
+
+        # fusions should match the single sample import
+        self.assertEqual(Fusion.objects.count(), 18)
+        self.assertEqual(FusionAnalysis.objects.filter(sample=sample_analysis_obj).count(), 13)
+
+
+    def test_upload_worksheet_failed_sample(self):
+        '''
+        a sample that fails shouldnt stop the rest of the samples importing, but the command should still error
+        '''
+        # make samples file in test data folder so input files can be found, second line has a panel that doesnt exist
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', dir='analysis/test_data/Database_37', delete=False) as f:
+            f.write('rna_test_1,rna_ws_1,RNA,Tumour,9000004,596,rna_test_1,GRCh37\n')
+            f.write('rna_test_1,rna_ws_1,RNA,not_a_panel,9000004,596,rna_test_1,GRCh37\n')
+        self.addCleanup(os.remove, f.name)
+
+        with contextlib.redirect_stdout(None):
+            with self.assertRaises(CommandError):
+                call_command('import_worksheet', samples=[f.name], workers=[1])
+
+        self.assertEqual(SampleAnalysis.objects.count(), 1)
+        self.assertEqual(SampleAnalysis.objects.get().panel.panel_name, 'Tumour')
+
+
+    def test_upload_rerun(self):
+        '''
+        rerunning an import with the same files should be skipped, changed files should replace the previous import
+        as long as checking hasnt started
+        '''
+        # copy SNV file so that it can be changed
+        snvs_file = os.path.join(tempfile.mkdtemp(), 'crm_test_1_variants.tsv')
+        self.addCleanup(shutil.rmtree, os.path.dirname(snvs_file))
+        shutil.copy('analysis/test_data/Database_37/crm_test_1_variants.tsv', snvs_file)
+
+        kwargs = {
+            'run': ['run_3'],
+            'worksheet': ['crm_ws_1'],
+            'assay': ['GeneRead_CRM'],
+            'sample': ['crm_test_1'],
+            'panel': ['tumour'],
+            'genome': ['GRCh37'],
+            'debug': ['False'],
+            'snvs': [snvs_file],
+            'snv_coverage': ['analysis/test_data/Database_37/crm_test_1_tumour_coverage.json']
+        }
+
+        # import twice, second import should be skipped
+        with contextlib.redirect_stdout(None):
+            call_command('import', **kwargs)
+            first_analysis = SampleAnalysis.objects.get()
+            call_command('import', **kwargs)
+
+        self.assertEqual(SampleAnalysis.objects.get(), first_analysis)
+        self.assertEqual(first_analysis.input_hash, SampleAnalysis.objects.get().input_hash)
+        self.assertEqual(VariantInstance.objects.count(), 11)
+        self.assertEqual(GeneCoverageAnalysis.objects.count(), 13)
+
+        # change the input file, previous import should be replaced without making duplicates
+        with open(snvs_file, 'a') as f:
+            f.write('\n')
+        with contextlib.redirect_stdout(None):
+            call_command('import', **kwargs)
+
+        second_analysis = SampleAnalysis.objects.get()
+        self.assertNotEqual(second_analysis.pk, first_analysis.pk)
+        self.assertNotEqual(second_analysis.input_hash, first_analysis.input_hash)
+        self.assertEqual(VariantInstance.objects.count(), 11)
+        self.assertEqual(VariantPanelAnalysis.objects.count(), 11)
+        self.assertEqual(GeneCoverageAnalysis.objects.count(), 13)
+        self.assertEqual(Check.objects.count(), 1)
+
+        # once checking has started the previous import shouldnt be replaced
+        Check.objects.filter(analysis=second_analysis).update(user=User.objects.create_user('test_user'))
+        with open(snvs_file, 'a') as f:
+            f.write('\n')
+        with contextlib.redirect_stdout(None):
+            with self.assertRaises(IOError):
+                call_command('import', **kwargs)
+
+        self.assertEqual(SampleAnalysis.objects.get(), second_analysis)
+        self.assertEqual(VariantInstance.objects.count(), 11)
+
+
+class TestImportUtils(TestCase):
+    """
+    Test the helper functions used to write imported data to the database
+    """
+
+    # load in all panels
+    fixtures = ['panels.json']
+
+    def setUp(self):
+        ''' runs before each test '''
+        run_obj = Run.objects.create(run_id='run_1')
+        ws_obj = Worksheet.objects.create(ws_id='ws_1', run=run_obj, assay='TSO500_DNA')
+        sample_obj = Sample.objects.create(sample_id='sample_1')
+        panel_obj = Panel.objects.get(panel_name='lung', assay='1', live=True, genome_build=38)
+        self.sample_analysis_obj = SampleAnalysis.objects.create(worksheet=ws_obj, sample=sample_obj, panel=panel_obj)
+        Gene.objects.create(gene='EGFR')
+
+    def test_bulk_insert_links_objects(self):
+        '''
+        objects built before their parent is saved should still be linked once both are written
+        '''
+        gene_coverage_obj = GeneCoverageAnalysis(sample=self.sample_analysis_obj, gene_id='EGFR', av_coverage=500, av_ntc_coverage=0, percent_ntc=0)
+        bulk_insert(GeneCoverageAnalysis, [gene_coverage_obj], return_pks=True)
+        self.assertIsNotNone(gene_coverage_obj.pk)
+
+        # build more regions than the batch size to check that chunking doesnt lose any
+        regions = [
+            make_region(['7', n, n + 10, f'c.{n}A>T', 500, 100, 100, 0, 0], 'G', gene_coverage_obj)
+            for n in range(1, 8)
+        ]
+        bulk_insert(RegionCoverageAnalysis, regions, batch_size=3)
+
+        self.assertEqual(RegionCoverageAnalysis.objects.count(), 7)
+        self.assertEqual(RegionCoverageAnalysis.objects.filter(gene=gene_coverage_obj).count(), 7)
+
+    def test_bulk_insert_audit_log(self):
+        '''
+        rows written in bulk should get an auditlog entry, the same as rows saved one at a time
+        '''
+        gene_coverage_obj = GeneCoverageAnalysis(sample=self.sample_analysis_obj, gene_id='EGFR', av_coverage=500, av_ntc_coverage=0, percent_ntc=0)
+        bulk_insert(GeneCoverageAnalysis, [gene_coverage_obj])
+        regions = [make_region(['7', n, n + 10, f'c.{n}A>T', 500, 100, 100, 0, 0], 'G', gene_coverage_obj) for n in range(1, 4)]
+        bulk_insert(RegionCoverageAnalysis, regions)
+
+        for obj in [gene_coverage_obj] + regions:
+            self.assertEqual(LogEntry.objects.get_for_object(obj).get().action, LogEntry.Action.CREATE)
+
+        # log entries made for bulk_create (used on postgres) have the values of each field
+        gene_objs = Gene.objects.bulk_create([Gene(gene='KRAS'), Gene(gene='BRAF')])
+        region_obj = RegionCoverageAnalysis.objects.create(
+            gene=gene_coverage_obj, hgvs_c='c.1A>T', chr_start='7', pos_start=1, chr_end='7', pos_end=2, hotspot='H',
+            average_coverage=500, ntc_coverage=0, percent_ntc=0,
+        )
+        LogEntry.objects.all().delete()
+        log_bulk_create(Gene, gene_objs)
+        log_bulk_create(RegionCoverageAnalysis, [region_obj])
+
+        self.assertEqual(json.loads(LogEntry.objects.get_for_object(gene_objs[0]).get().changes), {'gene': ['None', 'KRAS']})
+        changes = json.loads(LogEntry.objects.get_for_object(region_obj).get().changes)
+        self.assertEqual(changes['gene'], ['None', str(gene_coverage_obj.pk)])
+        self.assertEqual(changes['hgvs_c'], ['None', 'c.1A>T'])
+        self.assertNotIn('percent_135x', changes)
+
+    def test_get_or_create_in_bulk(self):
+        '''
+        existing objects should be reused and missing ones made, including when there are more keys than the batch size
+        '''
+        existing_variant = Variant.objects.create(variant='7:1A>T', genome_build=38)
+        Variant.objects.create(variant='7:2A>T', genome_build=37)
+
+        keys = [(f'7:{n}A>T',) for n in range(1, IMPORT_BATCH_SIZE + 10)]
+        variant_objs = get_or_create_in_bulk(Variant, ('variant',), keys + keys[:5], genome_build=38)
+
+        self.assertEqual(len(variant_objs), len(keys))
+        self.assertEqual(variant_objs[('7:1A>T',)].pk, existing_variant.pk)
+        self.assertEqual(variant_objs[('7:2A>T',)].genome_build, 38)
+        self.assertEqual(Variant.objects.filter(genome_build=38).count(), len(keys))
+
+        # fusions are matched on all breakpoints
+        Fusion.objects.create(fusion_genes='EML4-ALK', left_breakpoint='chr2:1', right_breakpoint='chr2:2', genome_build=37)
+        fusion_keys = [('EML4-ALK', 'chr2:1', 'chr2:2'), ('EML4-ALK', 'chr2:1', 'chr2:3')]
+        fusion_objs = get_or_create_in_bulk(Fusion, ('fusion_genes', 'left_breakpoint', 'right_breakpoint'), fusion_keys, genome_build=37)
+        self.assertEqual(len(fusion_objs), 2)
+        self.assertEqual(Fusion.objects.count(), 2)
+
+    def test_read_sample_files(self):
+        '''
+        input files should be read into plain data that can be sent back from a worker process, coverage is
+        streamed in while saving so only the file path is kept
+        '''
+        snvs_file = 'analysis/test_data/Database_37/crm_test_1_variants.tsv'
+        coverage_file = 'analysis/test_data/Database_37/crm_test_1_tumour_coverage.json'
+        panel_obj, genome_build = get_sample_panel('run_3', 'crm_ws_1', 'GeneRead_CRM', 'tumour', 'GRCh37')
+        sample_data = read_sample_files(panel_obj, snvs_file, coverage_file)
+
+        self.assertEqual(sample_data['coverage_file'], coverage_file)
+        self.assertEqual(len(sample_data['all_variants']), 67)
+        self.assertEqual(len(sample_data['panel_variants']), 11)
+
+        # no model objects are made until the sample is saved
+        def contains_model(value):
+            if isinstance(value, dict):
+                return any(contains_model(v) for v in value.values())
+            if isinstance(value, (list, tuple)):
+                return any(contains_model(v) for v in value)
+            return isinstance(value, models.Model)
+        self.assertFalse(contains_model(sample_data))
+
+    def test_iter_coverage_json(self):
+        '''
+        streaming the coverage json should give the same genes as loading it all at once, whatever the chunk size
+        '''
+        # one file with list formatted regions and one with dictionaries
+        for coverage_file in [
+            'analysis/test_data/Database_37/dna_test_1_Tumour_coverage.json',
+            'analysis/test_data/Database_38/sample22_lung_coverage.json',
+        ]:
+            with open(coverage_file) as f:
+                expected = json.load(f)
+            for chunk_size in [1, 100, 65536]:
+                with self.subTest(coverage_file=coverage_file, chunk_size=chunk_size):
+                    genes = list(iter_coverage_json(coverage_file, chunk_size=chunk_size))
+                    self.assertEqual([g for g, values in genes], list(expected.keys()))
+                    self.assertEqual(json.dumps(dict(genes)), json.dumps(expected))
+
+        # empty and invalid files
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+            f.write(' {\n}\n')
+            f.flush()
+            self.assertEqual(list(iter_coverage_json(f.name)), [])
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+            f.write('[]')
+            f.flush()
+            with self.assertRaises(ValueError):
+                list(iter_coverage_json(f.name))
+
+    def test_make_gap_formats(self):
+        '''
+        gaps in either format of coverage JSON should give the same object, unknown formats return None
+        '''
+        gene_coverage_obj = GeneCoverageAnalysis(sample=self.sample_analysis_obj, gene_id='EGFR', av_coverage=500, av_ntc_coverage=0, percent_ntc=0)
+
+        list_gap = make_gap(['7', 100, 200, 'c.1_101', 'EGFR'], '270', gene_coverage_obj)
+        dict_gap = make_gap({'chr': '7', 'pos_start': 100, 'pos_end': 200, 'hgvs_c': 'c.1_101', 'percent_cosmic': 'N/A'}, '270', gene_coverage_obj)
+
+        for gap in [list_gap, dict_gap]:
+            self.assertEqual(gap.pos_start, 100)
+            self.assertEqual(gap.pos_end, 200)
+            self.assertEqual(gap.percent_cosmic, None)
+            self.assertEqual(gap.coverage_cutoff, '270')
+
+        self.assertIsNone(make_gap('7:100-200', '270', gene_coverage_obj))
+
+    def test_format_fusion_call(self):
+        '''
+        fusions should be in the panel if any partner gene is a panel gene, but not if a gene name just contains a panel gene
+        '''
+        panel_genes = {'splicing': {'MET'}, 'fusions': {'RET', 'ROS1'}}
+        call = {'left_breakpoint': 'chr1:100', 'right_breakpoint': 'chr2:200', 'exons': '14/21'}
+
+        fusion_key, in_panel, f = format_fusion_call({**call, 'fusion': 'CCDC6--RET', 'type': 'Fusion'}, panel_genes)
+        self.assertEqual(fusion_key, ('CCDC6-RET', 'chr1:100', 'chr2:200'))
+        self.assertTrue(in_panel)
+
+        self.assertTrue(format_fusion_call({**call, 'fusion': 'CD74-ROS1;GOPC', 'type': 'Fusion'}, panel_genes)[1])
+        self.assertTrue(format_fusion_call({**call, 'fusion': 'NCOA4/RET', 'type': 'Fusion'}, panel_genes)[1])
+        self.assertFalse(format_fusion_call({**call, 'fusion': 'KIF5B-RETSAT', 'type': 'Fusion'}, panel_genes)[1])
+
+        # hyphens can be part of a gene name as well as separating genes
+        panel_genes['fusions'].add('NKX2-1')
+        self.assertTrue(format_fusion_call({**call, 'fusion': 'NKX2-1--FOXA1', 'type': 'Fusion'}, panel_genes)[1])
+        self.assertTrue(format_fusion_call({**call, 'fusion': 'FOXA1-NKX2-1', 'type': 'Fusion'}, panel_genes)[1])
+        self.assertTrue(format_fusion_call({**call, 'fusion': 'FOXA1::NKX2-1', 'type': 'Fusion'}, panel_genes)[1])
+        self.assertFalse(format_fusion_call({**call, 'fusion': 'NKX2-5-FOXA1', 'type': 'Fusion'}, panel_genes)[1])
+        self.assertFalse(format_fusion_call({**call, 'fusion': 'RET', 'type': 'Splice'}, panel_genes)[1])
+
+        fusion_key, in_panel, f = format_fusion_call({**call, 'fusion': 'MET', 'type': 'Splice'}, panel_genes)
+        self.assertEqual(fusion_key, ('MET 14/21', 'chr1:100', 'chr2:200'))
+        self.assertTrue(in_panel)
+
+    def test_import_metrics_stages(self):
+        '''
+        queries should only be counted against the stage that's running, nested stages pause the outer stage
+        '''
+        metrics = ImportMetrics(sample='test')
+        with metrics.stage('setup'):
+            Run.objects.count()
+            with metrics.stage('gaps'):
+                Run.objects.count()
+                Run.objects.count()
+            Run.objects.count()
+        metrics.add_rows('gaps', 'gaps', 3)
+        metrics.add_rows('gaps', 'gaps', 2)
+
+        # queries outside a stage arent counted
+        Run.objects.count()
+
+        output = metrics.as_dict()
+        self.assertEqual(output['sample'], 'test')
+        self.assertEqual(output['queries'], 4)
+        self.assertEqual(output['stages']['setup']['queries'], 2)
+        self.assertEqual(output['stages']['gaps']['queries'], 2)
+        self.assertEqual(output['stages']['gaps']['rows'], {'gaps': 5})
+
+
+class TestImportBenchmark(TestCase):
+    """
+    Test that the synthetic test data can be imported and benchmarked
+    """
+
+    # load in all panels
+    fixtures = ['panels.json']
+
+    def setUp(self):
+        ''' runs before each test '''
+        self.output_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_folder)
+
+    def test_generate_and_benchmark_dna(self):
+        '''
+        generated DNA data should import, and be rolled back after the benchmark
+        '''
+        with contextlib.redirect_stdout(None):
+            call_command('generate_import_data', output=[self.output_folder], samples=[2], variants=[200], genes=[10], on_panel=[0.5])
+            call_command('benchmark_import', samples=[f'{self.output_folder}/samples_bench_ws.csv'], output=[f'{self.output_folder}/results.tsv'])
+
+        # one line per sample per stage of the import, plus totals
+        with open(f'{self.output_folder}/results.tsv') as f:
+            results = list(csv.DictReader(f, delimiter='\t'))
+        stages = ['setup', 'read', 'snvs', 'coverage', 'gaps', 'coverage_summary']
+        self.assertEqual(len(results), 18)
+        self.assertEqual([r['stage'] for r in results[0:6]], stages)
+        self.assertEqual([r['stage'] for r in results if r['sample'] == 'total'], stages)
+        self.assertGreater(int(results[-4]['queries']), 0)
+        self.assertGreaterEqual(float(results[-1]['peak_rss_increase_mb']), 0)
+
+        # nothing should be left in the database
+        self.assertFalse(SampleAnalysis.objects.exists())
+        self.assertFalse(Worksheet.objects.exists())
+
+    def test_generate_and_import_rna(self):
+        '''
+        generated RNA data should import with the import_worksheet command
+        '''
+        with contextlib.redirect_stdout(None):
+            call_command('generate_import_data', output=[self.output_folder], assay=['RNA'], samples=[2], fusions=[20])
+            call_command('import_worksheet', samples=[f'{self.output_folder}/samples_bench_ws.csv'], workers=[1])
+
+        self.assertEqual(SampleAnalysis.objects.filter(worksheet_id='bench_ws').count(), 2)
+        self.assertTrue(FusionAnalysis.objects.exists())
+
+
+class TestMergeDuplicateFusions(TransactionTestCase):
+    """
+    Test merging duplicate fusions in a database made before fusions were unique
+    """
+
+    # load in all panels
+    fixtures = ['panels.json']
+
+    def setUp(self):
+        ''' remove the unique constraint so that duplicates can be made, it's added back once they're merged '''
+        key_fields = ('fusion_genes', 'left_breakpoint', 'right_breakpoint', 'genome_build')
+        with connection.schema_editor() as editor:
+            editor.alter_unique_together(Fusion, [key_fields], [])
+
+        def add_constraint():
+            with connection.schema_editor() as editor:
+                editor.alter_unique_together(Fusion, [], [key_fields])
+        self.addCleanup(add_constraint)
+
+    def test_merge_duplicate_fusions(self):
+        ''' analyses and list entries should be moved onto the oldest fusion and the duplicates removed '''
+        user = User.objects.create_user('test_user')
+        run_obj = Run.objects.create(run_id='run_1')
+        ws_obj = Worksheet.objects.create(ws_id='ws_1', run=run_obj, assay='TSO500_RNA')
+        sample_obj = SampleAnalysis.objects.create(
+            worksheet=ws_obj, sample=Sample.objects.create(sample_id='sample_1'), panel=Panel.objects.filter(assay='2').first()
+        )
+
+        fusions = [
+            Fusion.objects.create(fusion_genes='EML4-ALK', left_breakpoint='chr2:1', right_breakpoint='chr2:2', genome_build=37)
+            for n in range(3)
+        ]
+        other_fusion = Fusion.objects.create(fusion_genes='EML4-ALK', left_breakpoint='chr2:1', right_breakpoint='chr2:2', genome_build=38)
+        for fusion_obj in fusions[1:] + [other_fusion]:
+            FusionAnalysis.objects.create(sample=sample_obj, fusion_genes=fusion_obj, fusion_supporting_reads=10, ref_reads_1=10, fusion_caller='Fusion')
+        artefact_list = VariantList.objects.create(name='rna_artefacts', list_type='F', genome_build=37, assay='2')
+        VariantToVariantList.objects.create(variant_list=artefact_list, fusion=fusions[2], upload_user=user, check_user=user)
+
+        with contextlib.redirect_stdout(None):
+            call_command('merge_duplicate_fusions')
+
+        self.assertEqual(list(Fusion.objects.order_by('pk')), [fusions[0], other_fusion])
+        self.assertEqual(FusionAnalysis.objects.filter(fusion_genes=fusions[0]).count(), 2)
+        self.assertEqual(FusionAnalysis.objects.filter(fusion_genes=other_fusion).count(), 1)
+        self.assertEqual(VariantToVariantList.objects.get().fusion, fusions[0])
+        self.assertEqual(get_fusion_artefacts(37, '2'), {fusions[0].pk})
+
+
+class TestPanelRegionIndex(TestCase):
+    """
+    Test the in memory index of panel BED regions used to check if variants are on the panel
+    """
+
+    # load in all panels
+    fixtures = ['panels.json']
+
+    def setUp(self):
+        ''' runs before each test '''
+        panel_obj = Panel.objects.get(panel_name='Lung', assay='1', genome_build=37, live=True)
+        self.bed_path = panel_obj.bed_file.path
+        self.panel_regions = PanelRegionIndex.load(self.bed_path)
+
+    def test_index_is_reused(self):
+        ''' loading the same bed file twice should give the same index '''
+        self.assertIs(PanelRegionIndex.load(self.bed_path), self.panel_regions)
+
+    def test_overlaps(self):
+        ''' EGFR region in bed is 7:55241608-55241741 '''
+        self.assertTrue(self.panel_regions.overlaps('7', 55241608, 55241609))
+        self.assertTrue(self.panel_regions.overlaps('7', 55241740, 55241741))
+        self.assertFalse(self.panel_regions.overlaps('7', 55241607, 55241608))
+        self.assertFalse(self.panel_regions.overlaps('7', 55241741, 55241742))
+        self.assertFalse(self.panel_regions.overlaps('86', 55241608, 55241609))
+
+    def test_nearest_distance(self):
+        ''' distance should be to the closest region start or end '''
+        self.assertEqual(self.panel_regions.nearest_distance('7', 55241745, 55241746), 5)
+        self.assertEqual(self.panel_regions.nearest_distance('7', 55241598, 55241599), 10)
+        self.assertEqual(self.panel_regions.nearest_distance('86', 55241745, 55241746), None)
+
+    def test_variant_format_check_position(self):
+        ''' variants should pass if on the panel or within 100bp of it '''
+        variant_check, error = variant_format_check('7', 55241609, 'A', 'T', self.bed_path, 100, 10)
+        self.assertTrue(variant_check)
+
+        variant_check, error = variant_format_check('7', 55241746, 'A', 'T', self.bed_path, 100, 10)
+        self.assertTrue(variant_check)
+
+        variant_check, error = variant_format_check('7', 1, 'A', 'T', self.bed_path, 100, 10)
+        self.assertFalse(variant_check)
+        self.assertEqual(error, 'Genomic coordinates given are not on the panel - Have you used coordinates for the correct genome build?')
+
+
+class TestListFilters(TestCase):
+    """
+    Test that the poly/ artefact list filter is saved with each variant at import and kept up to date as the lists change
+    """
+
+    # load in all panels
+    fixtures = ['panels.json']
+
+    def setUp(self):
+        ''' import a GeneRead CRM sample and make empty poly and artefact lists '''
+        kwargs = {
+            'run': ['run_3'],
+            'worksheet': ['crm_ws_1'],
+            'assay': ['GeneRead_CRM'],
+            'sample': ['crm_test_1'],
+            'panel': ['tumour'],
+            'genome': ['GRCh37'],
+            'debug': ['False'],
+            'snvs': ['analysis/test_data/Database_37/crm_test_1_variants.tsv'],
+            'snv_coverage': ['analysis/test_data/Database_37/crm_test_1_tumour_coverage.json']
+        }
+        # cached list entries arent rolled back between tests so start with an empty cache
+        VariantListCache.clear()
+        self.addCleanup(VariantListCache.clear)
+
+        with contextlib.redirect_stdout(None):
+            call_command('import', **kwargs)
+
+        self.user = User.objects.create_user('test_user')
+        self.poly_list = VariantList.objects.create(name='build_37_polys', list_type='P', genome_build=37)
+        self.artefact_list = VariantList.objects.create(name='crm_artefacts', list_type='A', genome_build=37, assay='4')
+
+        # first variant on the panel, VAF is used to test artefact cutoffs
+        self.variant_panel_analysis = VariantPanelAnalysis.objects.order_by('pk').first()
+        self.variant_obj = self.variant_panel_analysis.variant_instance.variant
+        self.vaf = self.variant_panel_analysis.variant_instance.vaf()
+
+    def add_to_list(self, variant_list, signed_off=True, vaf_cutoff=0.0):
+        ''' add the test variant to a list '''
+        return VariantToVariantList.objects.create(
+            variant_list=variant_list,
+            variant=self.variant_obj,
+            vaf_cutoff=vaf_cutoff,
+            upload_user=self.user,
+            check_user=self.user if signed_off else None,
+        )
+
+    def get_filter(self):
+        ''' reload the list filter of the test variant '''
+        self.variant_panel_analysis.refresh_from_db()
+        return self.variant_panel_analysis.list_filter, self.variant_panel_analysis.list_filter_reason
+
+    def test_get_list_filter(self):
+        ''' polys are always filtered, artefacts only if they're below the VAF cutoff '''
+        vaf = Decimal('20.00')
+        self.assertEqual(get_list_filter(vaf, []), (None, None))
+        self.assertEqual(get_list_filter(vaf, [('P', Decimal('0'))]), ('P', 'Poly'))
+        self.assertEqual(get_list_filter(vaf, [('A', Decimal('0'))]), ('A', 'Artefact'))
+        self.assertEqual(get_list_filter(vaf, [('A', None)]), ('A', 'Artefact'))
+        self.assertEqual(get_list_filter(vaf, [('A', Decimal('30'))]), ('A', 'Artefact at <30% VAF'))
+        self.assertEqual(get_list_filter(vaf, [('A', Decimal('10'))]), (None, None))
+
+    def test_filter_updated_when_list_changes(self):
+        ''' filter should only be set once the list entry is signed off, and removed when it's taken off the list '''
+        self.assertEqual(self.get_filter(), (None, None))
+
+        list_entry = self.add_to_list(self.poly_list, signed_off=False)
+        self.assertEqual(self.get_filter(), (None, None))
+
+        list_entry.check_user = self.user
+        list_entry.save()
+        self.assertEqual(self.get_filter(), ('P', 'Poly'))
+
+        list_entry.delete()
+        self.assertEqual(self.get_filter(), (None, None))
+
+        # artefact lists only apply when the variant is below the VAF cutoff
+        list_entry = self.add_to_list(self.artefact_list, vaf_cutoff=self.vaf + 1)
+        self.assertEqual(self.get_filter()[0], 'A')
+        list_entry.vaf_cutoff = self.vaf - 1
+        list_entry.save()
+        self.assertEqual(self.get_filter(), (None, None))
+
+        # artefact list for a different assay shouldnt apply
+        list_entry.vaf_cutoff = 0
+        list_entry.save()
+        self.assertEqual(self.get_filter(), ('A', 'Artefact'))
+        self.artefact_list.assay = '1'
+        self.artefact_list.save()
+        self.assertEqual(self.get_filter(), (None, None))
+
+    def test_list_saved_without_settings_changes(self):
+        ''' saving a list without changing the type, genome build or assay shouldnt refilter its variants '''
+        self.add_to_list(self.artefact_list)
+        self.assertEqual(self.get_filter(), ('A', 'Artefact'))
+
+        with CaptureQueriesContext(connection) as queries:
+            self.artefact_list.save()
+        self.assertFalse([q for q in queries.captured_queries if 'analysis_variantpanelanalysis' in q['sql']])
+
+        self.artefact_list.genome_build = 38
+        with CaptureQueriesContext(connection) as queries:
+            self.artefact_list.save()
+        self.assertTrue([q for q in queries.captured_queries if 'analysis_variantpanelanalysis' in q['sql']])
+        self.assertEqual(self.get_filter(), (None, None))
+
+    def test_loaddata_skips_list_signals(self):
+        ''' list entries loaded from fixtures shouldnt update filters, as the rest of the fixture might not be loaded '''
+        fixture = [{
+            'model': 'analysis.varianttovariantlist',
+            'pk': 1000,
+            'fields': {'variant_list': self.poly_list.pk, 'variant': self.variant_obj.pk, 'upload_user': self.user.pk, 'check_user': self.user.pk},
+        }]
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+            json.dump(fixture, f)
+            f.flush()
+            call_command('loaddata', f.name, verbosity=0)
+
+        self.assertTrue(VariantToVariantList.objects.filter(pk=1000).exists())
+        self.assertEqual(self.get_filter(), (None, None))
+
+    def test_filter_set_at_import(self):
+        ''' variants already on a list when a sample is imported should be filtered straight away '''
+        self.add_to_list(self.poly_list)
+
+        # reimport as a different sample
+        snvs_file = 'analysis/test_data/Database_37/crm_test_1_variants.tsv'
+        coverage_file = 'analysis/test_data/Database_37/crm_test_1_tumour_coverage.json'
+        panel_obj, genome_build = get_sample_panel('run_3', 'crm_ws_1', 'GeneRead_CRM', 'tumour', 'GRCh37')
+        sample_data = read_sample_files(panel_obj, snvs_file, coverage_file)
+        with contextlib.redirect_stdout(None):
+            sample_analysis_obj = write_sample('run_3', 'crm_ws_1', 'crm_test_2', 'GeneRead_CRM', panel_obj, genome_build, sample_data)
+
+        filtered = VariantPanelAnalysis.objects.filter(sample_analysis=sample_analysis_obj).exclude(list_filter=None)
+        self.assertEqual(filtered.count(), 1)
+        self.assertEqual(filtered.get().variant_instance.variant, self.variant_obj)
+        self.assertEqual(filtered.get().list_filter_reason, 'Poly')
+
+    def test_checks_classified_automatically(self):
+        ''' polys should be classified when signed off, and in any checks made afterwards '''
+        self.add_to_list(self.poly_list)
+        self.assertEqual(self.variant_panel_analysis.get_current_check().decision, 'P')
+
+        sample_obj = self.variant_panel_analysis.sample_analysis
+        make_next_check(sample_obj, 'IGV')
+        current_check = self.variant_panel_analysis.get_current_check()
+        self.assertEqual(current_check.decision, 'P')
+
+        # resetting the check should set it back to poly
+        current_check.decision = 'G'
+        current_check.save()
+        unassign_check(sample_obj)
+        self.assertEqual(self.variant_panel_analysis.get_current_check().decision, 'P')
+
+    def test_get_variant_info_read_only(self):
+        ''' loading the analysis sheet shouldnt save anything '''
+        self.add_to_list(self.poly_list)
+        sample_obj = self.variant_panel_analysis.sample_analysis
+        sample_data = get_sample_info(sample_obj)
+
+        with CaptureQueriesContext(connection) as queries:
+            variant_data = get_variant_info(sample_data, sample_obj)
+
+        self.assertEqual(variant_data['poly_count'], 1)
+        self.assertEqual(variant_data['filtered_calls'][0][1], 'Poly')
+        self.assertEqual(variant_data['filtered_calls'][0][0]['checks'], ['Poly'])
+        for q in queries:
+            self.assertTrue(q['sql'].startswith('SELECT'), q['sql'])
+
+    def test_refresh_list_filters_command(self):
+        ''' command should fill in filters that are missing '''
+        self.add_to_list(self.poly_list)
+        VariantPanelAnalysis.objects.update(list_filter=None, list_filter_reason=None)
+
+        with contextlib.redirect_stdout(None):
+            call_command('refresh_list_filters')
+
+        self.assertEqual(self.get_filter(), ('P', 'Poly'))
+        self.assertEqual(VariantPanelAnalysis.objects.exclude(list_filter=None).count(), 1)
+
+    def test_list_entries_cached(self):
+        ''' list entries should only be loaded once, and reloaded when a list changes '''
+        self.assertEqual(get_variant_list_entries(37, '4'), {})
+        # only the list version is checked once the entries are loaded
+        with self.assertNumQueries(1):
+            get_variant_list_entries(37, '4')
+        with self.assertNumQueries(1):
+            get_fusion_artefacts(37, '4')
+
+        self.add_to_list(self.poly_list)
+        self.assertEqual(list(get_variant_list_entries(37, '4').values()), [[('P', Decimal('0'))]])
+
+        # other assays share the poly list but not the artefact list
+        self.add_to_list(self.artefact_list)
+        self.assertEqual(len(get_variant_list_entries(37, '4')[self.variant_obj.variant]), 2)
+        self.assertEqual(len(get_variant_list_entries(37, '1')[self.variant_obj.variant]), 1)
+
+    def test_list_entries_changed_in_other_process(self):
+        ''' changes saved by another process dont clear this process's cache, but should still be picked up '''
+        list_entry = self.add_to_list(self.poly_list, signed_off=False)
+        self.assertEqual(get_variant_list_entries(37, '4'), {})
+
+        # what another process does when it signs off the entry, without the signal clearing this cache
+        VariantToVariantList.objects.filter(pk=list_entry.pk).update(check_user=self.user)
+        VariantList.objects.filter(pk=self.poly_list.pk).update(updated=timezone.now())
+        self.assertEqual(list(get_variant_list_entries(37, '4').values()), [[('P', Decimal('0'))]])
+
+    def test_get_poly_list_queries(self):
+        ''' poly list page should load annotations for all variants in the same number of queries '''
+        variant_instance = self.variant_panel_analysis.variant_instance
+        self.add_to_list(self.poly_list)
+        with self.assertNumQueries(2):
+            confirmed_list, checking_list = get_poly_list(self.poly_list, self.user)
+        self.assertEqual(len(confirmed_list), 1)
+        self.assertEqual(confirmed_list[0]['gene'], variant_instance.gene)
+        self.assertEqual(confirmed_list[0]['hgvs_c'], variant_instance.hgvs_c)
+
+        for variant_panel_analysis in VariantPanelAnalysis.objects.order_by('pk')[1:]:
+            VariantToVariantList.objects.create(
+                variant_list=self.poly_list, variant=variant_panel_analysis.variant_instance.variant, upload_user=self.user
+            )
+        with self.assertNumQueries(2):
+            confirmed_list, checking_list = get_poly_list(self.poly_list, self.user)
+        self.assertEqual(len(confirmed_list), 1)
+        self.assertEqual(len(checking_list), VariantPanelAnalysis.objects.count() - 1)
+        self.assertFalse(checking_list[0]['able_to_sign_off'])
+
+    def test_variant_list_pages(self):
+        ''' list pages should load one page of entries at a time, filtered and sorted on the server '''
+        self.client.force_login(self.user)
+        checker = User.objects.create_user('checker')
+        variant_instances = [v.variant_instance for v in VariantPanelAnalysis.objects.order_by('pk')]
+        for n, variant_instance in enumerate(variant_instances):
+            VariantToVariantList.objects.create(
+                variant_list=self.poly_list, variant=variant_instance.variant, upload_user=self.user, check_user=checker if n % 2 else None,
+            )
+        confirmed = sorted(v.variant.variant for n, v in enumerate(variant_instances) if n % 2)
+
+        def get_page(**kwargs):
+            params = {'draw': 1, 'start': 0, 'length': 2, 'status': 'confirmed', 'order[0][column]': 0, 'columns[0][data]': 'variant'}
+            params.update(kwargs)
+            return self.client.get(f'/ajax/variant_list/{self.poly_list.name}', params, HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+
+        response = get_page()
+        self.assertEqual((response['recordsTotal'], response['recordsFiltered']), (len(variant_instances), len(confirmed)))
+        self.assertEqual([v['variant'] for v in response['data']], confirmed[:2])
+        self.assertEqual(response['data'][0]['check_user'], 'checker')
+
+        # bad paging parameters fall back to the defaults
+        response = get_page(draw='x', start='', length='abc')
+        self.assertEqual(response['draw'], 0)
+        self.assertEqual(len(response['data']), min(len(confirmed), 10))
+        self.assertEqual(get_page(draw=3)['draw'], 3)
+
+        response = get_page(start=2, **{'order[0][dir]': 'desc'})
+        self.assertEqual([v['variant'] for v in response['data']], confirmed[::-1][2:4])
+
+        # filters
+        variant_instance = variant_instances[1]
+        response = get_page(gene=variant_instance.gene, chrm=f'chr{variant_instance.variant.variant.split(":")[0]}')
+        self.assertIn(variant_instance.variant.variant, [v['variant'] for v in response['data']])
+        self.assertTrue(all(variant_instance.gene in v['gene'] for v in response['data']))
+        self.assertEqual(get_page(check_user='nobody')['recordsFiltered'], 0)
+        self.assertEqual(get_page(status='checking', upload_user='test')['recordsFiltered'], len(variant_instances) - len(confirmed))
+        self.assertEqual(get_page(**{'search[value]': variant_instance.hgvs_c})['data'][0]['variant'], variant_instance.variant.variant)
+
+        # page only loads the entries waiting to be checked
+        response = self.client.get(f'/variant_lists/polys/{self.poly_list.name}')
+        self.assertEqual(len(response.context['checking_list']), len(variant_instances) - len(confirmed))
+        self.assertNotIn('confirmed_list', response.context)
+
+
+class TestAnalysisSheetQueries(TestCase):
+    """
+    Test that loading the analysis sheet doesnt make more database queries for samples with more variants
+    """
+
+    # load in all panels
+    fixtures = ['panels.json']
+
+    def setUp(self):
+        ''' import a GeneRead CRM sample and add a second check with comments '''
+        kwargs = {
+            'run': ['run_3'],
+            'worksheet': ['crm_ws_1'],
+            'assay': ['GeneRead_CRM'],
+            'sample': ['crm_test_1'],
+            'panel': ['tumour'],
+            'genome': ['GRCh37'],
+            'debug': ['False'],
+            'snvs': ['analysis/test_data/Database_37/crm_test_1_variants.tsv'],
+            'snv_coverage': ['analysis/test_data/Database_37/crm_test_1_tumour_coverage.json']
+        }
+        with contextlib.redirect_stdout(None):
+            call_command('import', **kwargs)
+
+        self.sample_obj = SampleAnalysis.objects.get()
+        first_check = Check.objects.get(analysis=self.sample_obj)
+        first_check.user = User.objects.create_user('test_user')
+        first_check.save()
+        UserSettings.objects.create(user=first_check.user, lims_initials='TU')
+        make_next_check(self.sample_obj, '2nd')
+        VariantCheck.objects.filter(check_object=first_check).update(decision='G', comment='test comment', comment_updated=timezone.now())
+
+    def count_queries(self):
+        ''' number of queries used to get the variant info for the sample '''
+        sample_data = get_sample_info(self.sample_obj)
+        with CaptureQueriesContext(connection) as queries:
+            variant_data = get_variant_info(sample_data, self.sample_obj)
+        return len(queries), variant_data
+
+    def test_get_variant_info_queries(self):
+        ''' same number of queries for 11 variants as for 1 '''
+        all_queries, variant_data = self.count_queries()
+        self.assertEqual(len(variant_data['variant_calls']), 11)
+        self.assertEqual(variant_data['variant_calls'][0]['checks'], ['Genuine', 'Pending'])
+        self.assertEqual(variant_data['variant_calls'][0]['comments'][0]['user'].username, 'test_user')
+
+        VariantPanelAnalysis.objects.exclude(pk=VariantPanelAnalysis.objects.order_by('pk').first().pk).delete()
+        one_variant_queries, variant_data = self.count_queries()
+        self.assertEqual(len(variant_data['variant_calls']), 1)
+
+        self.assertEqual(all_queries, one_variant_queries)
+
+    def test_get_coverage_data_queries(self):
+        ''' coverage tab should be loaded in the same queries whatever the number of genes '''
+        depth_cutoffs = self.sample_obj.panel.depth_cutoffs
+        self.assertGreater(GeneCoverageAnalysis.objects.filter(sample=self.sample_obj).count(), 1)
+
+        with self.assertNumQueries(3):
+            gene_coverage_objs = get_coverage_objects(self.sample_obj)
+        with self.assertNumQueries(0):
+            coverage_data = get_coverage_data(self.sample_obj, depth_cutoffs, gene_coverage_objs)
+
+        # same output as loading them separately
+        self.assertEqual(coverage_data, get_coverage_data(self.sample_obj, depth_cutoffs))
+        self.assertEqual(list(coverage_data['regions'].keys()), sorted(coverage_data['regions'].keys()))
+
+    def test_coverage_summary(self):
+        ''' coverage summary should be saved at import and give the same output as working it out from the coverage objects '''
+        coverage_data = get_coverage_data(self.sample_obj, self.sample_obj.panel.depth_cutoffs)
+
+        with self.assertNumQueries(1):
+            coverage_summary = get_coverage_summary(self.sample_obj)
+        self.assertEqual(coverage_summary['coverage_data'], coverage_data)
+        self.assertEqual(coverage_summary['myeloid_coverage_summary'], False)
+
+        # samples imported before summaries were saved should still load, and be filled in by the command
+        CoverageSummary.objects.all().delete()
+        self.assertEqual(get_coverage_summary(self.sample_obj)['coverage_data'], coverage_data)
+        self.assertEqual(CoverageSummary.objects.count(), 0)
+
+        with contextlib.redirect_stdout(None):
+            call_command('save_coverage_summaries')
+        self.assertEqual(CoverageSummary.objects.get().sample, self.sample_obj)
+        self.assertEqual(get_coverage_summary(self.sample_obj)['coverage_data'], coverage_data)
+
+    def test_analysis_sheet_tabs(self):
+        ''' analysis sheet should only load the sample info, each tab is loaded separately when it's opened '''
+        SampleAnalysis.objects.filter(pk=self.sample_obj.pk).update(paperwork_check=True)
+        self.client.force_login(User.objects.get(username='test_user'))
+
+        response = self.client.get(f'/analysis/{self.sample_obj.pk}')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('variant_data', response.context)
+        self.assertNotIn('coverage_data', response.context)
+        self.assertContains(response, f'/ajax/analysis_tab/{self.sample_obj.pk}/snvs')
+
+        tabs = {}
+        for tab in ['details', 'depth', 'snvs', 'report']:
+            response = self.client.get(f'/ajax/analysis_tab/{self.sample_obj.pk}/{tab}', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+            self.assertEqual(response.status_code, 200)
+            tabs[tab] = response.json()['html']
+        self.assertIn('test comment', tabs['snvs'])
+        self.assertIn('TP53', tabs['depth'])
+
+        # fusion tab isnt used by the panel so is empty
+        response = self.client.get(f'/ajax/analysis_tab/{self.sample_obj.pk}/rna', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertNotIn('test comment', response.json()['html'])
+
+        response = self.client.get(f'/ajax/analysis_tab/{self.sample_obj.pk}/unknown', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 404)
+
+        # only the user the check is assigned to can load it
+        self.client.force_login(User.objects.create_user('other_user'))
+        response = self.client.get(f'/ajax/analysis_tab/{self.sample_obj.pk}/snvs', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 403)
+
+    def test_download_run_coverage(self):
+        ''' worksheet coverage download should use the saved coverage summary for each sample '''
+        self.client.force_login(User.objects.get(username='test_user'))
+        coverage_data = get_coverage_summary(self.sample_obj)['coverage_data']
+
+        response = self.client.get('/worksheets/crm_ws_1', {'download-run-coverage': ''})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename=crm_ws_1_coverage.tsv')
+
+        rows = list(csv.reader(response.content.decode().splitlines(), delimiter='\t'))
+        self.assertEqual(rows[0][:3], ['Sample ID', 'Panel', 'Gene'])
+        self.assertEqual([r[2] for r in rows[1:]], list(coverage_data['regions'].keys()))
+        self.assertEqual(rows[1][:2], ['crm_test_1', 'tumour'])
+
+    def assert_check_status(self, expected_status):
+        ''' status worked out in the database should match get_checks '''
+        with self.assertNumQueries(1):
+            sample_obj = SampleAnalysis.objects.with_check_status().get(pk=self.sample_obj.pk)
+
+        checks = sample_obj.get_checks()
+        assigned_to = checks['assigned_to'].pk if checks['assigned_to'] else None
+        self.assertEqual(checks['current_status'], expected_status)
+        self.assertEqual(sample_obj.current_status, expected_status)
+        self.assertEqual(sample_obj.assigned_to_id, assigned_to)
+        self.assertEqual(sample_obj.current_check_id, checks['current_check_object'].pk)
+        self.assertEqual(sample_obj.latest_check_id, checks['all_checks'].last().pk)
+
+    def test_with_check_status(self):
+        ''' sample status should be worked out in one query, for each step of the checking process '''
+        user = User.objects.get(username='test_user')
+        self.assert_check_status('IGV check 1')
+
+        Check.objects.filter(analysis=self.sample_obj, stage='IGV').update(status='C')
+        self.assert_check_status('Complete')
+
+        second_check = Check.objects.create(analysis=self.sample_obj, stage='IGV', status='P', user=user)
+        self.assert_check_status('IGV check 2')
+
+        # one fail needs another check, two fails fails the sample
+        second_check.status = 'F'
+        second_check.save()
+        third_check = Check.objects.create(analysis=self.sample_obj, stage='IGV', status='P')
+        self.assert_check_status('Fail - 2nd check required')
+        third_check.status = 'F'
+        third_check.save()
+        self.assert_check_status('Fail')
+
+        # reopened check that isnt the latest one
+        Check.objects.filter(analysis=self.sample_obj, stage='IGV').update(status='C')
+        Check.objects.filter(pk=second_check.pk).update(status='P')
+        self.assert_check_status('IGV check 2')
+
+    def assert_saved_status(self, expected_status, expected_user):
+        ''' status saved on the sample and worksheet should match the checks '''
+        sample_obj = SampleAnalysis.objects.with_check_status().get(pk=self.sample_obj.pk)
+        self.assertEqual((sample_obj.status, sample_obj.current_status), (expected_status, expected_status))
+        self.assertEqual((sample_obj.assigned_user, sample_obj.assigned_to_id), (expected_user, getattr(expected_user, 'pk', None)))
+        self.assertEqual(sample_obj.worksheet.status, expected_status)
+        self.assertEqual(sample_obj.worksheet.igv_open, 'IGV' in expected_status)
+        return sample_obj
+
+    def test_saved_status(self):
+        ''' status columns should be kept up to date as checks change, and be fixed by the command if they arent '''
+        user = User.objects.get(username='test_user')
+        sample_obj = self.assert_saved_status('IGV check 1', user)
+        self.assertIsNotNone(sample_obj.status_updated)
+
+        unassign_check(sample_obj)
+        sample_obj = self.assert_saved_status('IGV check 1', None)
+
+        reopen_check(user, sample_obj)
+        sample_obj = self.assert_saved_status('IGV check 1', user)
+
+        Check.objects.filter(analysis=self.sample_obj).update(status='C')
+        self.assertEqual(SampleAnalysis.objects.get(pk=self.sample_obj.pk).status, 'IGV check 1')
+        with contextlib.redirect_stdout(None):
+            call_command('refresh_sample_status')
+        sample_obj = self.assert_saved_status('Complete', None)
+
+        # sample failed at the second check
+        Check.objects.filter(pk=sample_obj.get_checks()['current_check_object'].pk).update(status='P')
+        current_check = sample_obj.get_checks()['current_check_object']
+        signoff_check(user, current_check, sample_obj, status='F')
+        make_next_check(sample_obj, 'IGV')
+        self.assert_saved_status('IGV check 2', None)
+
+    def test_get_samples_queries(self):
+        ''' worksheet and user sample lists should be loaded in two queries, with the same statuses as get_checks '''
+        user = User.objects.get(username='test_user')
+        checks = self.sample_obj.get_checks()
+
+        with self.assertNumQueries(2):
+            samples_dict = get_samples(SampleAnalysis.objects.filter(worksheet='crm_ws_1'))
+            panel = samples_dict['crm_test_1']['panels'][0]
+            self.assertEqual(panel['assay'], 'GeneRead CRM')
+            self.assertEqual(panel['checks']['assigned_to'], checks['assigned_to'])
+            self.assertEqual(panel['checks']['current_check_object'].user, user)
+        self.assertEqual(panel['checks']['current_status'], checks['current_status'])
+        self.assertEqual(panel['checks']['current_check_object'], checks['current_check_object'])
+
+        self.client.force_login(user)
+        response = self.client.get(f'/samples/user/{user.pk}')
+        self.assertEqual(list(response.context['samples'].keys()), ['crm_test_1'])
+
+    def test_search_worksheets(self):
+        ''' home page search should match the start of worksheet, run and sample IDs in one query '''
+        self.client.force_login(User.objects.get(username='test_user'))
+        self.assertEqual(get_search_terms('run_3'), {'run_3', '3'})
+
+        def search(term):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/ajax/search_worksheets', {'term': term}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+            self.assertEqual(len([q for q in queries if 'analysis_' in q['sql']]), 1)
+            return response.json()
+
+        self.assertEqual(search('CRM_ws'), [{'ws': 'crm_ws_1', 'run': 'run_3', 'sample': None}])
+        self.assertEqual(search('run_3'), [{'ws': 'crm_ws_1', 'run': 'run_3', 'sample': None}])
+        self.assertEqual(search('crm_test'), [{'ws': 'crm_ws_1', 'run': 'run_3', 'sample': 'crm_test_1'}])
+        self.assertEqual(search('test_1'), [{'ws': 'crm_ws_1', 'run': 'run_3', 'sample': 'crm_test_1'}])
+        self.assertEqual(search('ws_3'), [])
+
+        # search terms for samples imported before they were saved are filled in by the command
+        SearchTerm.objects.all().delete()
+        self.assertEqual(search('crm_test'), [])
+        with contextlib.redirect_stdout(None):
+            call_command('refresh_search_index')
+        self.assertEqual(search('crm_test'), [{'ws': 'crm_ws_1', 'run': 'run_3', 'sample': 'crm_test_1'}])
+
+    def test_all_worksheets_pages(self):
+        ''' all worksheets should be shown a page at a time, with filters applied in the query '''
+        self.client.force_login(User.objects.get(username='test_user'))
+        run_obj = Run.objects.create(run_id='run_4')
+        Worksheet.objects.bulk_create([
+            Worksheet(ws_id=f'training_ws_{n:03d}', run=run_obj, assay='TSO500_DNA', diagnostic=False) for n in range(100)
+        ])
+
+        response = self.client.get('/view_worksheets/all')
+        worksheets = response.context['worksheets']
+        self.assertEqual(len(worksheets), 100)
+        self.assertEqual(worksheets[0], {'worksheet_id': 'crm_ws_1', 'run_id': 'run_3', 'assay': 'GeneRead_CRM', 'status': 'IGV check 1', 'samples': ['crm_test_1']})
+        self.assertEqual(worksheets[1]['worksheet_id'], 'training_ws_099')
+        self.assertEqual(response.context['next_page'], 'after=training_ws_001')
+
+        response = self.client.get('/view_worksheets/all', {'after': 'training_ws_001'})
+        self.assertEqual([w['worksheet_id'] for w in response.context['worksheets']], ['training_ws_000'])
+        self.assertNotIn('next_page', response.context)
+
+        response = self.client.get('/view_worksheets/all', {'assay': 'GeneRead_CRM', 'worksheet_type': 'diagnostic'})
+        self.assertEqual([w['worksheet_id'] for w in response.context['worksheets']], ['crm_ws_1'])
+        response = self.client.get('/view_worksheets/all', {'worksheet_type': 'diagnostic', 'start_date': '2000-01-01', 'end_date': '2000-12-31'})
+        self.assertEqual(response.context['worksheets'], [])
+
+    def test_pending_worksheets(self):
+        ''' pending worksheets should be counted in one query, and drop off once all IGV checks are done '''
+        self.client.force_login(User.objects.get(username='test_user'))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/ajax/get_num_pending', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.json(), {'num_pending': 1, 'css_class': 'warning'})
+        self.assertEqual(len([q for q in queries if 'analysis_' in q['sql']]), 1)
+        response = self.client.get('/view_worksheets/pending')
+        self.assertEqual([w['worksheet_id'] for w in response.context['worksheets']], ['crm_ws_1'])
+
+        Check.objects.filter(analysis=self.sample_obj).update(status='C')
+        update_sample_status([self.sample_obj.pk])
+        response = self.client.get('/ajax/get_num_pending', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.json(), {'num_pending': 0, 'css_class': 'success'})
+        response = self.client.get('/view_worksheets/pending')
+        self.assertEqual(response.context['worksheets'], [])
+
+    def test_update_analysis(self):
+        ''' comments should be saved in one query without reloading the analysis sheet '''
+        self.client.force_login(User.objects.get(username='test_user'))
+        url = f'/ajax/update_analysis/{self.sample_obj.pk}'
+        current_check = Check.objects.get(analysis=self.sample_obj, stage='IGV')
+        variant_check = VariantCheck.objects.filter(check_object=current_check).first()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, {'variant_comment': 'new comment', 'pk': variant_check.pk}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.json()['message'], 'Comment saved')
+        self.assertEqual(len([q for q in queries if 'analysis_' in q['sql']]), 1)
+        variant_check.refresh_from_db()
+        self.assertEqual(variant_check.comment, 'new comment')
+
+        response = self.client.post(url, {'coverage_comment': 'coverage ok', 'ntc_checked': 'on', 'pk': current_check.pk}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertTrue(response.json()['success'])
+        response = self.client.post(url, {'sample_comment': 'sample ok', 'pk': current_check.pk}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertTrue(response.json()['success'])
+        current_check.refresh_from_db()
+        self.assertEqual((current_check.coverage_comment, current_check.coverage_ntc_check), ('coverage ok', True))
+        self.assertEqual((current_check.overall_comment, current_check.patient_info_check), ('sample ok', False))
+
+        # nothing saved if the check is assigned to someone else
+        self.client.force_login(User.objects.create_user('other_user'))
+        response = self.client.post(url, {'variant_comment': 'other comment', 'pk': variant_check.pk}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 403)
+        variant_check.refresh_from_db()
+        self.assertEqual(variant_check.comment, 'new comment')
+
+    def test_update_manual_check(self):
+        ''' manual check should only be saved once the paperwork is checked and every region is ticked '''
+        self.client.force_login(User.objects.get(username='test_user'))
+        url = f'/ajax/update_analysis/{self.sample_obj.pk}'
+        current_check = Check.objects.filter(analysis=self.sample_obj, stage='IGV', status='P').order_by('pk').last()
+        current_check.user = User.objects.get(username='test_user')
+        current_check.save()
+        Panel.objects.filter(pk=self.sample_obj.panel_id).update(manual_review_desc='region 1|region 2')
+
+        response = self.client.post(url, {'variants_checked': '', 'region 1': 'on', 'region 2': 'on'}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(response.json()['success'])
+
+        # form is sent back with errors if a region isnt ticked
+        SampleAnalysis.objects.filter(pk=self.sample_obj.pk).update(paperwork_check=True)
+        response = self.client.post(url, {'variants_checked': '', 'region 1': 'on'}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.json()['success'])
+        self.assertIn('region 2', response.json()['html'])
+        current_check.refresh_from_db()
+        self.assertFalse(current_check.manual_review_check)
+
+        response = self.client.post(url, {'variants_checked': '', 'region 1': 'on', 'region 2': 'on'}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.json()['message'], 'Manual check saved')
+        current_check.refresh_from_db()
+        self.assertTrue(current_check.manual_review_check)
+
+
 class TestDna(TestCase):
     """
     Load in DNA control sample with each virtual panel applied, test that data is as expected
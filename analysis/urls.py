@@ -19,6 +19,8 @@ urlpatterns = [
     path('worksheets/<str:worksheet_id>', views.view_samples, name='view_ws_samples'),
     path('analysis/<str:sample_id>', views.analysis_sheet, name='analysis_sheet'),
     path('ajax/submit_variant_selections/', views.ajax, name='ajax'),
+    path('ajax/analysis_tab/<str:sample_id>/<str:tab>', views.ajax_analysis_tab, name='ajax-analysis-tab'),
+    path('ajax/update_analysis/<str:sample_id>', views.ajax_update_analysis, name='ajax-update-analysis'),
 
     path('samples/user/<str:user_pk>', views.view_samples, name='view_user_samples'),
     path('ajax/get_num_assigned/<str:user_pk>', views.ajax_num_assigned_user, name='ajax-num-assigned'),
@@ -27,5 +29,6 @@ urlpatterns = [
 
     path('variant_lists/polys/<str:list_name>', views.view_polys, name='view_polys'),
     path('variant_lists/artefacts/<str:list_name>', views.view_artefacts, name='view_artefacts'),
-    path('variant_lists/fusion_artefacts/<str:list_name>', views.view_fusion_artefacts, name='view_fusion_artefacts')
+    path('variant_lists/fusion_artefacts/<str:list_name>', views.view_fusion_artefacts, name='view_fusion_artefacts'),
+    path('ajax/variant_list/<str:list_name>', views.ajax_variant_list, name='ajax-variant-list')
 ]
@@ -3,23 +3,40 @@ from .forms import NewVariantForm, SubmitForm, VariantCommentForm, FusionComment
 
 from django.utils import timezone
 from django.db import transaction
+from django.db.models import Q, F, Prefetch, Exists, OuterRef, Count, Max
 
-import pybedtools
+import os
 import re
 import requests
 import csv
+from bisect import bisect_left
 
 def get_samples(samples):
     """
-    Create context dictionary of all sample analyses for rendering the worksheet page
+    Create context dictionary of all sample analyses for rendering the worksheet page. Takes a queryset of
+    sample analyses, statuses are worked out in the same query and then the current checks are loaded in one go
 
     """
+    samples = samples.select_related('sample', 'worksheet', 'panel').with_check_status().order_by('pk')
+
+    # get the current check for each sample along with the user it's assigned to
+    current_check_ids = [s.current_check_id for s in samples]
+    current_checks = Check.objects.select_related('user').in_bulk(current_check_ids)
+
     # adds a record for each panel analysis - i.e. if a sample has two panels
     # it will have two records
     sample_dict = {}
     for s in samples:
         sample_id = s.sample.sample_id
 
+        # same keys as get_checks, only the ones needed by the template
+        current_check_object = current_checks[s.current_check_id]
+        checks = {
+            'current_status': s.current_status,
+            'assigned_to': current_check_object.user if s.pending_check_id else None,
+            'current_check_object': current_check_object,
+        }
+
         # if there haven't been any panels for the sample yet, add new sample to dict
         if sample_id not in sample_dict.keys():
 
@@ -30,7 +47,7 @@ def get_samples(samples):
                     'worksheet': s.worksheet,
                     'assay': s.panel.get_assay_display(),
                     'panel': s.panel,
-                    'checks': s.get_checks(),
+                    'checks': checks,
                 }]
             }
 
@@ -41,13 +58,137 @@ def get_samples(samples):
                     'worksheet': s.worksheet,
                     'assay': s.panel.get_assay_display(),
                     'panel': s.panel,
-                    'checks': s.get_checks(),
+                    'checks': checks,
                 }
             )
 
     return sample_dict
 
 
+def get_worksheets(worksheets):
+    """
+    Create list of worksheets for rendering the worksheets page, with diagnostic worksheets first. Statuses and
+    samples for all of the worksheets are worked out in one query
+
+    """
+    worksheets = list(worksheets)
+
+    # get status and sample ID of all samples on the worksheets, same as get_status_and_samples
+    statuses, samples = {}, {}
+    sample_analyses = SampleAnalysis.objects.filter(worksheet__in=worksheets).with_check_status().order_by('pk')
+    for s in sample_analyses:
+        statuses.setdefault(s.worksheet_id, set()).add(s.current_status)
+        samples.setdefault(s.worksheet_id, []).append(s.sample_id)
+
+    # Two seperate lists so that diagnostics runs appear first
+    diagnostics_ws_list = []
+    other_ws_list = []
+
+    for w in worksheets:
+        ws_dict = {
+            'worksheet_id': w.ws_id,
+            'run_id': w.run_id,
+            'assay': w.assay,
+            'status': ' | '.join(sorted(statuses.get(w.ws_id, []))),
+            'samples': samples.get(w.ws_id, []),
+        }
+        if w.diagnostic:
+            diagnostics_ws_list.append(ws_dict)
+        else:
+            other_ws_list.append(ws_dict)
+
+    return diagnostics_ws_list + other_ws_list
+
+
+def update_sample_status(sample_analysis_ids):
+    """
+    Save the status and assigned user of sample analyses from their checks, and the status of the worksheets
+    that they're on. Call this whenever checks are made or changed. Status is worked out in the database with
+    with_check_status, in chunks so that it can be run on the whole database
+
+    """
+    current_time = timezone.now()
+    worksheet_ids = set()
+
+    sample_analysis_ids = list(sample_analysis_ids)
+    for n in range(0, len(sample_analysis_ids), 500):
+        chunk = sample_analysis_ids[n:n + 500]
+
+        changed = []
+        for s in SampleAnalysis.objects.filter(pk__in=chunk).with_check_status():
+            worksheet_ids.add(s.worksheet_id)
+
+            if s.status != s.current_status or s.assigned_user_id != s.assigned_to_id:
+                s.status = s.current_status
+                s.assigned_user_id = s.assigned_to_id
+                s.status_updated = current_time
+                changed.append(s)
+
+        SampleAnalysis.objects.bulk_update(changed, ['status', 'assigned_user', 'status_updated'])
+
+    # worksheet status is every status of the samples on it, same as get_status_and_samples
+    worksheet_ids = list(worksheet_ids)
+    for n in range(0, len(worksheet_ids), 500):
+        chunk = worksheet_ids[n:n + 500]
+
+        sample_statuses = {}
+        for worksheet_id, status in SampleAnalysis.objects.filter(worksheet_id__in=chunk).values_list('worksheet_id', 'status'):
+            sample_statuses.setdefault(worksheet_id, set()).add(status or '')
+
+        changed = []
+        for w in Worksheet.objects.filter(pk__in=chunk):
+            statuses = sample_statuses.get(w.pk, set())
+            status = ' | '.join(sorted(statuses))
+            igv_open = any('IGV' in s for s in statuses)
+
+            if w.status != status or w.igv_open != igv_open:
+                w.status = status
+                w.igv_open = igv_open
+                changed.append(w)
+
+        Worksheet.objects.bulk_update(changed, ['status', 'igv_open'])
+
+
+def get_search_terms(identifier):
+    """
+    Search terms for a worksheet, run or sample ID, searches are matched on the start of a term so also add everything
+    after each _ or -, e.g. so that a run can be found from its flowcell ID
+
+    """
+    identifier = identifier.lower()
+    terms = {identifier}
+    for m in re.finditer('[_-]', identifier):
+        terms.add(identifier[m.end():])
+
+    terms.discard('')
+    return terms
+
+
+def update_search_index(sample_analyses):
+    """
+    Add search terms for the worksheet, run and sample of a queryset of sample analyses, terms that are
+    already saved are skipped
+
+    """
+    search_terms = set()
+    for worksheet_id, run_id, sample_id in sample_analyses.values_list('worksheet_id', 'worksheet__run_id', 'sample_id'):
+        for term in get_search_terms(worksheet_id) | get_search_terms(run_id):
+            search_terms.add((term, worksheet_id, None))
+        for term in get_search_terms(sample_id):
+            search_terms.add((term, worksheet_id, sample_id))
+
+    # remove terms that are already saved
+    worksheet_ids = list({t[1] for t in search_terms})
+    for n in range(0, len(worksheet_ids), 500):
+        existing_terms = SearchTerm.objects.filter(worksheet_id__in=worksheet_ids[n:n + 500])
+        search_terms -= set(existing_terms.values_list('term', 'worksheet_id', 'sample_id'))
+
+    SearchTerm.objects.bulk_create([
+        SearchTerm(term=term, worksheet_id=worksheet_id, sample_id=sample_id)
+        for term, worksheet_id, sample_id in sorted(search_terms, key=lambda t: (t[1], t[2] or '', t[0]))
+    ], batch_size=500)
+
+
 @transaction.atomic
 def unassign_check(sample_analysis_obj):
     """
@@ -73,23 +214,25 @@ def unassign_check(sample_analysis_obj):
     latest_check.signoff_time = None
     latest_check.save()
     
-    # get dna variant checks and reset
-    variant_checks = VariantCheck.objects.filter(check_object=latest_check)
+    # get dna variant checks and reset, polys and artefacts go back to being classified automatically
+    variant_checks = VariantCheck.objects.filter(check_object=latest_check).select_related('variant_analysis')
     for c in variant_checks:
-        c.decision = '-'
+        c.decision = get_list_decision(c.variant_analysis)
         c.comment = ''
         c.comment_updated = None
         c.save()
 
     # get rna variant checks and reset
-    fusion_checks = FusionCheck.objects.filter(check_object=latest_check)
+    fusion_checks = FusionCheck.objects.filter(check_object=latest_check).select_related('fusion_analysis__fusion_instance')
+    fusion_artefacts = get_fusion_artefacts(sample_analysis_obj.genome_build, sample_analysis_obj.panel.assay)
     for c in fusion_checks:
-        c.decision = '-'
+        c.decision = get_fusion_list_decision(c.fusion_analysis, fusion_artefacts)
         c.comment = ''
         c.comment_updated = None
         c.save()
 
     sample_analysis_obj.save()
+    update_sample_status([sample_analysis_obj.pk])
 
     return True
 
@@ -108,6 +251,7 @@ def reopen_check(current_user, sample_analysis_obj):
     latest_check.user = current_user
     latest_check.save()
     sample_analysis_obj.save()
+    update_sample_status([sample_analysis_obj.pk])
 
     return True
 
@@ -205,6 +349,7 @@ def signoff_check(user, current_step_obj, sample_obj, status='C', complete=False
     
     # save object
     current_step_obj.save()
+    update_sample_status([sample_obj.pk])
 
     return True, ''
 
@@ -225,25 +370,30 @@ def make_next_check(sample_obj, next_step):
     new_check_obj.save()
 
     if sample_obj.panel.show_snvs:
-        # make check objects for all variants
+        # make check objects for all variants, polys and artefacts are classified automatically
         variant_objects = VariantPanelAnalysis.objects.filter(sample_analysis=sample_obj)
         for v in variant_objects:
             new_variant_check = VariantCheck(
                 variant_analysis = v,
                 check_object = new_check_obj,
+                decision = get_list_decision(v),
             )
             new_variant_check.save()
     
     if sample_obj.panel.show_fusions:
-        # make check objects for all variants
-        variant_objects = FusionPanelAnalysis.objects.filter(sample_analysis=sample_obj)
+        # make check objects for all variants, artefacts are classified automatically
+        fusion_artefacts = get_fusion_artefacts(sample_obj.genome_build, sample_obj.panel.assay)
+        variant_objects = FusionPanelAnalysis.objects.filter(sample_analysis=sample_obj).select_related('fusion_instance')
         for v in variant_objects:
             new_variant_check = FusionCheck(
                 fusion_analysis = v,
                 check_object = new_check_obj,
+                decision = get_fusion_list_decision(v, fusion_artefacts),
             )
             new_variant_check.save()
 
+    update_sample_status([sample_obj.pk])
+
     return True
 
 
@@ -322,13 +472,234 @@ def get_sample_info(sample_obj):
     return sample_data
 
 
+class VariantListCache:
+    """
+    Signed off poly/ artefact list entries that apply to each genome build and assay, kept in memory so that
+    they dont need to be looked up for every sample. Each genome build and assay is loaded in one query the
+    first time it's needed
+
+    The cache is cleared when a variant list or list entry is changed (see signals.py). The signals also set
+    the updated time of the list, so changes made in other processes (e.g. web server workers while a worksheet
+    is being imported) are picked up by checking the number of lists and the latest updated time before the
+    cached entries are used
+
+    """
+    # loaded list entries, keyed by genome build and assay - the list version is stored so they can be expired
+    _cache = {}
+
+    @staticmethod
+    def get_version(genome_build):
+        """ number of lists and the last time one of them changed, any change to the lists will change this """
+        version = VariantList.objects.filter(genome_build=genome_build).aggregate(Count('pk'), Max('updated'))
+        return (version['pk__count'], version['updated__max'])
+
+    @classmethod
+    def load(cls, genome_build, assay):
+        """
+        Get the list entries for a genome build and assay, loading them if they arent cached or the lists have
+        changed since they were loaded
+
+        Returns a dictionary with:
+          variants - dictionary of variant (genomic coords): list of tuples of list type and VAF cutoff, for
+                     polys and SNV artefacts, in the order they were added
+          fusion_artefacts - set of pks of fusions that are on a fusion artefact list
+
+        """
+        key = (genome_build, assay)
+        version = cls.get_version(genome_build)
+        cached = cls._cache.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        # polys apply to all assays, artefacts only to the assay of the artefact list
+        list_entries = VariantToVariantList.objects.filter(
+            variant_list__genome_build=genome_build,
+            upload_user__isnull=False,
+            check_user__isnull=False,
+        ).filter(
+            Q(variant_list__list_type='P') | Q(variant_list__list_type__in=['A', 'F'], variant_list__assay=assay)
+        ).order_by('pk').values_list(
+            'variant__variant', 'variant__genome_build', 'fusion_id', 'variant_list__list_type', 'vaf_cutoff'
+        )
+
+        entries = {'variants': {}, 'fusion_artefacts': set()}
+        for variant, variant_genome_build, fusion_id, list_type, vaf_cutoff in list_entries:
+            if list_type in ['P', 'A'] and variant is not None and variant_genome_build == genome_build:
+                entries['variants'].setdefault(variant, []).append((list_type, vaf_cutoff))
+            elif list_type == 'F' and fusion_id is not None:
+                entries['fusion_artefacts'].add(fusion_id)
+
+        cls._cache[key] = (version, entries)
+        return entries
+
+    @classmethod
+    def clear(cls):
+        """ remove all cached list entries, called whenever the lists change """
+        cls._cache = {}
+
+
+def get_variant_list_entries(genome_build, assay):
+    """
+    Get all signed off poly and artefact list entries that apply to samples with this genome build and assay,
+    polys apply to all assays and artefacts only to the assay of the artefact list
+
+    Returns a dictionary of variant: list of tuples of list type and VAF cutoff, in the order they were added
+
+    """
+    return VariantListCache.load(genome_build, assay)['variants']
+
+
+def get_list_filter(vaf, list_entries):
+    """
+    Work out whether a variant should be filtered as a poly or artefact, from the VAF of the variant and the list
+    entries for the variant (from get_variant_list_entries). Artefacts are only filtered if they're below the VAF
+    cutoff of the artefact list entry, or if there is no cutoff
+
+    Returns a tuple of the filter (P, A or None) and the reason shown on the analysis sheet
+
+    """
+    list_filter, filter_reason = None, None
+
+    for list_type, vaf_cutoff in list_entries:
+
+        # if its a poly
+        if list_type == 'P':
+            list_filter = 'P'
+            filter_reason = 'Poly'
+
+        # if its an artefact, only filter if below the VAF cutoff or there is no cutoff
+        elif list_type == 'A':
+            if vaf_cutoff == None or vaf_cutoff == 0.0 or vaf < vaf_cutoff:
+                list_filter = 'A'
+
+                # add VAF cutoff to reason for filtering
+                if vaf_cutoff and vaf < vaf_cutoff:
+                    vaf_cutoff_rounded = vaf_cutoff.quantize(decimal.Decimal('1'), rounding=decimal.ROUND_HALF_UP)
+                    filter_reason = f'Artefact at <{vaf_cutoff_rounded}% VAF'
+                else:
+                    filter_reason = 'Artefact'
+
+    return list_filter, filter_reason
+
+
+def get_list_decision(variant_panel_analysis):
+    """
+    Decision that a new variant check starts with, polys and artefacts are classified automatically
+
+    """
+    if variant_panel_analysis.list_filter in ['P', 'A']:
+        return variant_panel_analysis.list_filter
+    return '-'
+
+
+def get_fusion_artefacts(genome_build, assay):
+    """
+    Get the pks of all fusions on a signed off fusion artefact list for this genome build and assay
+
+    """
+    return VariantListCache.load(genome_build, assay)['fusion_artefacts']
+
+
+def get_fusion_list_decision(fusion_panel_analysis, fusion_artefacts):
+    """
+    Decision that a new fusion check starts with, artefacts (from get_fusion_artefacts) are classified automatically
+
+    """
+    if fusion_panel_analysis.fusion_instance.fusion_genes_id in fusion_artefacts:
+        return 'A'
+    return '-'
+
+
+def apply_fusion_list_decisions(variant_list_entry):
+    """
+    Classify a fusion as an artefact in any checks that are still open once it's signed off on a fusion artefact list
+
+    """
+    variant_list = variant_list_entry.variant_list
+    if variant_list.list_type != 'F' or not variant_list_entry.signed_off():
+        return
+
+    open_checks = FusionCheck.objects.filter(
+        fusion_analysis__fusion_instance__fusion_genes_id=variant_list_entry.fusion_id,
+        fusion_analysis__sample_analysis__genome_build=variant_list.genome_build,
+        fusion_analysis__sample_analysis__panel__assay=variant_list.assay,
+        check_object__status='P',
+    ).exclude(decision='A')
+
+    for c in open_checks:
+        c.decision = 'A'
+        c.save()
+
+
+def update_list_filters(variant_panel_analyses):
+    """
+    Recalculate and save the poly/ artefact list filter for a list of variant panel analysis objects. Any variants
+    that have been newly filtered are classified as polys/ artefacts in checks that are still open
+
+    """
+    # group by genome build and assay as these decide which lists apply
+    groups = {}
+    for v in variant_panel_analyses:
+        key = (v.sample_analysis.genome_build, v.sample_analysis.panel.assay)
+        groups.setdefault(key, []).append(v)
+
+    for (genome_build, assay), group in groups.items():
+        entries = get_variant_list_entries(genome_build, assay)
+
+        newly_filtered = []
+        for v in group:
+            previous_filter = v.list_filter
+            v.list_filter, v.list_filter_reason = get_list_filter(
+                v.variant_instance.vaf(), entries.get(v.variant_instance.variant.variant, [])
+            )
+            if v.list_filter is not None and v.list_filter != previous_filter:
+                newly_filtered.append(v)
+
+        VariantPanelAnalysis.objects.bulk_update(group, ['list_filter', 'list_filter_reason'], batch_size=500)
+
+        # update open checks, in chunks to keep the number of query parameters down
+        for n in range(0, len(newly_filtered), 500):
+            chunk = {v.pk: v for v in newly_filtered[n:n + 500]}
+            open_checks = VariantCheck.objects.filter(variant_analysis_id__in=chunk.keys(), check_object__status='P')
+            for c in open_checks:
+                c.decision = get_list_decision(chunk[c.variant_analysis_id])
+                c.save()
+
+
+def refresh_list_filters(variant_ids):
+    """
+    Update the poly/ artefact list filter of every sample that has any of the variants (list of Variant pks),
+    called whenever a poly/ artefact list changes
+
+    """
+    variant_panel_analyses = VariantPanelAnalysis.objects.select_related(
+        'variant_instance__variant', 'sample_analysis__panel'
+    )
+
+    # look up variants in chunks to keep the number of query parameters down
+    variant_ids = list(variant_ids)
+    for n in range(0, len(variant_ids), 500):
+        update_list_filters(
+            variant_panel_analyses.filter(variant_instance__variant_id__in=variant_ids[n:n + 500])
+        )
+
+
 def get_variant_info(sample_data, sample_obj):
     """
     Get information on all variants in a sample analysis to generate the variant portion of the context dictionary
 
     """
-    # load in all variants in sample
-    sample_variants = VariantPanelAnalysis.objects.filter(sample_analysis=sample_obj)
+    # load in all variants in sample along with their checks and the users who made them, this is a fixed
+    # number of queries however many variants there are
+    sample_variants = VariantPanelAnalysis.objects.filter(sample_analysis=sample_obj).select_related(
+        'variant_instance__variant'
+    ).prefetch_related(
+        Prefetch(
+            'variantcheck_set',
+            queryset=VariantCheck.objects.select_related('check_object__user').order_by('pk'),
+            to_attr='variant_checks',
+        )
+    )
 
     # make empty variables for storing results
     variant_calls = []
@@ -346,54 +717,29 @@ def get_variant_info(sample_data, sample_obj):
         variant_obj = sample_variant.variant_instance.variant
 
         # get checks for each variant
-        variant_checks = VariantCheck.objects.filter(variant_analysis=sample_variant).order_by('pk')
+        variant_checks = sample_variant.variant_checks
         variant_checks_list = [ v.get_decision_display() for v in variant_checks ]
-        latest_check = variant_checks.latest('pk')
+        latest_check = variant_checks[-1]
 
         # marker to tell whether a variant should be filtered downstream
         filter_call = False
         filter_reason = ''
 
-        # get VAF and round to nearest whole number - used in artefact list so must be on top
+        # get VAF and round to nearest whole number
         vaf = sample_variant.variant_instance.vaf()
         vaf_rounded = vaf.quantize(decimal.Decimal('1'), rounding=decimal.ROUND_HALF_UP)
 
-        # get poly/artefact lists relevent to this sample
-        poly_lists = VariantList.objects.filter(genome_build=variant_obj.genome_build, list_type='P')
-        artefact_lists = VariantList.objects.filter(genome_build=variant_obj.genome_build, list_type='A', assay = sample_obj.panel.assay)
-        variant_lists = poly_lists | artefact_lists
-
-        # get whether the variant falls within a poly/ artefact list
-        for l in VariantToVariantList.objects.filter(variant=variant_obj):
-
-            # if signed off and in one of the variant lists for this sample
-            if l.signed_off() and (l.variant_list in variant_lists):
-
-                # if its a poly
-                if l.variant_list.list_type == 'P':
-                    # set variables and update variant check
-                    poly_count += 1
-                    filter_call = True
-                    filter_reason = 'Poly'
-                    latest_check.decision = 'P'
-                    latest_check.save()
-
-                # if its an artefact
-                elif l.variant_list.list_type == 'A':
-                    # only add if above the VAF cutoff or there is no cutoff
-                    if l.vaf_cutoff == None or l.vaf_cutoff == 0.0 or vaf < l.vaf_cutoff:
-                        # set variables and update variant check
-                        artefact_count += 1
-                        filter_call = True
-                        latest_check.decision = 'A'
-                        latest_check.save()
-
-                        # add VAF cutoff to reason for filtering
-                        if vaf < l.vaf_cutoff:
-                            vaf_cutoff_rounded = l.vaf_cutoff.quantize(decimal.Decimal('1'), rounding=decimal.ROUND_HALF_UP)
-                            filter_reason = f'Artefact at <{vaf_cutoff_rounded}% VAF'
-                        else:
-                            filter_reason = 'Artefact'
+        # poly/ artefact list filter is worked out when the sample is imported or the lists change, the checks
+        # are classified automatically at the same time so nothing is saved here
+        if sample_variant.list_filter == 'P':
+            poly_count += 1
+            filter_call = True
+            filter_reason = sample_variant.list_filter_reason
+
+        elif sample_variant.list_filter == 'A':
+            artefact_count += 1
+            filter_call = True
+            filter_reason = sample_variant.list_filter_reason
 
         # remove Not analysed from checks list
         variant_checks_analysed = []
@@ -517,7 +863,20 @@ def get_fusion_info(sample_data, sample_obj):
     Get information on all fusions in a sample analysis to generate the fusion portion of the context dictionary
     """
 
-    fusions = FusionPanelAnalysis.objects.filter(sample_analysis=sample_obj)
+    # load in all fusions in sample along with their checks and the users who made them, this is a fixed
+    # number of queries however many fusions there are
+    fusions = FusionPanelAnalysis.objects.filter(sample_analysis=sample_obj).select_related(
+        'fusion_instance__fusion_genes'
+    ).prefetch_related(
+        Prefetch(
+            'fusioncheck_set',
+            queryset=FusionCheck.objects.select_related('check_object__user').order_by('pk'),
+            to_attr='fusion_checks',
+        )
+    )
+
+    # fusions on signed off artefact lists relevant to this sample
+    fusion_artefacts = get_fusion_artefacts(sample_obj.genome_build, sample_obj.panel.assay)
 
     fusion_calls = []
     reportable_list = []
@@ -528,9 +887,9 @@ def get_fusion_info(sample_data, sample_obj):
     for fusion_object in fusions:
 
         # get checks for each variant
-        fusion_checks = FusionCheck.objects.filter(fusion_analysis=fusion_object).order_by('pk')
+        fusion_checks = fusion_object.fusion_checks
         fusion_checks_list = [ v.get_decision_display() for v in fusion_checks ]
-        latest_check = fusion_checks.latest('pk')
+        latest_check = fusion_checks[-1]
 
         # remove Not analysed from checks list
         fusion_checks_analysed = []
@@ -578,23 +937,11 @@ def get_fusion_info(sample_data, sample_obj):
         else:
             vaf = None
 
-        # get artefact lists relevant to this sample
-        artefact_lists = VariantList.objects.filter(genome_build=sample_obj.genome_build, list_type='F', assay = sample_obj.panel.assay)
-
-        # get fusions in artefact list
-        for fusion_artefact in VariantToVariantList.objects.filter(fusion=fusion_object.fusion_instance.fusion_genes):
-
-            # if signed off and in one of the variant lists for this sample
-            if fusion_artefact.signed_off() and (fusion_artefact.variant_list in artefact_lists):
-
-                # if it's an artefact
-                if fusion_artefact.variant_list.list_type == 'F':
-                    # set variables and update variant check
-                    artefact_count += 1
-                    filter_call = True
-                    latest_check.decision = 'A'
-                    latest_check.save()
-                    filter_reason = 'Artefact'
+        # if it's an artefact, check is classified automatically when it's made so nothing is saved here
+        if fusion_object.fusion_instance.fusion_genes_id in fusion_artefacts:
+            artefact_count += 1
+            filter_call = True
+            filter_reason = 'Artefact'
 
         # combine all into context dict
         fusion_calls_dict = {
@@ -648,9 +995,36 @@ def get_fusion_info(sample_data, sample_obj):
     return fusion_data
 
 
-def get_coverage_data(sample_obj, depth_cutoffs):
+def get_coverage_objects(sample_obj):
+    """
+    Load all gene coverage objects for a sample analysis, along with their regions and gaps. Regions and gaps
+    are loaded for the whole sample in one query each and grouped by gene, rather than queried gene by gene
+
+    Returns a list of GeneCoverageAnalysis objects ordered by gene, each with coverage_regions and
+    coverage_gaps lists added
+
+    """
+    gene_coverage_objs = list(GeneCoverageAnalysis.objects.filter(sample=sample_obj).order_by('gene'))
+
+    regions = {g.pk: [] for g in gene_coverage_objs}
+    for region in RegionCoverageAnalysis.objects.filter(gene__sample=sample_obj).order_by('pk'):
+        regions[region.gene_id].append(region)
+
+    gaps = {g.pk: [] for g in gene_coverage_objs}
+    for gap in GapsAnalysis.objects.filter(gene__sample=sample_obj).order_by('pk'):
+        gaps[gap.gene_id].append(gap)
+
+    for gene_coverage_obj in gene_coverage_objs:
+        gene_coverage_obj.coverage_regions = regions[gene_coverage_obj.pk]
+        gene_coverage_obj.coverage_gaps = gaps[gene_coverage_obj.pk]
+
+    return gene_coverage_objs
+
+
+def get_coverage_data(sample_obj, depth_cutoffs, gene_coverage_objs=None):
     """
-    Get information on the coverage in a sample analysis to generate the coverage portion of the context dictionary
+    Get information on the coverage in a sample analysis to generate the coverage portion of the context dictionary.
+    Coverage objects from get_coverage_objects can be passed in if they've already been loaded
 
     """
     # get list of target depths from panel object
@@ -667,13 +1041,13 @@ def get_coverage_data(sample_obj, depth_cutoffs):
         'regions': {},
         'depth_cutoffs': target_depths,
     }
-    gene_coverage_analysis_obj = GeneCoverageAnalysis.objects.filter(sample=sample_obj).order_by('gene')
+    if gene_coverage_objs is None:
+        gene_coverage_objs = get_coverage_objects(sample_obj)
 
-    for gene_coverage_obj in gene_coverage_analysis_obj:
+    for gene_coverage_obj in gene_coverage_objs:
 
         regions = []
-        coverage_regions_analysis_obj = RegionCoverageAnalysis.objects.filter(gene=gene_coverage_obj)
-        for region in coverage_regions_analysis_obj:
+        for region in gene_coverage_obj.coverage_regions:
             regions_dict = {
                 'hgvs_c': region.hgvs_c,
                 'average_coverage': region.average_coverage,
@@ -691,8 +1065,7 @@ def get_coverage_data(sample_obj, depth_cutoffs):
         # TODO - not a great long term fix, need to update models to handle different depths
         gaps_135, gaps_270, gaps_500, gaps_1000 = [], [], [], []
 
-        gaps_analysis_obj = GapsAnalysis.objects.filter(gene=gene_coverage_obj)
-        for gap in gaps_analysis_obj:
+        for gap in gene_coverage_obj.coverage_gaps:
 
             # error handling for COSMIC numbers as zero evaluates to None
             if gap.percent_cosmic != None or gap.percent_cosmic == 0:
@@ -752,7 +1125,7 @@ def get_coverage_data(sample_obj, depth_cutoffs):
             'gaps_1000': gaps_1000,
         }
 
-        coverage_data['regions'][gene_coverage_obj.gene.gene] = gene_dict
+        coverage_data['regions'][gene_coverage_obj.gene_id] = gene_dict
         coverage_data['gaps_present_135'] = gaps_present_135
         coverage_data['gaps_present_270'] = gaps_present_270
         coverage_data['gaps_present_500'] = gaps_present_500
@@ -761,6 +1134,91 @@ def get_coverage_data(sample_obj, depth_cutoffs):
     return coverage_data
 
 
+def build_coverage_summary(sample_obj):
+    """
+    Work out the coverage tab and myeloid coverage summary for a sample analysis. The depth cutoffs are
+    left out as they come from the panel, these are added in get_coverage_summary
+
+    """
+    gene_coverage_objs = get_coverage_objects(sample_obj)
+
+    coverage_data = get_coverage_data(sample_obj, sample_obj.panel.depth_cutoffs, gene_coverage_objs)
+    coverage_data.pop('depth_cutoffs')
+
+    if sample_obj.panel.show_myeloid_gaps_summary:
+        myeloid_coverage_summary = create_myeloid_coverage_summary(sample_obj, gene_coverage_objs)
+    else:
+        myeloid_coverage_summary = False
+
+    return {
+        'coverage_data': coverage_data,
+        'myeloid_coverage_summary': myeloid_coverage_summary,
+    }
+
+
+def save_coverage_summary(sample_obj):
+    """
+    Work out the coverage summary for a sample analysis and save it, replacing any that's already saved
+
+    """
+    coverage_summary_obj, created = CoverageSummary.objects.get_or_create(sample=sample_obj)
+    coverage_summary_obj.set_summary(build_coverage_summary(sample_obj))
+    coverage_summary_obj.save()
+
+    return coverage_summary_obj
+
+
+def get_coverage_summary(sample_obj):
+    """
+    Get the coverage portion of the context dictionary for a sample analysis from the summary saved at import.
+    If the sample was imported before summaries were saved it's worked out from the coverage objects instead,
+    these can be filled in with the save_coverage_summaries command
+
+    Returns a dictionary with:
+      coverage_data - same output as get_coverage_data
+      myeloid_coverage_summary - same output as create_myeloid_coverage_summary, or False if not a myeloid referral
+
+    """
+    try:
+        coverage_summary = CoverageSummary.objects.get(sample=sample_obj).get_summary()
+    except CoverageSummary.DoesNotExist:
+        coverage_summary = build_coverage_summary(sample_obj)
+
+    coverage_summary['coverage_data']['depth_cutoffs'] = sample_obj.panel.depth_cutoffs.split(',')
+
+    return coverage_summary
+
+
+def get_analysis_sheet_data(sample_obj, sample_data, sections):
+    """
+    Load the data for parts of the analysis sheet, so that each tab only loads what it needs. Sections can be:
+      snvs - variant_data from get_variant_info
+      coverage - coverage_data and myeloid_coverage_summary from get_coverage_summary
+      fusions - fusion_data from get_fusion_info
+
+    Sections that aren't used by the panel are skipped. Returns a dictionary to add to the context dictionary
+
+    """
+    sheet_data = {}
+
+    # SNV workflow
+    if sample_data['panel_obj'].show_snvs == True:
+        if 'snvs' in sections:
+            sheet_data['variant_data'] = get_variant_info(sample_data, sample_obj)
+
+        if 'coverage' in sections:
+            coverage_summary = get_coverage_summary(sample_obj)
+            sheet_data['coverage_data'] = coverage_summary['coverage_data']
+            sheet_data['myeloid_coverage_summary'] = coverage_summary['myeloid_coverage_summary']
+
+    # fusion workflow
+    if sample_data['panel_obj'].show_fusions == True:
+        if 'fusions' in sections:
+            sheet_data['fusion_data'] = get_fusion_info(sample_data, sample_obj)
+
+    return sheet_data
+
+
 def myeloid_add_to_dict(input_dict, anno):
     """
     Create a dictionary from the output in the create_myeloid_coverage_summary function in the 
@@ -866,10 +1324,11 @@ def myeloid_format_output(input_dict):
     return formatted_output
 
 
-def create_myeloid_coverage_summary(sample_obj):
+def create_myeloid_coverage_summary(sample_obj, gene_coverage_objs=None):
     """
     Pull all regions (i.e. exons or hotspots) from all genes and format into a coverage summary sentence
-    for copying into the report
+    for copying into the report. Coverage objects from get_coverage_objects can be passed in if they've
+    already been loaded
 
     """
 
@@ -878,12 +1337,12 @@ def create_myeloid_coverage_summary(sample_obj):
     regions_with_less_270 = {}
 
     # get all gene coverage objects
-    gene_coverage_analysis_obj = GeneCoverageAnalysis.objects.filter(sample=sample_obj)
+    if gene_coverage_objs is None:
+        gene_coverage_objs = get_coverage_objects(sample_obj)
 
     # loop through each region within each gene
-    for gene_coverage_obj in gene_coverage_analysis_obj:
-        coverage_regions_analysis_obj = RegionCoverageAnalysis.objects.filter(gene=gene_coverage_obj)
-        for region_obj in coverage_regions_analysis_obj:
+    for gene_coverage_obj in gene_coverage_objs:
+        for region_obj in gene_coverage_obj.coverage_regions:
 
             # pull out the percent coverage at 270X and HGVS annotations
             cov = region_obj.percent_270x
@@ -909,30 +1368,32 @@ def create_myeloid_coverage_summary(sample_obj):
     return myeloid_coverage_summary
 
 
-def get_poly_list(poly_list_obj, user):
+def format_variant_list_entries(variants):
     """
-    get all polys and split into a list of confirmed polys and 
-    a list of polys that need checking
+    Format a queryset of poly/ artefact list entries for displaying on the list pages
 
     """
-    # get all variant objects from the poly list
-    variants = VariantToVariantList.objects.filter(variant_list=poly_list_obj).order_by("variant__variant")
-
-    # make empty lists before collecting data from loop
-    confirmed_list = []
-    checking_list = []
+    variants = variants.select_related('variant', 'upload_user', 'check_user')
+
+    # get gene info for all variants in one query per 500 variants, only the distinct annotations are needed
+    variant_ids = list({v.variant_id for v in variants})
+    annotations = {}
+    for i in range(0, len(variant_ids), 500):
+        variant_instances = (VariantInstance.objects
+            .filter(variant_id__in=variant_ids[i:i + 500])
+            .values_list('variant_id', 'gene', 'hgvs_c', 'hgvs_p')
+            .distinct()
+        )
+        for variant_id, gene, hgvs_c, hgvs_p in variant_instances:
+            genes, hgvs_cs, hgvs_ps = annotations.setdefault(variant_id, ([], [], []))
+            genes.append(gene)
+            hgvs_cs.append(hgvs_c)
+            hgvs_ps.append(hgvs_p)
 
+    formatted_variants = []
     for n, v in enumerate(variants):
-        # get gene info
-        variant_instances = VariantInstance.objects.filter(variant=v.variant)
-        genes = []
-        hgvs_cs = []
-        hgvs_ps = []
-        for annotation in variant_instances:
-            genes.append(annotation.gene)
-            hgvs_cs.append(annotation.hgvs_c)
-            hgvs_ps.append(annotation.hgvs_p)
-        
+        genes, hgvs_cs, hgvs_ps = annotations.get(v.variant_id, ([], [], []))
+
         # tidy up vaf formatting
         if v.vaf_cutoff == None or v.vaf_cutoff == 0:
             vaf_cutoff = 'N/A'
@@ -940,7 +1401,7 @@ def get_poly_list(poly_list_obj, user):
             vaf_cutoff = str(v.vaf_cutoff.quantize(decimal.Decimal('1'), rounding=decimal.ROUND_HALF_UP)) + '%'
 
         # format variant info info dictionary 
-        formatted_variant = {
+        formatted_variants.append({
             'counter': n,
             'variant_pk': v.id,
             'variant': v.variant.variant,
@@ -955,43 +1416,23 @@ def get_poly_list(poly_list_obj, user):
             'check_user': v.check_user,
             'check_time': v.check_time,
             'check_comment': v.check_comment,
-        }
-
-        # add polys with two checks to the confirmed list
-        if v.signed_off():
-            confirmed_list.append(formatted_variant)
-
-        # otherwise add to the checking list
-        else:
-            # check if the current user is the person who submitted the poly
-            # if it is then disable the button to sign off
-            if user == v.upload_user:
-                formatted_variant['able_to_sign_off'] = False
-            else:
-                formatted_variant['able_to_sign_off'] = True
-
-            # add to checking list
-            checking_list.append(formatted_variant)
+        })
 
-    return confirmed_list, checking_list
+    return formatted_variants
 
 
-def get_fusion_list(artefact_list_obj, user):
+def format_fusion_list_entries(fusions):
     """
-    get all polys and split into a list of confirmed fusion artefacts and a list of fusion artefacts that need checking
+    Format a queryset of fusion artefact list entries for displaying on the list page
 
     """
-    # get all variant objects from the poly list
-    fusions = VariantToVariantList.objects.filter(variant_list=artefact_list_obj).order_by("fusion__left_breakpoint")
-
-    # make empty lists before collecting data from loop
-    confirmed_list = []
-    checking_list = []
+    fusions = fusions.select_related('fusion', 'upload_user', 'check_user')
 
+    formatted_fusions = []
     for n, f in enumerate(fusions):
 
         # format variant info info dictionary 
-        formatted_variant = {
+        formatted_fusions.append({
             'counter': n,
             'variant_pk': f.id,
             'fusion': f.fusion.fusion_genes,
@@ -1004,27 +1445,184 @@ def get_fusion_list(artefact_list_obj, user):
             'check_user': f.check_user,
             'check_time': f.check_time,
             'check_comment': f.check_comment,
-        }
+        })
+
+    return formatted_fusions
 
+
+def format_list_entries(variant_list_obj, entries):
+    """
+    Format list entries with the function for the type of list
+
+    """
+    if variant_list_obj.list_type == 'F':
+        return format_fusion_list_entries(entries)
+    else:
+        return format_variant_list_entries(entries)
+
+
+def split_list_entries(formatted_entries, user):
+    """
+    Split formatted list entries into a list of confirmed entries and a list of entries that need checking
+
+    """
+    # make empty lists before collecting data from loop
+    confirmed_list = []
+    checking_list = []
+
+    for v in formatted_entries:
         # add polys with two checks to the confirmed list
-        if f.signed_off():
-            confirmed_list.append(formatted_variant)
+        if v['upload_user'] != None and v['check_user'] != None:
+            confirmed_list.append(v)
 
         # otherwise add to the checking list
         else:
             # check if the current user is the person who submitted the poly
             # if it is then disable the button to sign off
-            if user == f.upload_user:
-                formatted_variant['able_to_sign_off'] = False
+            if user == v['upload_user']:
+                v['able_to_sign_off'] = False
             else:
-                formatted_variant['able_to_sign_off'] = True
+                v['able_to_sign_off'] = True
 
             # add to checking list
-            checking_list.append(formatted_variant)
+            checking_list.append(v)
 
     return confirmed_list, checking_list
 
 
+def get_poly_list(poly_list_obj, user):
+    """
+    get all polys and split into a list of confirmed polys and 
+    a list of polys that need checking
+
+    """
+    # get all variant objects from the poly list
+    variants = VariantToVariantList.objects.filter(variant_list=poly_list_obj).order_by("variant__variant")
+    return split_list_entries(format_variant_list_entries(variants), user)
+
+
+def get_fusion_list(artefact_list_obj, user):
+    """
+    get all polys and split into a list of confirmed fusion artefacts and a list of fusion artefacts that need checking
+
+    """
+    # get all variant objects from the poly list
+    fusions = VariantToVariantList.objects.filter(variant_list=artefact_list_obj).order_by("fusion__left_breakpoint")
+    return split_list_entries(format_fusion_list_entries(fusions), user)
+
+
+def get_checking_list(variant_list_obj, user):
+    """
+    Get only the list entries that need checking, this is kept small as entries are checked soon after they're added
+
+    """
+    entries = VariantToVariantList.objects.filter(
+        Q(upload_user__isnull=True) | Q(check_user__isnull=True),
+        variant_list=variant_list_obj,
+    )
+    if variant_list_obj.list_type == 'F':
+        entries = entries.order_by('fusion__left_breakpoint')
+    else:
+        entries = entries.order_by('variant__variant')
+
+    confirmed_list, checking_list = split_list_entries(format_list_entries(variant_list_obj, entries), user)
+    return checking_list
+
+
+# columns of the list pages that can be sorted on, and the field that they're sorted by
+LIST_ORDER_FIELDS = {
+    'variant': 'variant__variant',
+    'vaf_cutoff': 'vaf_cutoff',
+    'fusion': 'fusion__fusion_genes',
+    'left_breakpoint': 'fusion__left_breakpoint',
+    'right_breakpoint': 'fusion__right_breakpoint',
+    'upload_time': 'upload_time',
+    'check_time': 'check_time',
+}
+
+
+def filter_list_entries(variant_list_obj, filters):
+    """
+    Filter the entries of a poly/ artefact list in the database. Filters is a dictionary of the filter form
+    values, plus search for the search box on the list page. Blank filters are skipped
+
+    """
+    entries = VariantToVariantList.objects.filter(variant_list=variant_list_obj)
+    fusion_list = variant_list_obj.list_type == 'F'
+
+    # sign off state, confirmed entries have been added and checked by two people
+    if filters.get('status') == 'confirmed':
+        entries = entries.filter(upload_user__isnull=False, check_user__isnull=False)
+    elif filters.get('status') == 'checking':
+        entries = entries.filter(Q(upload_user__isnull=True) | Q(check_user__isnull=True))
+
+    # genes are taken from the fusion, or from the annotations of any instance of the variant
+    gene = filters.get('gene', '').strip()
+    if gene and fusion_list:
+        entries = entries.filter(fusion__fusion_genes__icontains=gene)
+    elif gene:
+        entries = entries.annotate(
+            gene_match=Exists(VariantInstance.objects.filter(variant=OuterRef('variant'), gene__iexact=gene))
+        ).filter(gene_match=True)
+
+    # variants are saved as e.g. 7:140453136A>T and fusion breakpoints as chr7:140453136
+    chrm = re.sub('^chr', '', filters.get('chrm', '').strip(), flags=re.IGNORECASE).upper()
+    if chrm and fusion_list:
+        entries = entries.filter(
+            Q(fusion__left_breakpoint__startswith=f'chr{chrm}:') | Q(fusion__right_breakpoint__startswith=f'chr{chrm}:')
+        )
+    elif chrm:
+        entries = entries.filter(variant__variant__startswith=f'{chrm}:')
+
+    if filters.get('upload_user', '').strip():
+        entries = entries.filter(upload_user__username__icontains=filters['upload_user'].strip())
+    if filters.get('check_user', '').strip():
+        entries = entries.filter(check_user__username__icontains=filters['check_user'].strip())
+
+    # search box matches any part of the variant/ fusion, or the variant annotations
+    search = filters.get('search', '').strip()
+    if search and fusion_list:
+        entries = entries.filter(
+            Q(fusion__fusion_genes__icontains=search) |
+            Q(fusion__left_breakpoint__icontains=search) |
+            Q(fusion__right_breakpoint__icontains=search)
+        )
+    elif search:
+        annotation_matches = VariantInstance.objects.filter(
+            Q(gene__icontains=search) | Q(hgvs_c__icontains=search) | Q(hgvs_p__icontains=search),
+            variant=OuterRef('variant'),
+        )
+        entries = entries.annotate(
+            search_match=Exists(annotation_matches)
+        ).filter(Q(variant__variant__icontains=search) | Q(search_match=True))
+
+    return entries
+
+
+def get_list_page(variant_list_obj, filters, order_by, descending, start, length):
+    """
+    Get one page of list entries for the list pages, filtered and sorted in the database so that only the
+    entries on the page are loaded. Returns the number of entries in the list, the number after filtering
+    and the formatted entries on the page
+
+    """
+    total = VariantToVariantList.objects.filter(variant_list=variant_list_obj).count()
+    entries = filter_list_entries(variant_list_obj, filters)
+    num_filtered = entries.count()
+
+    # sort on the chosen column, or on the variant/ fusion by default. pk keeps the order the same between pages
+    if order_by not in LIST_ORDER_FIELDS:
+        order_by = 'fusion' if variant_list_obj.list_type == 'F' else 'variant'
+    order_field = LIST_ORDER_FIELDS[order_by]
+    if descending:
+        entries = entries.order_by(F(order_field).desc(nulls_last=True), '-pk')
+    else:
+        entries = entries.order_by(F(order_field).asc(nulls_last=True), 'pk')
+
+    page = format_list_entries(variant_list_obj, entries[start:start + length])
+    return total, num_filtered, page
+
+
 def if_nucleotide(string):
     """
     Function to check if nucleotide is a string
@@ -1050,6 +1648,82 @@ def if_chrom(string):
         return False
 
 
+class PanelRegionIndex:
+    """
+    The regions in a panel BED file, held in memory as sorted lists for each chromosome so that
+    variants can be checked against the panel with a binary search rather than a call to bedtools
+    Use PanelRegionIndex.load() to reuse the same index for a BED file within a process
+
+    """
+    # loaded indexes, keyed by BED file path - the modified time is stored so an edited file is reloaded
+    _cache = {}
+
+    def __init__(self, bed_path):
+        regions = {}
+        with open(bed_path) as f:
+            for line in f:
+                # skip blank and header lines
+                if line.strip() == '' or line.startswith(('#', 'track', 'browser')):
+                    continue
+                fields = line.rstrip('\n').split('\t')
+                regions.setdefault(fields[0], []).append((int(fields[1]), int(fields[2])))
+
+        # for each chromosome store:
+        #   starts - region start positions, in order
+        #   max_ends - the furthest end of any region up to and including the matching start
+        #   ends - region end positions, in order
+        self.starts, self.max_ends, self.ends = {}, {}, {}
+        for chrom, chrom_regions in regions.items():
+            chrom_regions.sort()
+            self.starts[chrom] = [start for start, end in chrom_regions]
+            self.ends[chrom] = sorted(end for start, end in chrom_regions)
+
+            max_ends = []
+            for start, end in chrom_regions:
+                max_ends.append(max(end, max_ends[-1]) if max_ends else end)
+            self.max_ends[chrom] = max_ends
+
+    @classmethod
+    def load(cls, bed_path):
+        """
+        Get the index for a BED file, only reading the file if it hasnt been loaded already or has changed
+
+        """
+        modified_time = os.path.getmtime(bed_path)
+        cached = cls._cache.get(bed_path)
+        if cached is None or cached[0] != modified_time:
+            cached = (modified_time, cls(bed_path))
+            cls._cache[bed_path] = cached
+        return cached[1]
+
+    def overlaps(self, chrom, start, end):
+        """
+        Whether the region start-end (BED coordinates) overlaps any region in the panel, same as bedtools intersect
+
+        """
+        starts = self.starts.get(chrom, [])
+
+        # number of panel regions that start before the end of the query, then check if any of them reach past its start
+        i = bisect_left(starts, end)
+        return i > 0 and self.max_ends[chrom][i - 1] > start
+
+    def nearest_distance(self, chrom, start, end):
+        """
+        Smallest distance between the query start and a region start, or between the query end and a region end
+        Returns None if there are no panel regions on the chromosome
+
+        """
+        distances = []
+        for positions, query in [(self.starts.get(chrom, []), start), (self.ends.get(chrom, []), end)]:
+            # the closest positions will be either side of where the query would be inserted
+            i = bisect_left(positions, query)
+            for j in [i - 1, i]:
+                if 0 <= j < len(positions):
+                    distances.append(abs(positions[j] - query))
+
+        return min(distances) if distances else None
+
+
 def variant_format_check(chrm, position, ref, alt, panel_bed_path, total_reads, alt_reads):
     """
     Function to check if format of a manually entered variant is correct
@@ -1063,28 +1737,18 @@ def variant_format_check(chrm, position, ref, alt, panel_bed_path, total_reads,
     
     #Check position is right genome build and panel
     #Get overlap with panel bed to check genome build (check below)
-    panel_bed_file = panel_bed_path
-    panel_bed = pybedtools.BedTool(panel_bed_file)
-    variant_as_bed=f"{chrm}\t{int(position)-1}\t{position}"
-    variant_bed_region = pybedtools.BedTool(variant_as_bed, from_string=True)
-    overlaps_panel = len(panel_bed.intersect(variant_bed_region)) > 0
+    panel_regions = PanelRegionIndex.load(panel_bed_path)
+    variant_start, variant_end = int(position) - 1, int(position)
+    overlaps_panel = panel_regions.overlaps(chrm, variant_start, variant_end)
     
     #If the coordinates are in the wrong genome build - check they overlap with bed (calculated above)
-    if overlaps_panel == 0:
+    if not overlaps_panel:
 
-        #Check to see if the coordinate is an overlapping/intronic variant within a maximum acceptable distance. absolute_distance returns a generator object
+        #Check to see if the coordinate is an overlapping/intronic variant within a maximum acceptable distance
         max_acceptable_distance = 100
-        minimum_distance = max_acceptable_distance + 1 # outside of panel - will fail unless the varaint is close to the bed file
-        for region in panel_bed:
-            if variant_bed_region[0].chrom == region.chrom:
-                distance_downstream = abs(region.start - variant_bed_region[0].start)
-                distance_upstream = abs(region.end - variant_bed_region[0].end)
-                if distance_downstream < minimum_distance:
-                    minimum_distance = distance_downstream
-                if distance_upstream < minimum_distance:
-                    minimum_distance = distance_upstream
-
-        if minimum_distance > max_acceptable_distance:
+        minimum_distance = panel_regions.nearest_distance(chrm, variant_start, variant_end)
+
+        if minimum_distance is None or minimum_distance > max_acceptable_distance:
             
             #Coordinates are not close to any of the BED regions - return error
             return False, 'Genomic coordinates given are not on the panel - Have you used coordinates for the correct genome build?'
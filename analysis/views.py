@@ -4,17 +4,21 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth import authenticate, update_session_auth_hash
 from django.core.exceptions import PermissionDenied, ObjectDoesNotExist
 from django.utils import timezone
-from django.template.loader import get_template
+from django.utils.formats import date_format
+from django.db.models import F, Q
+from django.template.loader import get_template, render_to_string
 from django.template import Context
 from django.shortcuts import get_object_or_404
 
-from .forms import (NewVariantForm, SubmitForm, VariantCommentForm, UpdatePatientName, 
-    CoverageCheckForm, FusionCommentForm, SampleCommentForm, UnassignForm, PaperworkCheckForm, 
+from .forms import (NewVariantForm, SubmitForm, UpdatePatientName, 
+    CoverageCheckForm, SampleCommentForm, UnassignForm, PaperworkCheckForm, 
     ConfirmPolyForm, ConfirmArtefactForm, AddNewPolyForm, AddNewArtefactForm, AddNewFusionArtefactForm, 
-    ManualVariantCheckForm, ReopenForm, ChangeLimsInitials, EditedPasswordChangeForm, EditedUserCreationForm, NewFusionForm,SelfAuditSubmission)
-from .utils import (get_samples, unassign_check, reopen_check, signoff_check, make_next_check, 
-    get_variant_info, get_coverage_data, get_sample_info, get_fusion_info, get_poly_list, get_fusion_list, 
-    create_myeloid_coverage_summary, variant_format_check, breakpoint_format_check, lims_initials_check, validate_variant)
+    ManualVariantCheckForm, ReopenForm, ChangeLimsInitials, EditedPasswordChangeForm, EditedUserCreationForm, NewFusionForm,SelfAuditSubmission,
+    WorksheetFilterForm, VariantListFilterForm)
+from .utils import (get_samples, unassign_check, reopen_check, signoff_check, make_next_check, update_sample_status,
+    get_analysis_sheet_data, get_coverage_summary, get_sample_info, get_worksheets, get_checking_list, get_list_page,
+    variant_format_check, breakpoint_format_check, lims_initials_check, validate_variant,
+    update_list_filters, get_fusion_artefacts, get_fusion_list_decision)
 from .models import *
 
 import csv
@@ -234,13 +238,10 @@ def ajax_num_pending_worksheets(request):
     """
     AJAX call for the number of uncompleted worksheets
     Loaded in the background when the home page is loaded
-    TODO this isnt being called anymore because it might be causing the database to be slow, will test on live database
     """
     if request.is_ajax():
-        # get all worksheets then filter for only ones that have a current IGV check in them
-        all_worksheets = Worksheet.objects.filter(diagnostic=True).order_by('-run')
-        pending_worksheets = [w for w in all_worksheets if 'IGV' in w.get_status_and_samples()[0]]
-        num_pending = len(pending_worksheets)
+        # count diagnostic worksheets that have a current IGV check in them, saved on the worksheet by update_sample_status
+        num_pending = Worksheet.objects.filter(diagnostic=True, igv_open=True).count()
 
         # sort out css colouring, green if no checks, yellow if one or more
         if num_pending == 0:
@@ -262,62 +263,45 @@ def ajax_autocomplete(request):
     Get a list of worksheets for autocompleting the search bar on the home page
     """
     if request.is_ajax():
-        # get search term from ajax
-        query_string = request.GET.get('term', '')
-
-        # list to store results plus counter that will control return of results when max limit is reached
-        results = []
-        counter = 0
+        # get search term from ajax, search terms are saved in lowercase
+        query_string = request.GET.get('term', '').strip().lower()
         max_results = 10
 
-        # use to search for worksheets - limit to max results variable as we'd never return more than that
-        ws_queryset = Worksheet.objects.filter(ws_id__icontains=query_string)[:max_results]
-        run_id_query = Worksheet.objects.filter(run__run_id__icontains=query_string)[:max_results]
+        # match the start of worksheet, run and sample IDs in one query, worksheet/ run matches come before samples
+        matches = (SearchTerm.objects
+            .filter(term__startswith=query_string)
+            .values_list('worksheet_id', 'worksheet__run_id', 'sample_id')
+            .order_by(F('sample_id').asc(nulls_first=True), '-worksheet_id')
+            .distinct()[:max_results]
+        )
 
-        # process query results from worksheet/ run objects
-        for record in ws_queryset | run_id_query:
+        results = []
+        for ws, run, sample in matches:
             results.append({
-                'ws': record.ws_id,
-                'run': record.run.run_id,
-                'sample': None,
+                'ws': ws,
+                'run': run,
+                'sample': sample,
             })
-            counter += 1
-
-            # return as soon as max length reached to speed up query
-            if counter == max_results:
-                data = json.dumps(results)
-                return HttpResponse(data, 'application/json')
-
 
-        # process query results from sample objects - this wil only query if the above returns less then the max query size
-        sample_queryset = Sample.objects.filter(sample_id__icontains=query_string)[:max_results]
-
-        for record in sample_queryset:
-            for ws in record.get_worksheets():
-                results.append({
-                    'ws': ws.ws_id,
-                    'run': ws.run.run_id,
-                    'sample': record.sample_id,
-                })
-                counter += 1
-
-                # return as soon as max length reached to speed up query
-                if counter == max_results:
-                    data = json.dumps(results)
-                    return HttpResponse(data, 'application/json')
-
-
-        # return to template if total number less than max query size
+        # return to template
         data = json.dumps(results)
         return HttpResponse(data, 'application/json')
 
 
+# number of worksheets on each page of the all worksheets view
+WORKSHEETS_PER_PAGE = 100
+
+
 @login_required
 def view_worksheets(request, query):
     """
     Displays all worksheets and links to the page to show all samples 
     within the worksheet
     """
+    context = {
+        'query': query,
+    }
+
     # based on URL, do a different query
     # 30 most recent worksheets
     if query == 'recent':
@@ -331,54 +315,60 @@ def view_worksheets(request, query):
 
     # all diagnostic worksheets with an IGV check still open
     elif query == 'pending':
-        # TODO this will load in all worksheets first, is there a quicker way?
-        all_worksheets = Worksheet.objects.filter(diagnostic=True).order_by('-run')
-
-        # only include worksheets that have a current IGV check in them
-        worksheets = [w for w in all_worksheets if 'IGV' in w.get_status_and_samples()[0]]
+        # only include worksheets that have a current IGV check in them, saved on the worksheet by update_sample_status
+        worksheets = Worksheet.objects.filter(diagnostic=True, igv_open=True).order_by('-run')
         filtered = True
 
-    # all worksheets
+    # all worksheets, one page at a time with diagnostic worksheets first
     elif query == 'all':
-        worksheets = Worksheet.objects.all().order_by('-run')
+        worksheets = Worksheet.objects.order_by('-diagnostic', '-run', '-ws_id')
         filtered = False
 
-    # any other string will be chnaged to most recent, if left blank then it'll throw a 404 error
-    else:
-        return redirect('view_worksheets', 'recent')
+        # apply any filters from the form
+        filter_form = WorksheetFilterForm(request.GET)
+        if filter_form.is_valid():
+            filters = filter_form.cleaned_data
+            if filters['assay']:
+                worksheets = worksheets.filter(assay=filters['assay'])
+            if filters['worksheet_type']:
+                worksheets = worksheets.filter(diagnostic=(filters['worksheet_type'] == 'diagnostic'))
+            if filters['start_date']:
+                worksheets = worksheets.filter(upload_time__date__gte=filters['start_date'])
+            if filters['end_date']:
+                worksheets = worksheets.filter(upload_time__date__lte=filters['end_date'])
+
+        # carry on from the last worksheet of the previous page, rather than using an offset
+        last_ws_id = request.GET.get('after')
+        if last_ws_id:
+            last_ws = get_object_or_404(Worksheet, ws_id=last_ws_id)
+            worksheets = worksheets.filter(
+                Q(diagnostic__lt=last_ws.diagnostic) |
+                Q(diagnostic=last_ws.diagnostic, run__lt=last_ws.run_id) |
+                Q(diagnostic=last_ws.diagnostic, run=last_ws.run_id, ws_id__lt=last_ws.ws_id)
+            )
 
+        # get one extra worksheet to see if there's another page
+        worksheets = list(worksheets[:WORKSHEETS_PER_PAGE + 1])
+        if len(worksheets) > WORKSHEETS_PER_PAGE:
+            worksheets = worksheets[:WORKSHEETS_PER_PAGE]
+            next_page = request.GET.copy()
+            next_page['after'] = worksheets[-1].ws_id
+            context['next_page'] = next_page.urlencode()
 
-    # Two seperate lists so that diagnostics runs appear first
-    diagnostics_ws_list = []
-    other_ws_list = []
-
-    for w in worksheets:
-        # if first two characters are digits, add to diagnostics list, otherwise add to other list
-        status, samples = w.get_status_and_samples()
-        if w.diagnostic:
-            diagnostics_ws_list.append({
-                'worksheet_id': w.ws_id,
-                'run_id': w.run.run_id,
-                'assay': w.assay,
-                'status': status,
-                'samples': samples
-            })
-        else:
-            other_ws_list.append({
-                'worksheet_id': w.ws_id,
-                'run_id': w.run.run_id,
-                'assay': w.assay,
-                'status': status,
-                'samples': samples
-            })
+        # link back to the first page keeps the filters
+        if last_ws_id:
+            first_page = request.GET.copy()
+            del first_page['after']
+            context['first_page'] = first_page.urlencode()
 
-    ws_list = diagnostics_ws_list + other_ws_list
+        context['filter_form'] = filter_form
 
-    context = {
-        'worksheets': ws_list,
-        'filtered': filtered,
-        'query': query,
-    }
+    # any other string will be chnaged to most recent, if left blank then it'll throw a 404 error
+    else:
+        return redirect('view_worksheets', 'recent')
+
+    context['worksheets'] = get_worksheets(worksheets)
+    context['filtered'] = filtered
 
     return render(request, 'analysis/view_worksheets.html', context)
 
@@ -410,7 +400,7 @@ def view_samples(request, worksheet_id=None, user_pk=None):
         # get user object to get list of checks, then get the related samples
         user_obj = get_object_or_404(User, pk=user_pk)
         user_checks = Check.objects.filter(user=user_obj, status='P')
-        samples = [c.analysis for c in user_checks]
+        samples = SampleAnalysis.objects.filter(pk__in=user_checks.values('analysis'))
 
         # get template specific variables needed for context
         context['template'] = 'user'
@@ -468,7 +458,7 @@ def view_samples(request, worksheet_id=None, user_pk=None):
 
                 # only process samples that look at SNVs
                 if sample_data['panel_obj'].show_snvs == True:
-                    coverage_data = get_coverage_data(sample, sample_data['panel_obj'].depth_cutoffs)
+                    coverage_data = get_coverage_summary(sample)['coverage_data']
 
                     # Making sure the sample ID isn't repeated in the csv
                     sample_id_written = False
@@ -550,33 +540,26 @@ def view_samples(request, worksheet_id=None, user_pk=None):
     return render(request, 'analysis/view_samples.html', context)
 
 
-@login_required
-def analysis_sheet(request, sample_id):
-    """
-    Display coverage and variant metrics to allow checking of data 
-    in IGV
+# tabs of the analysis sheet that can be loaded separately, with the template for each tab and the
+# sections of data that it needs (see get_analysis_sheet_data)
+ANALYSIS_SHEET_TABS = {
+    'details': ('analysis/analysis-info.html', []),
+    'depth': ('analysis/analysis-depth.html', ['coverage']),
+    'snvs': ('analysis/analysis-snvs.html', ['snvs']),
+    'rna': ('analysis/analysis-fusions.html', ['fusions']),
+    'report': ('analysis/analysis-report.html', ['snvs', 'coverage', 'fusions']),
+}
+
+
+def get_analysis_sheet_context(sample_data):
     """
-    # load sample object, error if the paperwork check hasnt been done
-    sample_obj = SampleAnalysis.objects.get(pk = sample_id)
-    if sample_obj.paperwork_check == False:
-        raise Http404("Paperwork hasn't been checked")
+    Context dictionary that is common to the whole analysis sheet, data for each tab is added
+    separately with get_analysis_sheet_data
 
-    # load in data that is common to both RNA and DNA workflows
-    sample_data = get_sample_info(sample_obj)
+    """
     current_step_obj = sample_data['checks']['current_check_object']
 
-    # assign to whoever clicked the sample and reload check objects
-    if sample_data['checks']['current_status'] not in ['Complete', 'Fail']:
-        if current_step_obj.user == None:
-            current_step_obj.user = request.user
-            current_step_obj.save()
-            sample_data['checks'] = sample_obj.get_checks()
-
-        if current_step_obj.user != request.user:
-            raise PermissionDenied()
-        
-    # set up context dictionary
-    context = {
+    return {
         'success': [],
         'warning': [],
         'sample_data': sample_data,
@@ -597,23 +580,38 @@ def analysis_sheet(request, sample_id):
         ),
     }
 
-    # pull out coverage summary for myeloid, otherwise return false
-    if sample_data['is_myeloid_referral']:
-        myeloid_coverage_summary = create_myeloid_coverage_summary(sample_obj)
-    else:
-        myeloid_coverage_summary = False
 
-    # SNV workflow
-    if sample_data['panel_obj'].show_snvs == True:
-        context['variant_data'] = get_variant_info(sample_data, sample_obj)
-        context['coverage_data'] = get_coverage_data(sample_obj, sample_data['panel_obj'].depth_cutoffs)
-        context['myeloid_coverage_summary'] = myeloid_coverage_summary
+@login_required
+def analysis_sheet(request, sample_id):
+    """
+    Display coverage and variant metrics to allow checking of data 
+    in IGV. Only the sample info is loaded here, each tab is loaded
+    when it's opened by ajax_analysis_tab
+    """
+    # load sample object, error if the paperwork check hasnt been done
+    sample_obj = SampleAnalysis.objects.get(pk = sample_id)
+    if sample_obj.paperwork_check == False:
+        raise Http404("Paperwork hasn't been checked")
+
+    # load in data that is common to both RNA and DNA workflows
+    sample_data = get_sample_info(sample_obj)
+    current_step_obj = sample_data['checks']['current_check_object']
 
-    # fusion workflow
-    if sample_data['panel_obj'].show_fusions == True:
-        context['fusion_data'] = get_fusion_info(sample_data, sample_obj)
+    # assign to whoever clicked the sample and reload check objects
+    if sample_data['checks']['current_status'] not in ['Complete', 'Fail']:
+        if current_step_obj.user == None:
+            current_step_obj.user = request.user
+            current_step_obj.save()
+            update_sample_status([sample_obj.pk])
+            sample_data['checks'] = sample_obj.get_checks()
 
+        if current_step_obj.user != request.user:
+            raise PermissionDenied()
         
+    # set up context dictionary
+    context = get_analysis_sheet_context(sample_data)
+
+
     ####################################
     #  If any buttons are pressed
     ####################################
@@ -621,6 +619,10 @@ def analysis_sheet(request, sample_id):
     # download PDF reports
     if request.method == 'GET':
 
+        # reports need everything that's in the analysis sheet
+        if 'download-report' in request.GET or 'download-xml' in request.GET:
+            context.update(get_analysis_sheet_data(sample_obj, sample_data, ['snvs', 'coverage', 'fusions']))
+
         if 'download-report' in request.GET:
             filename = f"{context['sample_data']['worksheet_id']}_{context['sample_data']['sample_id']}_{context['sample_data']['panel']}.pdf"
 
@@ -676,76 +678,6 @@ def analysis_sheet(request, sample_id):
                 sample_obj = SampleAnalysis.objects.get(pk = sample_id)
                 context['sample_data'] = get_sample_info(sample_obj)
 
-        # comments submit button
-        if 'variant_comment' in request.POST:
-            new_comment = request.POST['variant_comment']
-            pk = request.POST['pk']
-
-            # update comment
-            VariantCheck.objects.filter(pk=request.POST['pk']).update(
-                comment=new_comment,
-                comment_updated=timezone.now(),
-            )
-
-            # reload variant data
-            context['variant_data'] = get_variant_info(sample_data, sample_obj)
-
-        if 'variants_checked' in request.POST:
-            manual_check_form = ManualVariantCheckForm(request.POST, regions=sample_data['panel_manual_regions'])
-
-            if manual_check_form.is_valid():
-                current_step_obj.manual_review_check = True
-                current_step_obj.save()
-                context['sample_data'] = get_sample_info(current_step_obj.analysis)
-
-        # coverage comments button
-        if 'coverage_comment' in request.POST:
-            new_comment = request.POST['coverage_comment']
-            try:
-                if request.POST['ntc_checked'] == 'on':
-                    ntc_checked = True
-            except:
-                ntc_checked = False
-            pk = request.POST['pk']
-
-            # update comment
-            Check.objects.filter(pk=request.POST['pk']).update(
-                coverage_comment=new_comment,
-                coverage_comment_updated=timezone.now(),
-                coverage_ntc_check=ntc_checked,
-            )
-
-            # reload sample data
-            context['sample_data'] = get_sample_info(sample_obj)
-            current_step_obj = context['sample_data']['checks']['current_check_object']
-            context['coverage_check_form'] = CoverageCheckForm(
-                pk=current_step_obj.pk, 
-                comment=current_step_obj.coverage_comment,
-                ntc_check=current_step_obj.coverage_ntc_check,
-            )
-
-        # fusion comments submit button
-        if 'fusion_comment' in request.POST:
-            new_comment = request.POST['fusion_comment']
-            hgvs = request.POST['hgvs']
-            pk = request.POST['pk']
-
-            # update comment
-            fusion_check_obj = FusionCheck.objects.get(pk=request.POST['pk'])
-            fusion_check_obj.comment=request.POST['fusion_comment']
-            fusion_check_obj.comment_updated=timezone.now()
-
-            # update fusion HGVS
-            fusion_instance = fusion_check_obj.fusion_analysis.fusion_instance
-            fusion_instance.hgvs = hgvs
-
-            # save objects to database
-            fusion_check_obj.save()
-            fusion_instance.save()
-            
-            # reload variant data
-            context['fusion_data'] = get_fusion_info(sample_data, sample_obj)
-
 
         # if add new variant form is clicked
         if 'chrm' in request.POST:
@@ -796,6 +728,9 @@ def analysis_sheet(request, sample_id):
                     )
                     new_variant_check_object.save()
 
+                    # check poly/ artefact lists, this will also classify the check if the variant is on one
+                    update_list_filters([new_variant_panel_object])
+
                     # redirect to same page (if you just reload comtext then form will be resubmitted on refresh)
                     return redirect('analysis_sheet', sample_id)
 
@@ -856,41 +791,17 @@ def analysis_sheet(request, sample_id):
                     # Create new FusionCheck object
                     new_fusion_check_object = FusionCheck(
                         fusion_analysis=new_fusion_panel_analysis_object,
-                        check_object=sample_obj.get_checks().get('current_check_object')
+                        check_object=sample_obj.get_checks().get('current_check_object'),
+                        decision=get_fusion_list_decision(
+                            new_fusion_panel_analysis_object,
+                            get_fusion_artefacts(sample_obj.genome_build, sample_obj.panel.assay),
+                        ),
                     )
                     new_fusion_check_object.save()
 
                     # redirect to same page (if you just reload comtext then form will be resubmitted on refresh)
                     return redirect('analysis_sheet', sample_id)
 
-        # overall sample comments form
-        if 'sample_comment' in request.POST:
-            new_comment = request.POST['sample_comment']
-            try:
-                if request.POST['patient_demographics'] == 'on':
-                    info_check = True
-            except:
-                info_check = False
-            pk = request.POST['pk']
-
-            # update comment
-            Check.objects.filter(pk=pk).update(
-                overall_comment=new_comment,
-                overall_comment_updated=timezone.now(),
-                patient_info_check=info_check,
-            )
-
-            # reload sample data
-            context['sample_data'] = get_sample_info(sample_obj)
-            current_step_obj = context['sample_data']['checks']['current_check_object']
-            context['sample_comment_form'] = SampleCommentForm(
-                comment=current_step_obj.overall_comment,
-                info_check=current_step_obj.patient_info_check,
-                pk=current_step_obj.pk, 
-            )
-
-
-
         # if finalise check submit form is clicked
         if 'next_step' in request.POST:
             submit_form = SubmitForm(request.POST)
@@ -932,14 +843,15 @@ def analysis_sheet(request, sample_id):
                             non_matching_variants = []
 
                             # check for variants/fusions with disagreeing checks
+                            sheet_data = get_analysis_sheet_data(sample_obj, sample_data, ['snvs', 'fusions'])
                             if sample_data['panel_obj'].show_snvs == True:
-                                for variant in context['variant_data']['variant_calls']:
+                                for variant in sheet_data['variant_data']['variant_calls']:
                                     if not variant['latest_checks_agree']:
                                         variants_match = False
                                         non_matching_variants.append(variant['genomic'])
 
                             if sample_data['panel_obj'].show_fusions == True:
-                                for fusion in context['fusion_data']['fusion_calls']:
+                                for fusion in sheet_data['fusion_data']['fusion_calls']:
                                     if not fusion['latest_checks_agree']:
                                         variants_match = False
                                         non_matching_variants.append(fusion['fusion_genes'])
@@ -989,6 +901,152 @@ def analysis_sheet(request, sample_id):
     return render(request, 'analysis/analysis_sheet.html', context)
 
 
+@login_required
+def ajax_analysis_tab(request, sample_id, tab):
+    """
+    AJAX call for the contents of one tab of the analysis sheet
+    Loaded in the background the first time the tab is opened
+    """
+    if request.is_ajax():
+        if tab not in ANALYSIS_SHEET_TABS:
+            raise Http404(f'{tab} is not a tab of the analysis sheet')
+
+        # same checks as the analysis sheet, the check will have been assigned when the analysis sheet was loaded
+        sample_obj = get_object_or_404(SampleAnalysis, pk=sample_id)
+        if sample_obj.paperwork_check == False:
+            raise Http404("Paperwork hasn't been checked")
+
+        sample_data = get_sample_info(sample_obj)
+        if sample_data['checks']['current_status'] not in ['Complete', 'Fail']:
+            if sample_data['checks']['current_check_object'].user != request.user:
+                raise PermissionDenied()
+
+        # only load the data that's needed for this tab
+        template, sections = ANALYSIS_SHEET_TABS[tab]
+        context = get_analysis_sheet_context(sample_data)
+        context.update(get_analysis_sheet_data(sample_obj, sample_data, sections))
+
+        # return as json object
+        out_dict = {
+            'html': render_to_string(template, context, request=request),
+        }
+
+        return JsonResponse(out_dict)
+
+
+@login_required
+def ajax_update_analysis(request, sample_id):
+    """
+    AJAX call for the comment and checkbox forms on the analysis sheet
+    Only the changed row is saved and a message is returned, rather than reloading the whole analysis sheet.
+    Checks can only be changed by the user they're assigned to while they're still open
+    """
+    if request.is_ajax() and request.method == 'POST':
+        current_time = timezone.now()
+        html = None
+
+        # SNV comments
+        if 'variant_comment' in request.POST:
+            updated = VariantCheck.objects.filter(
+                pk=request.POST['pk'],
+                variant_analysis__sample_analysis_id=sample_id,
+                check_object__user=request.user,
+                check_object__status='P',
+            ).update(
+                comment=request.POST['variant_comment'],
+                comment_updated=current_time,
+            )
+            message = 'Comment saved'
+
+        # coverage comment and NTC check
+        elif 'coverage_comment' in request.POST:
+            updated = Check.objects.filter(pk=request.POST['pk'], analysis_id=sample_id, user=request.user, status='P').update(
+                coverage_comment=request.POST['coverage_comment'],
+                coverage_comment_updated=current_time,
+                coverage_ntc_check=request.POST.get('ntc_checked') == 'on',
+            )
+            message = 'Coverage check saved'
+
+        # overall sample comment and patient info check
+        elif 'sample_comment' in request.POST:
+            updated = Check.objects.filter(pk=request.POST['pk'], analysis_id=sample_id, user=request.user, status='P').update(
+                overall_comment=request.POST['sample_comment'],
+                overall_comment_updated=current_time,
+                patient_info_check=request.POST.get('patient_demographics') == 'on',
+            )
+            message = 'Sample comment saved'
+
+        # fusion comments and HGVS, saved as objects so that the changes are in the audit log
+        elif 'fusion_comment' in request.POST:
+            fusion_check_obj = FusionCheck.objects.select_related('fusion_analysis__fusion_instance').filter(
+                pk=request.POST['pk'],
+                fusion_analysis__sample_analysis_id=sample_id,
+                check_object__user=request.user,
+                check_object__status='P',
+            ).first()
+
+            updated = fusion_check_obj is not None
+            if updated:
+                fusion_check_obj.comment = request.POST['fusion_comment']
+                fusion_check_obj.comment_updated = current_time
+                fusion_check_obj.save()
+
+                fusion_instance = fusion_check_obj.fusion_analysis.fusion_instance
+                fusion_instance.hgvs = request.POST['hgvs']
+                fusion_instance.save()
+            message = 'Comment saved'
+
+        # manual review of regions in IGV, returns the updated manual review box
+        elif 'variants_checked' in request.POST:
+            current_step_obj = Check.objects.filter(analysis_id=sample_id, stage='IGV', status='P').select_related(
+                'analysis__panel'
+            ).order_by('pk').last()
+
+            updated = current_step_obj is not None and current_step_obj.user == request.user
+            if updated:
+                # same as the analysis sheet, nothing can be checked until the paperwork has been checked
+                if current_step_obj.analysis.paperwork_check == False:
+                    return JsonResponse({'success': False, 'message': "Not saved - paperwork hasn't been checked"}, status=403)
+
+                panel_obj = current_step_obj.analysis.panel
+                regions = panel_obj.manual_review_desc.split('|') if panel_obj.manual_review_desc else []
+                manual_check_form = ManualVariantCheckForm(request.POST, regions=regions)
+
+                form_valid = manual_check_form.is_valid()
+                if form_valid:
+                    current_step_obj.manual_review_check = True
+                    current_step_obj.save()
+
+                html = render_to_string('analysis/analysis-manual-check.html', {
+                    'sample_data': {
+                        'panel_manual_regions': regions,
+                        'checks': {'current_check_object': current_step_obj},
+                    },
+                    'manual_check_form': manual_check_form,
+                }, request=request)
+
+                # send the form back with the errors if any regions werent ticked
+                if not form_valid:
+                    return JsonResponse({'success': False, 'message': 'Not saved - all regions need to be checked', 'html': html}, status=400)
+            message = 'Manual check saved'
+
+        else:
+            raise Http404('Unknown form')
+
+        # nothing is changed if the check isnt open or isnt assigned to the user
+        if not updated:
+            return JsonResponse({'success': False, 'message': 'Not saved - this check is not assigned to you'}, status=403)
+
+        # return as json object
+        out_dict = {
+            'success': True,
+            'message': message,
+            'html': html,
+        }
+
+        return JsonResponse(out_dict)
+
+
 def ajax(request):
     """
     Handles the submission of the genuine/ artefact etc dropdown box
@@ -1030,9 +1088,8 @@ def view_polys(request, list_name):
     Page to view all confirmed polys and add and check new ones
 
     """
-    # get poly list and pull out list of confirmed polys and polys to be checked
+    # get poly list, confirmed polys are loaded a page at a time by ajax_variant_list
     poly_list = VariantList.objects.get(name=list_name, list_type='P')
-    confirmed_list, checking_list = get_poly_list(poly_list, request.user)
 
     # set genome build
     genome = poly_list.genome_build
@@ -1043,8 +1100,7 @@ def view_polys(request, list_name):
         'warning': [],
         'list_name': list_name,
         'genome_build': genome,
-        'confirmed_list': confirmed_list,
-        'checking_list': checking_list,
+        'filter_form': VariantListFilterForm(),
         'confirm_form': ConfirmPolyForm(),
         'add_new_form': AddNewPolyForm(),
     }
@@ -1074,10 +1130,6 @@ def view_polys(request, list_name):
                 variant_obj = variant_to_variant_list_obj.variant
                 variant = variant_obj.variant
 
-                # reload context
-                confirmed_list, checking_list = get_poly_list(poly_list, request.user)
-                context['confirmed_list'] = confirmed_list
-                context['checking_list'] = checking_list
                 context['success'].append(f'Variant {variant} added to poly list')
 
         # if add new poly button is pressed
@@ -1122,10 +1174,8 @@ def view_polys(request, list_name):
                     else:
                         context['warning'].append(f'Variant {variant} is already in the poly list')
 
-                    # reload context
-                    confirmed_list, checking_list = get_poly_list(poly_list, request.user)
-                    context['confirmed_list'] = confirmed_list
-                    context['checking_list'] = checking_list
+    # only the polys waiting to be checked are loaded with the page, after any changes have been saved
+    context['checking_list'] = get_checking_list(poly_list, request.user)
 
     # render the page
     return render(request, 'analysis/view_polys.html', context)
@@ -1137,9 +1187,8 @@ def view_artefacts(request, list_name):
     Page to view all confirmed artefacts and add and check new ones
 
     """
-    # get artefact list and pull out list of confirmed polys and polys to be checked
+    # get artefact list, confirmed artefacts are loaded a page at a time by ajax_variant_list
     artefact_list = VariantList.objects.get(name=list_name, list_type='A')
-    confirmed_list, checking_list = get_poly_list(artefact_list, request.user)
 
     # set genome build
     genome = artefact_list.genome_build
@@ -1157,8 +1206,7 @@ def view_artefacts(request, list_name):
         'genome_build': genome,
         'build_tag': build_tag,
         'assay': assay,
-        'confirmed_list': confirmed_list,
-        'checking_list': checking_list,
+        'filter_form': VariantListFilterForm(),
         'confirm_form': ConfirmArtefactForm(),
         'add_new_form': AddNewArtefactForm(),
     }
@@ -1188,10 +1236,6 @@ def view_artefacts(request, list_name):
                 variant_obj = variant_to_variant_list_obj.variant
                 variant = variant_obj.variant
 
-                # reload context
-                confirmed_list, checking_list = get_poly_list(artefact_list, request.user)
-                context['confirmed_list'] = confirmed_list
-                context['checking_list'] = checking_list
                 context['success'].append(f'Variant {variant} added to artefact list')
 
         # if add new artefact button is pressed
@@ -1214,7 +1258,7 @@ def view_artefacts(request, list_name):
                 if validation_error:
                     context['warning'].append(f'{validation_error}')
                 else:
-
+                    variant = chrm + ':' + str(position) + ref + '>' + alt
 
                     # load in variant and variant to list objects
                     variant_obj, _ = Variant.objects.get_or_create(variant=variant, genome_build=genome)
@@ -1238,10 +1282,8 @@ def view_artefacts(request, list_name):
                     else:
                         context['warning'].append(f'Variant {variant} is already in the artefact list')
 
-                    # reload context
-                    confirmed_list, checking_list = get_poly_list(artefact_list, request.user)
-                    context['confirmed_list'] = confirmed_list
-                    context['checking_list'] = checking_list
+    # only the artefacts waiting to be checked are loaded with the page, after any changes have been saved
+    context['checking_list'] = get_checking_list(artefact_list, request.user)
 
     # render the page
     return render(request, 'analysis/view_artefacts.html', context)
@@ -1253,9 +1295,8 @@ def view_fusion_artefacts(request, list_name):
     Page to view all confirmed artefacts and add and check new ones
 
     """
-    # get artefact list and pull out list of confirmed polys and polys to be checked
+    # get artefact list, confirmed artefacts are loaded a page at a time by ajax_variant_list
     artefact_list = VariantList.objects.get(name=list_name, list_type='F')
-    confirmed_list, checking_list = get_fusion_list(artefact_list, request.user)
 
     # set genome build
     genome = artefact_list.genome_build
@@ -1273,8 +1314,7 @@ def view_fusion_artefacts(request, list_name):
         'genome_build': genome,
         'build_tag': build_tag,
         'assay': assay,
-        'confirmed_list': confirmed_list,
-        'checking_list': checking_list,
+        'filter_form': VariantListFilterForm(),
         'confirm_form': ConfirmArtefactForm(),
         'add_new_form': AddNewFusionArtefactForm(),
     }
@@ -1304,10 +1344,6 @@ def view_fusion_artefacts(request, list_name):
                 fusion_obj = variant_to_variant_list_obj.fusion
                 fusion = fusion_obj.fusion_genes
 
-                # reload context
-                confirmed_list, checking_list = get_fusion_list(artefact_list, request.user)
-                context['confirmed_list'] = confirmed_list
-                context['checking_list'] = checking_list
                 context['success'].append(f'Fusion {fusion} added to artefact list')
 
         # if add new artefact button is pressed
@@ -1347,18 +1383,72 @@ def view_fusion_artefacts(request, list_name):
                     else:
                         context['warning'].append(f'Fusion {fusion} is already in the artefact list')
 
-                    # reload context
-                    confirmed_list, checking_list = get_fusion_list(artefact_list, request.user)
-                    context['confirmed_list'] = confirmed_list
-                    context['checking_list'] = checking_list
-
                 # throw error if there isnt a variant matching the input
                 except Fusion.DoesNotExist:
                     context['warning'].append(f'Cannot find fusion, have you entered the correct breakpoints?')
 
+    # only the artefacts waiting to be checked are loaded with the page, after any changes have been saved
+    context['checking_list'] = get_checking_list(artefact_list, request.user)
+
     # render the page
     return render(request, 'analysis/view_fusion_artefacts.html', context)
 
+# most list entries that can be loaded on one page of the list pages
+MAX_LIST_PAGE_LENGTH = 100
+
+
+@login_required
+def ajax_variant_list(request, list_name):
+    """
+    AJAX call for one page of a poly/ artefact list, in the format used by DataTables server-side processing
+    Filtering, sorting and paging are all done in the database so that only the entries on the page are loaded
+    """
+    if request.is_ajax():
+        variant_list_obj = get_object_or_404(VariantList, name=list_name)
+
+        # filters from the filter form, plus the DataTables search box
+        filter_form = VariantListFilterForm(request.GET)
+        filters = filter_form.cleaned_data if filter_form.is_valid() else {'status': 'confirmed'}
+        filters['search'] = request.GET.get('search[value]', '')
+
+        # sorted column, DataTables sends the index of the column so get the name from the column settings
+        order_column = request.GET.get('order[0][column]', '')
+        order_by = request.GET.get(f'columns[{order_column}][data]', '')
+        descending = request.GET.get('order[0][dir]') == 'desc'
+
+        # which page to load
+        try:
+            start = max(int(request.GET.get('start', 0)), 0)
+            length = min(max(int(request.GET.get('length', 10)), 1), MAX_LIST_PAGE_LENGTH)
+        except (ValueError, TypeError):
+            start, length = 0, 10
+
+        # counter that DataTables uses to match up responses to requests, echoed back as an integer
+        try:
+            draw = int(request.GET.get('draw', 0))
+        except (ValueError, TypeError):
+            draw = 0
+
+        total, num_filtered, page = get_list_page(variant_list_obj, filters, order_by, descending, start, length)
+
+        # users and times are formatted the same as in the templates
+        for v in page:
+            for field in ['upload_user', 'check_user']:
+                v[field] = str(v[field]) if v[field] else ''
+            for field in ['upload_time', 'check_time']:
+                v[field] = date_format(timezone.localtime(v[field]), 'DATETIME_FORMAT') if v[field] else ''
+
+        # return as json object
+        out_dict = {
+            'draw': draw,
+            'recordsTotal': total,
+            'recordsFiltered': num_filtered,
+            'data': page,
+        }
+
+        return JsonResponse(out_dict)
+
+
 @login_required
 def options_page(request):
     """